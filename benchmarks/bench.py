@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+EasyCopy Benchmarks
+Load-tests the server's upload/download hot paths, either in-process (ASGI,
+no network) or under uvicorn with several workers, and compares the results
+with a saved baseline so regressions are caught
+"""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+import httpx
+
+SERVER_DIR = Path(__file__).resolve().parent.parent / "server"
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+ENDPOINTS = ("upload", "upload-raw", "download", "status", "download-file", "download-image")
+# Content type stored before each endpoint is measured (uploads measure every type)
+ENDPOINT_TYPES = {
+    "upload": ("text", "file", "image"),
+    "upload-raw": ("text", "file", "image"),
+    "download": ("text", "file", "image"),
+    "status": ("text", "image"),
+    "download-file": ("file",),
+    "download-image": ("image",),
+}
+
+DEFAULT_SIZES = "1K,64K,1M,16M"
+DEFAULT_CONCURRENCY = "1,8,32"
+DEFAULT_REQUESTS = 200
+# Fewer requests for big payloads: each scenario moves at most this many bytes
+BYTES_PER_SCENARIO = 1024 ** 3
+MIN_REQUESTS = 5
+# Untimed requests before each read scenario (first-request caches such as thumbnails)
+WARMUP_REQUESTS = 3
+
+# The server runs without its upload limits: rate limiting and in-flight
+# admission would measure the limiter rather than the hot paths, and the JSON
+# body limit would refuse the larger /upload payloads
+SERVER_ENV = {"EASYCOPY_UPLOAD_RATE": "0", "EASYCOPY_MAX_INFLIGHT_BYTES": "0", "EASYCOPY_MAX_JSON_BYTES": "0"}
+
+# A metric is a regression if it is this much worse than the baseline
+DEFAULT_TOLERANCE = 0.2
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+def parse_size(value):
+    """'64K' -> 65536 (suffixes K, M, G are powers of 1024)"""
+    value = value.strip().upper()
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def format_size(size):
+    for unit, factor in (("G", 1024 ** 3), ("M", 1024 ** 2), ("K", 1024)):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return str(size)
+
+
+def make_payload(content_type, size):
+    """
+    Raw bytes of a clipboard payload: compressible text, a PNG of random
+    pixels (about size bytes, as noise barely compresses) or random bytes
+    """
+    if content_type == "text":
+        return os.urandom(size // 2 + 1).hex()[:size].encode("ascii")
+    if content_type == "image":
+        from PIL import Image
+
+        side = max(1, math.isqrt(size // 3))
+        output = io.BytesIO()
+        Image.frombytes("RGB", (side, side), os.urandom(side * side * 3)).save(output, "PNG")
+        return output.getvalue()
+    return os.urandom(size)
+
+
+def upload_request(endpoint, content_type, raw):
+    """(method, path, kwargs) uploading raw through /upload (JSON) or /upload/raw"""
+    metadata = {"filename": "bench.bin", "mime_type": "application/octet-stream", "size": len(raw)}
+    if content_type == "image":
+        metadata = {"format": "PNG", "size": len(raw)}
+    if endpoint == "upload-raw":
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "X-EasyCopy-Type": content_type,
+            "X-EasyCopy-Metadata": quote(json.dumps(metadata)),
+        }
+        return "PUT", "/upload/raw", {"content": raw, "headers": headers}
+    content = raw.decode("ascii") if content_type == "text" else base64.b64encode(raw).decode("ascii")
+    body = json.dumps({"type": content_type, "content": content, "metadata": metadata})
+    return "POST", "/upload", {"content": body, "headers": {"Content-Type": "application/json"}}
+
+
+def download_request(endpoint):
+    path = {"download": "/download", "status": "/status",
+            "download-file": "/download/file", "download-image": "/download/image"}[endpoint]
+    # Identity encoding keeps the numbers comparable across client libraries
+    return "GET", path, {"headers": {"Accept-Encoding": "identity"}}
+
+
+def read_rss(pids):
+    """Combined resident set size in bytes of pids (Linux /proc), or None"""
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total or None
+
+
+def process_tree(pid):
+    """pid and all its descendants"""
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        try:
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+class RSSMonitor:
+    """Samples the peak RSS of a process tree in a background thread"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = read_rss(process_tree(self.pid))
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+            self._stop.wait(RSS_SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_load(client, request, count, concurrency):
+    """
+    Send count copies of request with at most concurrency in flight
+    Returns (latencies, errors, bytes received in successful responses)
+    """
+    method, path, kwargs = request
+    latencies, errors, transferred = [], 0, 0
+    remaining = count
+
+    async def worker():
+        nonlocal remaining, errors, transferred
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                ok = response.status_code < 400
+                if ok:
+                    transferred += len(response.content)
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, count))))
+    return latencies, errors, transferred
+
+
+async def run_scenario(client, server_pid, endpoint, content_type, size, concurrency, requests):
+    raw = make_payload(content_type, size)
+    count = max(MIN_REQUESTS, min(requests, BYTES_PER_SCENARIO // max(size, 1)))
+
+    if endpoint.startswith("upload"):
+        request = upload_request(endpoint, content_type, raw)
+    else:
+        # Store the content once, then measure reads of it
+        method, path, kwargs = upload_request("upload-raw", content_type, raw)
+        (await client.request(method, path, **kwargs)).raise_for_status()
+        request = download_request(endpoint)
+        await run_load(client, request, WARMUP_REQUESTS, 1)
+    del raw
+
+    with RSSMonitor(server_pid) as rss:
+        start = time.perf_counter()
+        latencies, errors, transferred = await run_load(client, request, count, concurrency)
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    # Failed requests move nothing: counting them would make errors look fast
+    succeeded = count - errors
+    sent = size * succeeded if endpoint.startswith("upload") else transferred
+    return {
+        "name": f"{endpoint}/{content_type}/{format_size(size)}/c{concurrency}",
+        "endpoint": endpoint,
+        "type": content_type,
+        "size": size,
+        "concurrency": concurrency,
+        "requests": count,
+        "errors": errors,
+        "throughput_rps": succeeded / elapsed,
+        "throughput_mbps": sent / elapsed / 1024 ** 2,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "peak_rss_mb": rss.peak / 1024 ** 2 if rss.peak else None,
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.asynccontextmanager
+async def inprocess_server(data_dir):
+    """The FastAPI app imported into this process, reached through ASGI without sockets"""
+    os.environ.update(SERVER_ENV, EASYCOPY_DATA_DIR=str(data_dir))
+    sys.path.insert(0, str(SERVER_DIR))
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        import main
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        yield client, os.getpid()
+
+
+@contextlib.asynccontextmanager
+async def uvicorn_server(data_dir, workers):
+    """The server under uvicorn with workers processes on a free local port"""
+    port = free_port()
+    env = dict(os.environ, **SERVER_ENV, EASYCOPY_DATA_DIR=str(data_dir))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None,
+                                     limits=httpx.Limits(max_connections=None)) as client:
+            for _ in range(100):
+                try:
+                    if (await client.get("/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn did not start")
+            yield client, process.pid
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+async def run_all(args):
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    levels = [int(c) for c in args.concurrency.split(",")]
+    endpoints = args.endpoints.split(",") if args.endpoints else ENDPOINTS
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix="easycopy-bench-") as data_dir:
+        if args.mode == "inprocess":
+            server = inprocess_server(data_dir)
+        else:
+            server = uvicorn_server(data_dir, args.workers)
+        async with server as (client, server_pid):
+            for endpoint in endpoints:
+                for content_type in ENDPOINT_TYPES[endpoint]:
+                    for size in sizes:
+                        for concurrency in levels:
+                            # Keep the server's request logging out of the report
+                            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                                result = await run_scenario(client, server_pid, endpoint, content_type,
+                                                            size, concurrency, args.requests)
+                            print_result(result)
+                            results.append(result)
+    return results
+
+
+def print_result(result):
+    rss = f"{result['peak_rss_mb']:8.1f}" if result["peak_rss_mb"] is not None else "       -"
+    errors = f"  ({result['errors']} errors)" if result["errors"] else ""
+    print(f"{result['name']:40} {result['throughput_rps']:9.1f} req/s {result['throughput_mbps']:9.1f} MB/s "
+          f"p50 {result['p50_ms']:9.2f} ms  p99 {result['p99_ms']:9.2f} ms  RSS {rss} MB{errors}")
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print metrics that got worse than the baseline by more than tolerance,
+    and scenarios with failed requests; return their count
+    """
+    previous = {r["name"]: r for r in baseline.get("results", [])}
+    regressions = 0
+    for result in results:
+        old = previous.get(result["name"])
+        if result["errors"]:
+            regressions += 1
+            was = f" (baseline: {old['errors']})" if old is not None else ""
+            print(f"✗ {result['name']}: {result['errors']} failed request(s){was}")
+        if old is None:
+            continue
+        checks = [
+            ("throughput_rps", result["throughput_rps"] < old["throughput_rps"] * (1 - tolerance)),
+            ("p50_ms", result["p50_ms"] > old["p50_ms"] * (1 + tolerance)),
+            ("p99_ms", result["p99_ms"] > old["p99_ms"] * (1 + tolerance)),
+        ]
+        if result["peak_rss_mb"] and old.get("peak_rss_mb"):
+            checks.append(("peak_rss_mb", result["peak_rss_mb"] > old["peak_rss_mb"] * (1 + tolerance)))
+        for metric, worse in checks:
+            if worse:
+                regressions += 1
+                print(f"✗ {result['name']}: {metric} {old[metric]:.2f} -> {result[metric]:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the EasyCopy server")
+    parser.add_argument("--mode", choices=("inprocess", "uvicorn"), default="inprocess",
+                        help="run the app in this process (ASGI) or under uvicorn (default: inprocess)")
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn worker processes (default: 4)")
+    parser.add_argument("--endpoints", help=f"comma-separated subset of {', '.join(ENDPOINTS)}")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"payload sizes, up to 1G (default: {DEFAULT_SIZES})")
+    parser.add_argument("--concurrency", default=DEFAULT_CONCURRENCY,
+                        help=f"concurrent requests (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS,
+                        help=f"requests per scenario, fewer for large payloads (default: {DEFAULT_REQUESTS})")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE,
+                        help="baseline file to compare with or save to")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"allowed slowdown before a metric counts as a regression (default: {DEFAULT_TOLERANCE})")
+    args = parser.parse_args()
+
+    if args.endpoints and not set(args.endpoints.split(",")) <= set(ENDPOINTS):
+        parser.error(f"unknown endpoint in --endpoints (choose from {', '.join(ENDPOINTS)})")
+
+    results = asyncio.run(run_all(args))
+    report = {
+        "mode": args.mode,
+        "workers": args.workers if args.mode == "uvicorn" else 1,
+        "python": sys.version.split()[0],
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2))
+        print(f"✓ Saved baseline to {args.baseline}")
+        return
+    baseline = {}
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+        if (baseline.get("mode"), baseline.get("workers")) != (report["mode"], report["workers"]):
+            print(f"⚠ Baseline was recorded in {baseline.get('mode')} mode with {baseline.get('workers')} worker(s)")
+    # Failed requests count even without a baseline
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"✗ {regressions} regression(s) against {args.baseline}")
+        sys.exit(1)
+    if baseline:
+        print(f"✓ No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+EasyCopy Client Startup Benchmark
+Measures the cold start of the command-line clients: a fresh interpreter
+runs upload.py or download.py as from the command line, probing a stubbed
+clipboard (a stand-in xclip on PATH, so Linux only) and performing one small
+transfer against a local server. Pass --compare with the client directory of
+another checkout (e.g. `git worktree add /tmp/old HEAD~1`) to see the
+difference; scenarios the other client does not support are reported as failed
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from bench import percentile, uvicorn_server
+
+CLIENT_DIR = Path(__file__).resolve().parent.parent / "client"
+
+# Scenario -> (client script, its arguments, payload on the clipboard, payload on standard input)
+SCENARIOS = {
+    "upload-text": ("upload", [], "text", None),  # Probes files and an image first
+    "upload-text-typed": ("upload", ["--type", "text"], "text", None),
+    "upload-image": ("upload", [], "image", None),
+    "upload-file": ("upload", ["-", "--name", "data.csv"], None, "csv"),
+    "download-unchanged": ("download", [], None, None),
+}
+DEFAULT_RUNS = 10
+
+# Runs in a fresh interpreter: argv = client dir, script name, the script's arguments.
+# Prints the time spent importing the client (seconds) as the last line of output
+DRIVER = """
+import sys, time, json
+start = time.perf_counter()
+client_dir, script = sys.argv[1:3]
+sys.path.insert(0, client_dir)
+client = __import__(script)
+imported = time.perf_counter()
+sys.argv = [script + ".py"] + sys.argv[3:]
+try:
+    client.main()
+finally:
+    print(json.dumps({"import": imported - start}))
+"""
+
+# Stand-in for xclip serving $EASYCOPY_BENCH_CLIPBOARD: a .png file as an
+# image, anything else as text, nothing if unset. Copies are discarded
+XCLIP_STUB = """#!/bin/sh
+target=
+output=
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -t|-target) target=$2; shift ;;
+        -o|-out) output=1 ;;
+    esac
+    shift
+done
+[ -n "$output" ] || exec cat > /dev/null
+case "$EASYCOPY_BENCH_CLIPBOARD" in
+    "") exit 1 ;;
+    *.png) kind=image/png ;;
+    *) kind=UTF8_STRING ;;
+esac
+case "$target" in
+    TARGETS) echo TARGETS; echo "$kind" ;;
+    image/png|"$kind") exec cat "$EASYCOPY_BENCH_CLIPBOARD" ;;
+    "") [ "$kind" = UTF8_STRING ] && exec cat "$EASYCOPY_BENCH_CLIPBOARD"; exit 1 ;;
+    *) exit 1 ;;
+esac
+"""
+
+
+def make_payloads(directory):
+    """Payload files (1 KB text, 64 KB CSV file, 256x256 PNG)"""
+    from PIL import Image
+
+    text = directory / "clip.txt"
+    text.write_text("easycopy " * 113 + "\n")
+    csv = directory / "data.csv"
+    csv.write_text("".join(f"{i},{i * i},{i % 7}\n" for i in range(6000)))
+    image = directory / "shot.png"
+    Image.effect_noise((256, 256), 64).convert("RGB").save(image)
+    return {"text": text, "csv": csv, "image": image}
+
+
+def install_stubs(directory):
+    """Directory holding the stand-in xclip, to go first on PATH"""
+    directory.mkdir()
+    xclip = directory / "xclip"
+    xclip.write_text(XCLIP_STUB)
+    xclip.chmod(0o755)
+    return directory
+
+
+def store_unchanged(env, payload):
+    """Set up download-unchanged: the server holds the text and the client remembers its ETag"""
+    url = env["EASYCOPY_SERVER"]
+    response = httpx.put(f"{url}/upload/raw", content=payload.read_bytes(), headers={"X-EasyCopy-Type": "text"})
+    response.raise_for_status()
+    Path(env["EASYCOPY_STATE_FILE"]).write_text(json.dumps({url: f'"{response.json()["sha256"]}"'}))
+
+
+def run_once(client_dir, scenario, payloads, env):
+    """(wall, import) seconds of one fresh client process"""
+    script, arguments, clipboard, stdin = SCENARIOS[scenario]
+    env = dict(env, EASYCOPY_BENCH_CLIPBOARD=str(payloads[clipboard]) if clipboard else "")
+    with open(payloads[stdin] if stdin else os.devnull, "rb") as source:
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", DRIVER, str(client_dir), script, *arguments],
+                                env=env, stdin=source, capture_output=True, text=True)
+        wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"{scenario} failed:\n{result.stdout}{result.stderr}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    return wall, timings["import"]
+
+
+def measure(client_dir, scenarios, payloads, env, runs):
+    """Timings of each scenario, None for those that failed (the error is printed)"""
+    results = {}
+    for scenario in scenarios:
+        if scenario == "download-unchanged":
+            store_unchanged(env, payloads["text"])
+        try:
+            run_once(client_dir, scenario, payloads, env)  # Untimed: fill the OS page cache
+            samples = [run_once(client_dir, scenario, payloads, env) for _ in range(runs)]
+        except RuntimeError as e:
+            print(f"{client_dir}: {e}", file=sys.stderr)
+            results[scenario] = None
+            continue
+        walls = sorted(sample[0] for sample in samples)
+        imports = sorted(sample[1] for sample in samples)
+        results[scenario] = {
+            "wall_p50_ms": percentile(walls, 0.5) * 1000,
+            "wall_p90_ms": percentile(walls, 0.9) * 1000,
+            "import_p50_ms": percentile(imports, 0.5) * 1000,
+        }
+    return results
+
+
+async def run_all(args):
+    client_dirs = [args.client] + ([args.compare] if args.compare else [])
+    with tempfile.TemporaryDirectory(prefix="easycopy-startup-") as work:
+        work = Path(work)
+        payloads = make_payloads(work)
+        (work / "data").mkdir()
+        async with uvicorn_server(work / "data", 1) as (client, _):
+            env = dict(os.environ, EASYCOPY_SERVER=str(client.base_url).rstrip("/"),
+                       EASYCOPY_STATE_FILE=str(work / "download_state.json"),
+                       EASYCOPY_DOWNLOAD_DIR=str(work / "downloads"),
+                       PATH=os.pathsep.join((str(install_stubs(work / "bin")), os.environ.get("PATH", ""))),
+                       DISPLAY=":0")
+            env.pop("EASYCOPY_CHANNEL", None)
+            env.pop("WAYLAND_DISPLAY", None)  # The clients would look for wl-paste instead of xclip
+            return [measure(client_dir, args.scenarios, payloads, env, args.runs) for client_dir in client_dirs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cold start of the EasyCopy clients")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS,
+                        help=f"client processes per scenario (default: {DEFAULT_RUNS})")
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=list(SCENARIOS),
+                        help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--client", type=Path, default=CLIENT_DIR, help="client directory to measure")
+    parser.add_argument("--compare", type=Path, help="client directory of another checkout to compare with")
+    args = parser.parse_args()
+
+    if not set(args.scenarios) <= set(SCENARIOS):
+        parser.error(f"unknown scenario in --scenarios (choose from {', '.join(SCENARIOS)})")
+
+    results = asyncio.run(run_all(args))
+    print(f"{'':20} {'wall p50':>10} {'wall p90':>10} {'imports':>10}" + ("   vs --compare" if args.compare else ""))
+    for scenario in args.scenarios:
+        current = results[0][scenario]
+        if current is None:
+            line = f"{scenario:20} {'failed':>10}"
+        else:
+            line = (f"{scenario:20} {current['wall_p50_ms']:8.1f}ms {current['wall_p90_ms']:8.1f}ms "
+                    f"{current['import_p50_ms']:8.1f}ms")
+        if args.compare:
+            other = results[1][scenario]
+            if other is None:
+                line += "   failed"
+            else:
+                line += f"   {other['wall_p50_ms']:8.1f}ms wall, {other['import_p50_ms']:8.1f}ms imports"
+                if current is not None:
+                    line += f" ({current['wall_p50_ms'] - other['wall_p50_ms']:+.1f}ms)"
+        print(line)
+    if any(result is None for result in results[0].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+EasyCopy Client Daemon
+Keeps the upload and download clients loaded (imports, clipboard libraries,
+keep-alive connections to the server) and runs them on request from
+short-lived `easycopy.py upload|download` invocations over a Unix socket.
+Commands run in the caller's working directory. The clients read their
+EASYCOPY_* settings once, when the daemon imports them, so callers with other
+settings (another server, channel or download directory) are turned away and
+run the command themselves.
+Only the standard library is imported until the daemon starts serving.
+"""
+
+import json
+import os
+import socket
+import sys
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+
+# Unix socket the daemon listens on (private to the user)
+SOCKET_PATH = Path(os.environ.get("EASYCOPY_SOCKET") or (
+    Path(os.environ["XDG_RUNTIME_DIR"]) / "easycopy.sock" if os.environ.get("XDG_RUNTIME_DIR")
+    else Path.home() / ".cache" / "easycopy" / "daemon.sock"))
+
+# Commands the daemon runs, by client module
+COMMANDS = ("upload", "download")
+
+
+def settings():
+    """The EASYCOPY_* environment the clients are configured by (the socket aside)"""
+    return {name: value for name, value in os.environ.items()
+            if name.startswith("EASYCOPY_") and name != "EASYCOPY_SOCKET"}
+
+
+def request(command, argv):
+    """
+    Run a command in the daemon, echoing its output
+    Returns the command's exit status, or None if no daemon is running or
+    it runs with other settings
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(SOCKET_PATH))
+    except OSError:
+        sock.close()
+        return None
+    with sock, sock.makefile("rwb") as stream:
+        message = {"command": command, "argv": argv, "cwd": os.getcwd(), "settings": settings()}
+        stream.write(json.dumps(message).encode() + b"\n")
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if message.get("refused"):
+                return None
+            if "status" in message:
+                return message["status"]
+            sys.stdout.write(message["output"])
+            sys.stdout.flush()
+    print("✗ Error: The EasyCopy daemon closed the connection")
+    return 1
+
+
+class _Output:
+    """Text stream forwarding everything written to the requesting client"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        if text:
+            self.stream.write(json.dumps({"output": text}).encode() + b"\n")
+            self.stream.flush()
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def _run(module, argv, stream):
+    """Run a client's main() as if started with argv; returns the exit status"""
+    output = _Output(stream)
+    saved_argv = sys.argv
+    sys.argv = [f"{module.__name__}.py", *argv]
+    try:
+        with redirect_stdout(output), redirect_stderr(output):
+            module.main()
+        return 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        output.write(f"{e.code}\n")
+        return 1
+    finally:
+        sys.argv = saved_argv
+
+
+def _is_running():
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with sock:
+        try:
+            sock.connect(str(SOCKET_PATH))
+            return True
+        except OSError:
+            return False
+
+
+def serve():
+    """Load the clients and answer requests one at a time until interrupted"""
+    if not hasattr(socket, "AF_UNIX"):
+        print("✗ The EasyCopy daemon needs Unix domain sockets, which this platform lacks")
+        sys.exit(1)
+    import socketserver
+
+    import download
+    import upload
+
+    modules = {"upload": upload, "download": download}
+    own_settings = settings()
+    own_cwd = os.getcwd()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                message = json.loads(self.rfile.readline())
+                module = modules[message["command"]]
+                argv = [str(arg) for arg in message.get("argv", [])]
+            except (ValueError, KeyError, TypeError):
+                return
+            try:
+                if message.get("settings") != own_settings:
+                    self.wfile.write(json.dumps({"refused": "settings"}).encode() + b"\n")
+                    return
+                try:
+                    os.chdir(message.get("cwd") or own_cwd)
+                except (OSError, TypeError):
+                    self.wfile.write(json.dumps({"refused": "cwd"}).encode() + b"\n")
+                    return
+                try:
+                    status = _run(module, argv, self.wfile)
+                finally:
+                    os.chdir(own_cwd)
+                self.wfile.write(json.dumps({"status": status}).encode() + b"\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # The client went away
+
+    if _is_running():
+        print(f"✗ The EasyCopy daemon is already running ({SOCKET_PATH})")
+        sys.exit(1)
+    SOCKET_PATH.parent.mkdir(parents=True, exist_ok=True, mode=0o700)
+    SOCKET_PATH.unlink(missing_ok=True)  # Left behind by a daemon that did not exit cleanly
+
+    # Only this user may connect: the daemon reads and writes their clipboard
+    umask = os.umask(0o077)
+    try:
+        server = socketserver.UnixStreamServer(str(SOCKET_PATH), Handler)
+    finally:
+        os.umask(umask)
+    print(f"EasyCopy daemon listening on {SOCKET_PATH} (server {upload.SERVER_URL}, Ctrl+C to stop)")
+    try:
+        with server:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        SOCKET_PATH.unlink(missing_ok=True)
@@ -0,0 +1,220 @@
+"""
+EasyCopy delta transfer helpers shared by the upload and download clients
+rsync-style block signatures and deltas: the side holding the new version
+matches its bytes against the signatures of the old version and sends only
+instructions to copy old blocks plus the bytes that changed.
+Kept in sync with server/delta.py.
+
+Signature: per block of the base, the 4-byte Adler-32 (rolling, weak) and the
+16-byte BLAKE2b (strong) checksum, concatenated.
+Delta: a stream of instructions
+    b"C" + first block (u64) + block count (u32)  - copy blocks of the base
+    b"L" + length (u32) + bytes                   - literal bytes
+    b"E"                                          - end
+"""
+
+import hashlib
+import math
+import struct
+import zlib
+
+MIN_BLOCK_SIZE = 4 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+STRONG_SIZE = 16
+SIGNATURE_RECORD = struct.Struct(f">I{STRONG_SIZE}s")
+
+COPY = b"C"
+LITERAL = b"L"
+END = b"E"
+COPY_ARGS = struct.Struct(">QI")
+LITERAL_ARGS = struct.Struct(">I")
+MAX_LITERAL = 1024 * 1024
+
+# After a mismatch, matches are searched at every byte offset for this many
+# blocks (finds blocks shifted by insertions and deletions), then at block
+# boundaries with another block of rolling search every RESYNC_BLOCKS blocks
+# (finds the data after long insertions). This bounds the pure-Python
+# rolling to a few blocks per change plus 1/RESYNC_BLOCKS of new data
+ROLLING_BLOCKS = 4
+RESYNC_BLOCKS = 16
+
+_ADLER_MOD = 65521
+
+
+def block_size_for(size):
+    """Block size for a file of size bytes: a power of two near sqrt(size)"""
+    if size <= 0:
+        return MIN_BLOCK_SIZE
+    return min(MAX_BLOCK_SIZE, max(MIN_BLOCK_SIZE, 1 << math.ceil(math.log2(math.sqrt(size)))))
+
+
+def _strong(data):
+    return hashlib.blake2b(data, digest_size=STRONG_SIZE).digest()
+
+
+def make_signature(blocks):
+    """Signature of a base given as an iterable of block_size chunks (the last may be shorter)"""
+    return b"".join(SIGNATURE_RECORD.pack(zlib.adler32(block), _strong(block)) for block in blocks)
+
+
+def parse_signature(signature):
+    """[(weak, strong)] per block"""
+    if len(signature) % SIGNATURE_RECORD.size:
+        raise ValueError("Truncated signature")
+    return list(SIGNATURE_RECORD.iter_unpack(signature))
+
+
+def plan_delta(data, signature, block_size, base_size, max_literal=None):
+    """
+    Instructions rebuilding data (bytes or mmap) from the base the signature describes
+    Returns [("copy", first block, count) | ("literal", start, end)], or None
+    as soon as more than max_literal bytes would have to be sent literally
+    """
+    blocks = parse_signature(signature)
+    index = {}
+    for number, (weak, strong) in enumerate(blocks):
+        if min(block_size, base_size - number * block_size) == block_size:
+            index.setdefault(weak, {}).setdefault(strong, number)
+
+    plan = []
+    size = len(data)
+    pending = 0  # Start of the bytes not covered by the plan yet
+    literal = 0
+
+    def copy(number, start):
+        nonlocal literal
+        if start > pending:
+            plan.append(("literal", pending, start))
+            literal += start - pending
+        if plan and plan[-1][0] == "copy" and plan[-1][1] + plan[-1][2] == number:
+            plan[-1] = ("copy", plan[-1][1], plan[-1][2] + 1)
+        else:
+            plan.append(("copy", number, 1))
+
+    def lookup(weak, start, end):
+        candidates = index.get(weak)
+        if candidates:
+            return candidates.get(_strong(data[start:end]))
+        return None
+
+    pos = 0
+    rolling_until = ROLLING_BLOCKS * block_size
+    while pos + block_size <= size:
+        weak = zlib.adler32(data[pos:pos + block_size])
+        number = lookup(weak, pos, pos + block_size)
+        if number is None and pos < rolling_until:
+            # Slide the window a byte at a time, updating the checksum in O(1)
+            a, b = weak & 0xFFFF, weak >> 16
+            end = min(rolling_until, size - block_size)
+            while pos < end:
+                out, new = data[pos], data[pos + block_size]
+                a = (a - out + new) % _ADLER_MOD
+                b = (b - block_size * out + a - 1) % _ADLER_MOD
+                pos += 1
+                if (b << 16 | a) in index:
+                    number = lookup(b << 16 | a, pos, pos + block_size)
+                    if number is not None:
+                        break
+            if number is None:
+                rolling_until = pos  # Back to block boundaries from here
+                continue
+        if number is None:
+            pos += block_size
+            if max_literal is not None and literal + pos - pending > max_literal:
+                return None
+            if pos >= rolling_until + RESYNC_BLOCKS * block_size:
+                rolling_until = pos + block_size
+            continue
+        copy(number, pos)
+        pos += block_size
+        pending = pos
+        rolling_until = pos + ROLLING_BLOCKS * block_size
+
+    # A short last block of the base can only match the end of the data
+    tail = base_size - (len(blocks) - 1) * block_size if blocks else 0
+    if 0 < tail < block_size and size - tail >= pending:
+        weak, strong = blocks[-1]
+        if zlib.adler32(data[size - tail:]) == weak and _strong(data[size - tail:]) == strong:
+            copy(len(blocks) - 1, size - tail)
+            pending = size
+    if size > pending:
+        if max_literal is not None and literal + size - pending > max_literal:
+            return None
+        plan.append(("literal", pending, size))
+    return plan
+
+
+def literal_size(plan):
+    return sum(op[2] - op[1] for op in plan if op[0] == "literal")
+
+
+def encode_delta(data, plan):
+    """Yield the delta stream of a plan"""
+    for op in plan:
+        if op[0] == "copy":
+            yield COPY + COPY_ARGS.pack(op[1], op[2])
+            continue
+        for start in range(op[1], op[2], MAX_LITERAL):
+            chunk = data[start:min(start + MAX_LITERAL, op[2])]
+            yield LITERAL + LITERAL_ARGS.pack(len(chunk)) + chunk
+    yield END
+
+
+class DeltaDecoder:
+    """
+    Rebuild a file from a delta stream fed in arbitrary pieces
+    base is a seekable binary file of the old version; write receives the
+    new version in order
+    """
+
+    def __init__(self, base, block_size, write, chunk_size=1024 * 1024):
+        self.base = base
+        self.block_size = block_size
+        self.write = write
+        self.chunk_size = chunk_size
+        self.finished = False
+        self._buffer = bytearray()
+        self._literal_left = 0
+
+    def feed(self, data):
+        self._buffer += data
+        while self._buffer and not self.finished:
+            if self._literal_left:
+                chunk = self._buffer[:self._literal_left]
+                del self._buffer[:len(chunk)]
+                self._literal_left -= len(chunk)
+                self.write(bytes(chunk))
+                continue
+            op = self._buffer[:1]
+            if op == END:
+                self.finished = True
+                del self._buffer[:1]
+            elif op == COPY:
+                if len(self._buffer) < 1 + COPY_ARGS.size:
+                    return
+                first, count = COPY_ARGS.unpack_from(self._buffer, 1)
+                del self._buffer[:1 + COPY_ARGS.size]
+                self._copy(first, count)
+            elif op == LITERAL:
+                if len(self._buffer) < 1 + LITERAL_ARGS.size:
+                    return
+                self._literal_left = LITERAL_ARGS.unpack_from(self._buffer, 1)[0]
+                del self._buffer[:1 + LITERAL_ARGS.size]
+            else:
+                raise ValueError(f"Invalid delta instruction {bytes(op)!r}")
+        if self.finished and self._buffer:
+            raise ValueError("Data after the end of the delta")
+
+    def _copy(self, first, count):
+        self.base.seek(first * self.block_size)
+        remaining = count * self.block_size
+        while remaining:
+            chunk = self.base.read(min(remaining, self.chunk_size))
+            if not chunk:
+                break  # The last block of the base is short
+            self.write(chunk)
+            remaining -= len(chunk)
+
+    def close(self):
+        if not self.finished:
+            raise ValueError("Delta stream ended early")
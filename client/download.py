@@ -7,43 +7,99 @@ Supports: text, files, and images
 
 import sys
 import os
+import argparse
 import base64
+import glob
+import hashlib
 import json
+import re
+import shutil
+import threading
+import time
+from contextlib import nullcontext, redirect_stdout
 from pathlib import Path
+from urllib.parse import quote, unquote
 import requests
-import pyperclip
-from PIL import Image
 from io import BytesIO
 
+# Pillow, pyperclip, tarfile and the delta/parallel download machinery are
+# imported by the functions that need them, so a run that finds the
+# clipboard up to date (or fetches text) starts quickly
+from transfer import (ACCEPT_ENCODING, TEXT_DELTA_THRESHOLD, decoded_reader, load_text_base, new_session, open_decoded,
+                      save_text_base)
+
 # Server configuration
 SERVER_URL = os.environ.get("EASYCOPY_SERVER", "http://localhost:8000")
 
+# Named channel on a shared server (empty: the server's default channel)
+CHANNEL = os.environ.get("EASYCOPY_CHANNEL", "")
+API_URL = f"{SERVER_URL}/c/{quote(CHANNEL, safe='')}" if CHANNEL else SERVER_URL
+
 # Default download directory for files
 DOWNLOAD_DIR = Path(os.environ.get("EASYCOPY_DOWNLOAD_DIR", 
                                    Path.home() / "Downloads" / "easycopy"))
 
+# Ranged file downloads: files larger than PARALLEL_THRESHOLD are fetched as
+# SEGMENT_SIZE byte ranges over PARALLEL_DOWNLOADS concurrent connections
+PARALLEL_DOWNLOADS = int(os.environ.get("EASYCOPY_PARALLEL", "4"))
+SEGMENT_SIZE = 8 * 1024 * 1024
+PARALLEL_THRESHOLD = 4 * SEGMENT_SIZE
+MAX_RETRIES = 3
+
+# Files are fetched as a delta against an older local copy of at least this size
+DELTA_THRESHOLD = 4 * 1024 * 1024
+
+# Connections are kept alive and reused by every request
+http = new_session(PARALLEL_DOWNLOADS)
+
+# Seconds to wait before re-subscribing after losing the --watch event stream
+WATCH_RECONNECT_DELAY = 5
+
+# ETag of the last downloaded content, so unchanged content is not fetched again
+STATE_FILE = Path(os.environ.get("EASYCOPY_STATE_FILE",
+                                 Path.home() / ".cache" / "easycopy" / "download_state.json"))
+
+
+def load_last_etag():
+    """Return the ETag of the content last downloaded from this server and channel, if any"""
+    try:
+        return json.loads(STATE_FILE.read_text()).get(API_URL)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_last_etag(etag):
+    if not etag:
+        return
+    # Compressed representations are tagged "<sha256>-<encoding>"; remember the content hash
+    etag = '"' + etag.removeprefix("W/").strip('"').split("-")[0] + '"'
+    try:
+        state = json.loads(STATE_FILE.read_text())
+    except (FileNotFoundError, ValueError):
+        state = {}
+    state[API_URL] = etag
+    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    STATE_FILE.write_text(json.dumps(state))
 
-def set_clipboard_image(image):
-    """Set image to clipboard (platform-specific)"""
+
+def set_clipboard_image(data):
+    """
+    Set an encoded image (PNG, WebP, ...) to clipboard (platform-specific)
+    The bytes are handed to the platform API in memory; only Windows, which
+    wants a bitmap, needs them decoded
+    """
     if sys.platform == "darwin":
         # macOS
         try:
-            from AppKit import NSPasteboard, NSImage, NSPasteboardTypePNG
-            import tempfile
-            
-            # Save image to temporary file
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-                image.save(tmp.name, 'PNG')
-                tmp_path = tmp.name
+            from AppKit import NSPasteboard, NSImage
+            from Foundation import NSData
             
-            # Load into NSImage and copy to clipboard
-            ns_image = NSImage.alloc().initWithContentsOfFile_(tmp_path)
+            ns_image = NSImage.alloc().initWithData_(NSData.dataWithBytes_length_(data, len(data)))
+            if ns_image is None:
+                return False
             pb = NSPasteboard.generalPasteboard()
             pb.clearContents()
             pb.writeObjects_([ns_image])
-            
-            # Clean up temp file
-            os.unlink(tmp_path)
             return True
         except ImportError:
             pass
@@ -54,20 +110,14 @@ def set_clipboard_image(image):
             import gi
             gi.require_version('Gtk', '3.0')
             from gi.repository import Gtk, Gdk, GdkPixbuf
-            import tempfile
-            
-            # Save to temp file
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-                image.save(tmp.name, 'PNG')
-                tmp_path = tmp.name
             
-            # Load and set to clipboard
-            pixbuf = GdkPixbuf.Pixbuf.new_from_file(tmp_path)
+            # Decode from memory with the loader for the image's format
+            loader = GdkPixbuf.PixbufLoader()
+            loader.write(data)
+            loader.close()
             clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
-            clipboard.set_image(pixbuf)
+            clipboard.set_image(loader.get_pixbuf())
             clipboard.store()
-            
-            os.unlink(tmp_path)
             return True
         except (ImportError, Exception):
             pass
@@ -76,10 +126,10 @@ def set_clipboard_image(image):
         # Windows
         try:
             import win32clipboard
-            from io import BytesIO
+            from PIL import Image
             
             output = BytesIO()
-            image.convert('RGB').save(output, 'BMP')
+            Image.open(BytesIO(data)).convert('RGB').save(output, 'BMP')
             data = output.getvalue()[14:]  # Remove BMP header
             output.close()
             
@@ -96,34 +146,290 @@ def set_clipboard_image(image):
 
 def download_text(content, metadata):
     """Download text and put in clipboard"""
+    import pyperclip
+
     pyperclip.copy(content)
+    save_text_base(content.encode("utf-8"))
     print(f"✓ Downloaded text to clipboard ({metadata.get('length', len(content))} characters)")
 
 
-def download_file(content_base64, metadata):
-    """Download file and save to disk, copy file to clipboard"""
-    # Decode base64 content
-    file_content = base64.b64decode(content_base64)
-    
-    # Ensure download directory exists
+def unique_path(directory, filename):
+    """
+    Return a path in directory for filename that does not exist yet
+    filename itself if it is free, else stem_N.suffix after the highest N
+    taken (one directory listing instead of a check per candidate)
+    """
+    try:
+        names = set(os.listdir(directory))
+    except FileNotFoundError:
+        names = set()
+    if filename not in names:
+        return directory / filename
+    name = Path(filename)
+    numbered = re.compile(rf"{re.escape(name.stem)}_(\d+){re.escape(name.suffix)}")
+    taken = [int(match.group(1)) for match in map(numbered.fullmatch, names) if match]
+    return directory / f"{name.stem}_{max(taken, default=0) + 1}{name.suffix}"
+
+
+def etag_digest(etag):
+    """SHA-256 of the raw content a content-hash ETag names"""
+    return etag.removeprefix("W/").strip('"').split("-")[0]
+
+
+def save_download(chunks, filename, sha256):
+    """
+    Write chunks to a temp file in DOWNLOAD_DIR, hashing them on the way, and
+    rename it to a free name for filename once complete; returns the path.
+    Raises ValueError (keeping nothing) if the bytes do not hash to sha256
+    """
     DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
-    
-    # Use original filename
+    digest = hashlib.sha256()
+    tmp_path = DOWNLOAD_DIR / f".{filename}.{os.urandom(4).hex()}.part"
+    try:
+        with open(tmp_path, "xb") as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                f.write(chunk)
+        if digest.hexdigest() != sha256:
+            raise ValueError("Downloaded content does not match the server's SHA-256, discarded")
+        file_path = unique_path(DOWNLOAD_DIR, filename)
+        os.replace(tmp_path, file_path)
+        return file_path
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def _fetch_segment(part_path, etag, start, end):
+    """
+    Fetch bytes [start, end] of the stored file into part_path at offset start
+    If-Range makes the server answer 200 instead of 206 if the file changed
+    """
+    headers = {"Range": f"bytes={start}-{end}", "If-Range": etag, "Accept-Encoding": ACCEPT_ENCODING}
+    for attempt in range(MAX_RETRIES):
+        try:
+            with http.get(f"{API_URL}/download/file", headers=headers, stream=True, timeout=30) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise RuntimeError("File changed on server during download")
+                with open(part_path, "r+b") as f:
+                    f.seek(start)
+                    # Ranges address the encoded representation; keep the bytes as sent
+                    for chunk in response.raw.stream(1024 * 1024, decode_content=False):
+                        f.write(chunk)
+                return
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError):
+            if attempt == MAX_RETRIES - 1:
+                raise
+
+
+def download_file_ranged(head):
+    """
+    Download the stored file with HTTP range requests
+    Progress is kept in DOWNLOAD_DIR/.<filename>.part (plus a .json sidecar of
+    finished segments), so an interrupted download resumes where it stopped.
+    Large files are fetched as several parallel ranges. If the server sends
+    the file compressed (Content-Encoding), the ranges cover the compressed
+    bytes, which are decoded once the download is complete.
+    """
+    metadata = json.loads(unquote(head.headers.get("X-EasyCopy-Metadata", "{}")))
+    etag = head.headers["ETag"]
+    encoding = head.headers.get("Content-Encoding")
+    size = int(head.headers["Content-Length"])
     filename = metadata.get('filename', 'downloaded_file')
-    file_path = DOWNLOAD_DIR / filename
-    
-    # Handle duplicate filenames
-    counter = 1
-    original_stem = file_path.stem
-    while file_path.exists():
-        file_path = DOWNLOAD_DIR / f"{original_stem}_{counter}{file_path.suffix}"
-        counter += 1
-    
-    # Write file
-    with open(file_path, 'wb') as f:
-        f.write(file_content)
-    
-    # Copy file to clipboard (platform-specific)
+
+    DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    part_path = DOWNLOAD_DIR / f".{filename}.part"
+    state_path = DOWNLOAD_DIR / f".{filename}.part.json"
+
+    segments = [(start, min(start + SEGMENT_SIZE, size) - 1) for start in range(0, size, SEGMENT_SIZE)]
+    done = set()
+    try:
+        state = json.loads(state_path.read_text())
+        if state.get("etag") == etag and state.get("size") == size and part_path.exists():
+            done = set(state.get("done", []))
+    except (FileNotFoundError, ValueError):
+        pass
+    if not done:
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+    elif len(done) < len(segments):
+        print(f"  Resuming download ({len(done)}/{len(segments)} segments already present)")
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    lock = threading.Lock()
+
+    def fetch(index):
+        start, end = segments[index]
+        _fetch_segment(part_path, etag, start, end)
+        with lock:
+            done.add(index)
+            state_path.write_text(json.dumps({"etag": etag, "size": size, "done": sorted(done)}))
+
+    pending = [i for i in range(len(segments)) if i not in done]
+    workers = PARALLEL_DOWNLOADS if size >= PARALLEL_THRESHOLD else 1
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            for future in [pool.submit(fetch, i) for i in pending]:
+                future.result()
+    except RuntimeError:
+        # The partial download belongs to content that is gone
+        part_path.unlink(missing_ok=True)
+        state_path.unlink(missing_ok=True)
+        raise
+
+    # Ranges finish out of order: hash the result in one pass (decoding it if needed)
+    digest = hashlib.sha256()
+    if encoding:
+        decoded_path = DOWNLOAD_DIR / f".{filename}.decoded"
+        with open_decoded(part_path, encoding) as src, open(decoded_path, "wb") as dst:
+            while chunk := src.read(1024 * 1024):
+                digest.update(chunk)
+                dst.write(chunk)
+        os.replace(decoded_path, part_path)
+    else:
+        with open(part_path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+    state_path.unlink(missing_ok=True)
+    if digest.hexdigest() != etag_digest(etag):
+        part_path.unlink(missing_ok=True)
+        raise ValueError("Downloaded file does not match the server's SHA-256, discarded")
+
+    file_path = unique_path(DOWNLOAD_DIR, filename)
+    os.replace(part_path, file_path)
+
+    copy_file_to_clipboard(file_path, metadata, file_path.stat().st_size)
+
+
+def download_file_stream():
+    """
+    Download the stored file in a single request
+    The body is decoded while it arrives and written straight to disk, so
+    memory use does not depend on the file size
+    """
+    headers = {"Accept-Encoding": ACCEPT_ENCODING}
+    with http.get(f"{API_URL}/download/file", headers=headers, stream=True, timeout=(10, None)) as response:
+        response.raise_for_status()
+        metadata = json.loads(unquote(response.headers.get("X-EasyCopy-Metadata", "{}")))
+        with decoded_reader(response.raw, response.headers.get("Content-Encoding")) as stream:
+            file_path = save_download(iter(lambda: stream.read(1024 * 1024), b""),
+                                      metadata.get("filename", "downloaded_file"),
+                                      etag_digest(response.headers["ETag"]))
+    copy_file_to_clipboard(file_path, metadata, file_path.stat().st_size)
+
+
+def find_local_copy(filename):
+    """The newest file in DOWNLOAD_DIR saved as filename (or a numbered variant of it), or None"""
+    name = Path(filename)
+    candidates = [DOWNLOAD_DIR / filename]
+    candidates += DOWNLOAD_DIR.glob(f"{glob.escape(name.stem)}_*{glob.escape(name.suffix)}")
+    existing = [path for path in candidates if path.is_file()]
+    return max(existing, key=lambda path: path.stat().st_mtime) if existing else None
+
+
+def download_file_delta(head):
+    """
+    Download the stored file as a delta against an older copy in DOWNLOAD_DIR
+    Only the changed parts are transferred. Returns False if there is no
+    local copy worth using or the result does not verify
+    """
+    metadata = json.loads(unquote(head.headers.get("X-EasyCopy-Metadata", "{}")))
+    filename = metadata.get('filename', 'downloaded_file')
+    local = find_local_copy(filename) if DOWNLOAD_DIR.is_dir() else None
+    if local is None or local.stat().st_size < DELTA_THRESHOLD:
+        return False
+    from delta import DeltaDecoder, block_size_for, make_signature
+
+    base_size = local.stat().st_size
+    block_size = block_size_for(base_size)
+    part_path = DOWNLOAD_DIR / f".{filename}.delta"
+    digest = hashlib.sha256()
+    received = 0
+    with open(local, "rb") as base:
+        signature = make_signature(iter(lambda: base.read(block_size), b""))
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "Accept-Encoding": ACCEPT_ENCODING,
+            "X-EasyCopy-Block-Size": str(block_size),
+            "X-EasyCopy-Size": str(base_size),
+        }
+        try:
+            with http.post(f"{API_URL}/download/delta", data=signature, headers=headers,
+                               stream=True, timeout=(10, None)) as response:
+                if response.status_code != 200:
+                    return False
+                with open(part_path, "wb") as out:
+                    def write(chunk):
+                        out.write(chunk)
+                        digest.update(chunk)
+
+                    decoder = DeltaDecoder(base, block_size, write)
+                    stream = decoded_reader(response.raw, response.headers.get("Content-Encoding"))
+                    while chunk := stream.read(1024 * 1024):
+                        received += len(chunk)
+                        decoder.feed(chunk)
+                    decoder.close()
+        except (ValueError, requests.exceptions.ChunkedEncodingError):
+            part_path.unlink(missing_ok=True)
+            return False
+
+    if digest.hexdigest() != etag_digest(head.headers["ETag"]):
+        part_path.unlink(missing_ok=True)
+        return False
+
+    file_path = unique_path(DOWNLOAD_DIR, filename)
+    os.replace(part_path, file_path)
+    print(f"  Received as a delta against {local.name}: {received} bytes")
+    copy_file_to_clipboard(file_path, metadata, file_path.stat().st_size)
+    return True
+
+
+def download_text_delta(conditional):
+    """
+    Download the stored text as a delta against the last large text synced
+    Only the changed parts are transferred. Returns False if there is no
+    base worth using, the server no longer has it or the result does not verify
+    """
+    base = load_text_base()
+    if base is None:
+        return False
+    from delta import DeltaDecoder
+
+    headers = {**conditional, "Accept-Encoding": ACCEPT_ENCODING,
+               "X-EasyCopy-Base-SHA256": hashlib.sha256(base).hexdigest()}
+    out = BytesIO()
+    received = 0
+    try:
+        with http.post(f"{API_URL}/download/delta", headers=headers, stream=True, timeout=(10, None)) as response:
+            if response.status_code == 304:
+                print("✓ Clipboard already up to date")
+                return True
+            if response.status_code != 200:
+                return False
+            decoder = DeltaDecoder(BytesIO(base), int(response.headers["X-EasyCopy-Block-Size"]), out.write)
+            stream = decoded_reader(response.raw, response.headers.get("Content-Encoding"))
+            while chunk := stream.read(1024 * 1024):
+                received += len(chunk)
+                decoder.feed(chunk)
+            decoder.close()
+    except (ValueError, requests.exceptions.ChunkedEncodingError):
+        return False
+
+    data = out.getvalue()
+    etag = response.headers["ETag"]
+    if hashlib.sha256(data).hexdigest() != etag_digest(etag):
+        return False
+    download_text(data.decode("utf-8"), json.loads(unquote(response.headers.get("X-EasyCopy-Metadata", "{}"))))
+    print(f"  Received as a delta: {received} bytes")
+    save_last_etag(etag)
+    return True
+
+
+def copy_file_to_clipboard(file_path, metadata, size):
+    """Copy a downloaded file to the clipboard (platform-specific)"""
     file_copied = False
     if sys.platform == "darwin":
         try:
@@ -137,83 +443,338 @@ def download_file(content_base64, metadata):
     
     if not file_copied:
         # Fallback: copy file path to clipboard
+        import pyperclip
         pyperclip.copy(str(file_path))
         print(f"✓ Downloaded file: {file_path}")
         print(f"  Original: {metadata.get('original_path', 'unknown')}")
-        print(f"  Size: {len(file_content)} bytes")
+        print(f"  Size: {size} bytes")
         print(f"  Path copied to clipboard (could not copy file to clipboard)")
     else:
         print(f"✓ Downloaded file: {file_path}")
         print(f"  Original: {metadata.get('original_path', 'unknown')}")
-        print(f"  Size: {len(file_content)} bytes")
+        print(f"  Size: {size} bytes")
         print(f"  File copied to clipboard")
 
 
+def _safe_members(tar, dest):
+    """Members of tar that stay inside dest (for Pythons without tarfile extraction filters)"""
+    dest = os.path.realpath(dest)
+    for member in tar:
+        target = os.path.realpath(os.path.join(dest, member.name))
+        if os.path.commonpath([target, dest]) == dest and (member.isfile() or member.isdir()):
+            yield member
+
+
+def download_bundle(conditional):
+    """
+    Stream the stored bundle and extract it while it arrives
+    Files are unpacked into a hidden staging directory, then each top-level
+    entry is moved into DOWNLOAD_DIR (renamed if the name is taken).
+    Returns the ETag, or None if the bundle has not changed.
+    """
+    import tarfile
+
+    DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    headers = {**conditional, "Accept-Encoding": ACCEPT_ENCODING}
+    with http.get(f"{API_URL}/download/bundle", headers=headers, stream=True, timeout=(10, None)) as response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        metadata = json.loads(unquote(response.headers.get("X-EasyCopy-Metadata", "{}")))
+        staging = DOWNLOAD_DIR / f".{metadata.get('name', 'bundle')}.part"
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir()
+        try:
+            stream = decoded_reader(response.raw, response.headers.get("Content-Encoding"))
+            with stream, tarfile.open(fileobj=stream, mode="r|") as tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(staging, filter="data")
+                else:
+                    tar.extractall(staging, members=_safe_members(tar, staging))
+            paths = []
+            for item in sorted(staging.iterdir()):
+                target = unique_path(DOWNLOAD_DIR, item.name)
+                os.replace(item, target)
+                paths.append(target)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        etag = response.headers.get("ETag")
+
+    copy_paths_to_clipboard(paths, metadata)
+    return etag
+
+
+def copy_paths_to_clipboard(paths, metadata):
+    """Copy downloaded files and directories to the clipboard (platform-specific)"""
+    copied = False
+    if sys.platform == "darwin":
+        try:
+            from AppKit import NSPasteboard, NSFilenamesPboardType
+            pb = NSPasteboard.generalPasteboard()
+            pb.clearContents()
+            pb.setPropertyList_forType_([str(path) for path in paths], NSFilenamesPboardType)
+            copied = True
+        except (ImportError, Exception):
+            pass
+    if not copied:
+        import pyperclip
+        pyperclip.copy("\n".join(str(path) for path in paths))
+
+    print(f"✓ Downloaded bundle: {metadata.get('files', '?')} files ({metadata.get('size', 0)} bytes)")
+    for path in paths:
+        print(f"  {path}")
+    print("  Files copied to clipboard" if copied else "  Paths copied to clipboard")
+
+
+def download_file(content_base64, metadata, sha256):
+    """Download file and save to disk, copy file to clipboard"""
+    # Decode base64 content a slice at a time (a multiple of 4 characters)
+    step = 4 * 1024 * 1024
+    chunks = (base64.b64decode(content_base64[i:i + step]) for i in range(0, len(content_base64), step))
+    file_path = save_download(chunks, metadata.get('filename', 'downloaded_file'), sha256)
+
+    copy_file_to_clipboard(file_path, metadata, file_path.stat().st_size)
+
+
 def download_image(content_base64, metadata):
-    """Download image and put in clipboard"""
-    # Decode base64 content
-    image_bytes = base64.b64decode(content_base64)
-    image = Image.open(BytesIO(image_bytes))
+    """Put an image from /download in the clipboard"""
+    # Decode base64 content (the image itself stays encoded)
+    copy_image_to_clipboard(base64.b64decode(content_base64), metadata)
+
+
+def download_image_raw(conditional):
+    """
+    Fetch the stored image from /download/image into memory and put it in
+    the clipboard. Returns the ETag, or None if the image has not changed.
+    Raises ValueError if the bytes do not hash to the server's SHA-256
+    """
+    headers = {**conditional, "Accept-Encoding": ACCEPT_ENCODING}
+    with http.get(f"{API_URL}/download/image", headers=headers, stream=True, timeout=(10, None)) as response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        with decoded_reader(response.raw, response.headers.get("Content-Encoding")) as stream:
+            image_bytes = stream.read()
+        etag = response.headers["ETag"]
+        metadata = json.loads(unquote(response.headers.get("X-EasyCopy-Metadata", "{}")))
+    if hashlib.sha256(image_bytes).hexdigest() != etag_digest(etag):
+        raise ValueError("Downloaded image does not match the server's SHA-256, discarded")
+    copy_image_to_clipboard(image_bytes, metadata)
+    return etag
+
+
+def copy_image_to_clipboard(image_bytes, metadata):
+    """Put encoded image bytes in the clipboard; saved to a file only if that fails"""
+    import pyperclip
+
+    image_format = metadata.get('format', 'PNG')
     
     # Try to set image to clipboard
-    if set_clipboard_image(image):
+    if set_clipboard_image(image_bytes):
         print(f"✓ Downloaded image to clipboard ({metadata.get('dimensions', 'unknown')})")
     else:
-        # Fallback: save to file and copy path
+        # Fallback: save the received bytes to file and copy path
         DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
-        file_path = DOWNLOAD_DIR / "clipboard_image.png"
-        
-        counter = 1
-        while file_path.exists():
-            file_path = DOWNLOAD_DIR / f"clipboard_image_{counter}.png"
-            counter += 1
-        
-        image.save(file_path)
+        file_path = unique_path(DOWNLOAD_DIR, f"clipboard_image.{image_format.lower()}")
+        file_path.write_bytes(image_bytes)
         pyperclip.copy(str(file_path))
         
         print(f"✓ Downloaded image to: {file_path}")
         print(f"  (Could not set to clipboard directly, path copied instead)")
 
 
-def main():
-    """Main download logic"""
-    try:
-        # Download from server
-        response = requests.get(f"{SERVER_URL}/download")
+def sync_raw(content_type, conditional):
+    """
+    Download a file, image or bundle through its own raw endpoint
+    Files use resumable range requests or a delta, images are read straight
+    into memory and bundles are unpacked as they arrive
+    """
+    if content_type == "file":
+        head = http.head(f"{API_URL}/download/file",
+                         headers={**conditional, "Accept-Encoding": ACCEPT_ENCODING})
+        if head.status_code == 304:
+            print("✓ Clipboard already up to date")
+            return True
+        head.raise_for_status()
+        if not download_file_delta(head):
+            # Up to one segment there is nothing to parallelise or resume, and
+            # without range support the file can only be streamed
+            if (int(head.headers["Content-Length"]) <= SEGMENT_SIZE
+                    or head.headers.get("Accept-Ranges") != "bytes"):
+                download_file_stream()
+            else:
+                download_file_ranged(head)
+        save_last_etag(head.headers["ETag"])
+        return True
+    
+    etag = download_image_raw(conditional) if content_type == "image" else download_bundle(conditional)
+    if etag is None:
+        print("✓ Clipboard already up to date")
+    save_last_etag(etag)
+    return True
+
+
+def sync(force=False):
+    """
+    Download the current clipboard content into the local clipboard
+    Returns False if the server had nothing usable
+    """
+    # Skip the transfer and clipboard write if we already have this content
+    last_etag = None if force else load_last_etag()
+    conditional = {"If-None-Match": last_etag} if last_etag else {}
+    
+    # One conditional request covers the common case, a small text; its
+    # headers tell when the content is better fetched another way
+    # requests advertises and transparently decodes the encodings it supports
+    response = http.get(f"{API_URL}/download", headers=conditional, stream=True, timeout=(10, None))
+    if response.status_code == 304:
+        response.close()
+        print("✓ Clipboard already up to date")
+        return True
+    content_type = response.headers.get("X-EasyCopy-Type")
+    large_text = (content_type == "text" and load_text_base() is not None
+                  and int(response.headers.get("X-EasyCopy-Size", "0")) >= TEXT_DELTA_THRESHOLD)
+    if response.status_code == 200 and (content_type in ("file", "image", "bundle") or large_text):
+        response.close()
+        if content_type != "text":
+            return sync_raw(content_type, conditional)
+        # Text is fetched as a delta when a previous version is at hand
+        if download_text_delta(conditional):
+            return True
+        response = http.get(f"{API_URL}/download", headers=conditional)
+        if response.status_code == 304:
+            print("✓ Clipboard already up to date")
+            return True
+    
+    with response:
         response.raise_for_status()
-        
         data = response.json()
-        content_type = data.get("type")
-        content = data.get("content")
-        metadata = data.get("metadata", {})
-        
-        if not content_type or not content:
-            print("✗ No valid content received from server")
+    content_type = data.get("type")
+    content = data.get("content")
+    metadata = data.get("metadata", {})
+    
+    if not content_type or not content:
+        print("✗ No valid content received from server")
+        return False
+    
+    # Process based on type
+    if content_type == "text":
+        download_text(content, metadata)
+    elif content_type == "file":
+        download_file(content, metadata, etag_digest(response.headers.get("ETag", "")))
+    elif content_type == "image":
+        download_image(content, metadata)
+    else:
+        print(f"✗ Unknown content type: {content_type}")
+        return False
+    
+    save_last_etag(response.headers.get("ETag"))
+    return True
+
+
+# Where download_to() fetches each type of content
+TYPE_ENDPOINTS = {"text": "/download/text", "file": "/download/file", "image": "/download/image",
+                  "bundle": "/download/bundle"}
+
+
+def download_to(out):
+    """
+    Stream the current content, whatever its type, to a binary file object
+    (standard output for `download.py -`), decoding it on the way
+    Nothing is written to disk or to the clipboard
+    """
+    headers = {"Accept-Encoding": ACCEPT_ENCODING}
+    response = http.get(f"{API_URL}/download/file", headers=headers, stream=True, timeout=(10, None))
+    content_type = response.headers.get("X-EasyCopy-Type")
+    if response.status_code == 404 and content_type in TYPE_ENDPOINTS:
+        response.close()
+        response = http.get(f"{API_URL}{TYPE_ENDPOINTS[content_type]}", headers=headers, stream=True,
+                            timeout=(10, None))
+    with response:
+        response.raise_for_status()
+        with decoded_reader(response.raw, response.headers.get("Content-Encoding")) as stream:
+            try:
+                shutil.copyfileobj(stream, out, 1024 * 1024)
+                out.flush()
+            except BrokenPipeError:
+                # The reader stopped early (e.g. `| head`); keep Python from
+                # failing again when it flushes standard output at exit
+                os.dup2(os.open(os.devnull, os.O_WRONLY), out.fileno())
+
+
+def iter_events():
+    """Yield change events from the server's Server-Sent Events stream"""
+    with http.get(f"{API_URL}/events", stream=True, timeout=(10, None)) as response:
+        response.raise_for_status()
+        event_name, data = None, []
+        for line in response.iter_lines(decode_unicode=True):
+            if line == "":
+                if event_name == "change" and data:
+                    yield json.loads("\n".join(data))
+                event_name, data = None, []
+            elif line.startswith("event:"):
+                event_name = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data.append(line[len("data:"):].strip())
+
+
+def watch():
+    """Keep the local clipboard in sync by following the server's change stream"""
+    print(f"Watching {API_URL} for clipboard changes (Ctrl+C to stop)")
+    while True:
+        try:
+            for event in iter_events():
+                if not event.get("type") or f'"{event.get("sha256")}"' == load_last_etag():
+                    continue
+                try:
+                    sync()
+                except requests.exceptions.HTTPError as e:
+                    print(f"✗ Error downloading from server: {e}")
+                except (ValueError, RuntimeError) as e:
+                    # A corrupt or overtaken download: the next change is fetched anyway
+                    print(f"✗ Error: {e}")
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.HTTPError):
+            print(f"✗ Lost connection to {SERVER_URL}, reconnecting in {WATCH_RECONNECT_DELAY}s")
+            time.sleep(WATCH_RECONNECT_DELAY)
+
+
+def main():
+    """Main download logic"""
+    parser = argparse.ArgumentParser(description="Download clipboard content from the EasyCopy server")
+    parser.add_argument("--force", action="store_true",
+                        help="download even if the content has not changed since the last run")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and download every change pushed by the server")
+    parser.add_argument("target", nargs="?", choices=["-"],
+                        help="- to write the content to standard output instead of the clipboard")
+    args = parser.parse_args()
+
+    # With -, standard output carries the content and messages go to standard error
+    output = sys.stdout.buffer if args.target == "-" else None
+    with redirect_stdout(sys.stderr) if output else nullcontext():
+        try:
+            if output:
+                download_to(output)
+            elif args.watch:
+                watch()
+            elif not sync(force=args.force):
+                sys.exit(1)
+
+        except KeyboardInterrupt:
+            pass
+        except requests.exceptions.ConnectionError:
+            print(f"✗ Error: Cannot connect to server at {SERVER_URL}")
             sys.exit(1)
-        
-        # Process based on type
-        if content_type == "text":
-            download_text(content, metadata)
-        elif content_type == "file":
-            download_file(content, metadata)
-        elif content_type == "image":
-            download_image(content, metadata)
-        else:
-            print(f"✗ Unknown content type: {content_type}")
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 404:
+                print("✗ No clipboard data available on server")
+            else:
+                print(f"✗ Error downloading from server: {e}")
+            sys.exit(1)
+        except Exception as e:
+            print(f"✗ Error: {e}")
             sys.exit(1)
-            
-    except requests.exceptions.ConnectionError:
-        print(f"✗ Error: Cannot connect to server at {SERVER_URL}")
-        sys.exit(1)
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 404:
-            print("✗ No clipboard data available on server")
-        else:
-            print(f"✗ Error downloading from server: {e}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"✗ Error: {e}")
-        sys.exit(1)
 
 
 if __name__ == "__main__":
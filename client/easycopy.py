@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+EasyCopy Client
+Fast entry point for keyboard shortcuts: `upload` and `download` are handed
+to the running daemon (see daemon.py) and only run in this process when no
+daemon is running.
+
+Usage: easycopy.py daemon | upload [--type TYPE] [- [--name NAME]] | download [--force] [--watch] [-]
+"""
+
+import importlib
+import sys
+
+import daemon
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("daemon", *daemon.COMMANDS):
+        print(__doc__.strip().splitlines()[-1])
+        sys.exit(2)
+    command, argv = sys.argv[1], sys.argv[2:]
+    if command == "daemon":
+        daemon.serve()
+        return
+
+    # --watch runs until interrupted, and - streams this process's standard
+    # input or output, so both keep their own process
+    if "--watch" not in argv and "-" not in argv:
+        status = daemon.request(command, argv)
+        if status is not None:
+            sys.exit(status)
+    sys.argv = [f"{command}.py", *argv]
+    importlib.import_module(command).main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+EasyCopy transfer helpers shared by the upload and download clients
+Content-Encoding support: gzip always, zstd when the optional zstandard
+package is installed
+"""
+
+import gzip
+import os
+import zlib
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip always works
+    zstandard = None
+
+# Encodings this client can produce and decode, in order of preference
+ENCODINGS = ("zstd", "gzip") if zstandard else ("gzip",)
+ACCEPT_ENCODING = ", ".join(ENCODINGS)
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Payloads smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 1024
+
+# MIME types that are already compressed (prefix match) - sent as-is
+INCOMPRESSIBLE_TYPES = (
+    "image/png", "image/jpeg", "image/gif", "image/webp", "image/avif", "image/heic",
+    "video/", "audio/",
+    "application/zip", "application/gzip", "application/x-gzip", "application/x-bzip2",
+    "application/x-xz", "application/x-7z-compressed", "application/x-rar-compressed",
+    "application/vnd.rar", "application/zstd", "application/java-archive", "application/pdf",
+    "application/vnd.openxmlformats-officedocument", "application/epub+zip",
+    "font/woff", "font/woff2",
+)
+
+# The last large text uploaded or downloaded (private to the user), the base
+# the next text is sent or fetched as a delta against
+TEXT_CACHE_FILE = Path(os.environ.get("EASYCOPY_TEXT_CACHE",
+                                      Path.home() / ".cache" / "easycopy" / "last_text.txt"))
+TEXT_DELTA_THRESHOLD = 64 * 1024
+
+
+def new_session(pool_size=10):
+    """
+    HTTP session reusing keep-alive connections for all requests of a run (and
+    of every run while the daemon keeps the client loaded)
+    pool_size connections per host are kept open for parallel transfers
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=max(pool_size, 1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def is_compressible(mime_type):
+    """False for MIME types that are already compressed"""
+    mime_type = (mime_type or "application/octet-stream").lower()
+    return not mime_type.startswith(INCOMPRESSIBLE_TYPES)
+
+
+def compress_chunks(source, encoding, chunk_size=1024 * 1024):
+    """Yield the contents of a binary file object (or an iterable of bytes) compressed with encoding"""
+    if encoding == "zstd":
+        comp = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    else:
+        comp = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    chunks = iter(lambda: source.read(chunk_size), b"") if hasattr(source, "read") else source
+    for chunk in chunks:
+        data = comp.compress(chunk)
+        if data:
+            yield data
+    yield comp.flush()
+
+
+def open_decoded(path, encoding):
+    """Open a file holding encoded bytes as a readable stream of the decoded bytes"""
+    if encoding == "gzip":
+        return gzip.open(path, "rb")
+    return decoded_reader(open(path, "rb"), encoding)
+
+
+def decoded_reader(source, encoding):
+    """
+    Readable stream of the decoded bytes of a binary stream (a file or an
+    HTTP response's raw stream - requests cannot decode zstd itself)
+    """
+    if encoding == "gzip":
+        return gzip.GzipFile(fileobj=source, mode="rb")
+    if encoding == "zstd":
+        return zstandard.ZstdDecompressor().stream_reader(source, closefd=True)
+    return source
+
+
+def load_text_base():
+    """UTF-8 bytes of the last large text synced, or None"""
+    try:
+        return TEXT_CACHE_FILE.read_bytes()
+    except OSError:
+        return None
+
+
+def save_text_base(data):
+    """Keep the UTF-8 bytes of a text just synced as the base of the next text delta"""
+    if len(data) < TEXT_DELTA_THRESHOLD:
+        return
+    tmp_path = TEXT_CACHE_FILE.with_name(f".{TEXT_CACHE_FILE.name}.{os.getpid()}")
+    try:
+        TEXT_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, TEXT_CACHE_FILE)
+    except OSError:
+        pass  # Only a missed optimisation: the next text is sent whole
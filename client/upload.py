@@ -7,105 +7,466 @@ Supports: text, files, and images
 
 import sys
 import os
-import base64
+import argparse
+import functools
 import json
+import hashlib
 import mimetypes
+import mmap
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
+from urllib.parse import quote
 import requests
-import pyperclip
-from PIL import ImageGrab, Image
 from io import BytesIO
 
+# Pillow, pyperclip, tarfile and the delta/parallel upload machinery are
+# imported by the functions that need them: a text copy should not pay for
+# loading image support, and each run is a fresh interpreter
+from transfer import (ENCODINGS, MIN_COMPRESS_SIZE, TEXT_DELTA_THRESHOLD, compress_chunks, is_compressible,
+                      load_text_base, new_session, save_text_base)
+
 # Server configuration
 SERVER_URL = os.environ.get("EASYCOPY_SERVER", "http://localhost:8000")
 
+# Named channel on a shared server (empty: the server's default channel)
+CHANNEL = os.environ.get("EASYCOPY_CHANNEL", "")
+API_URL = f"{SERVER_URL}/c/{quote(CHANNEL, safe='')}" if CHANNEL else SERVER_URL
+
+# Files of at least CHUNKED_THRESHOLD bytes are sent as CHUNK_SIZE chunks
+# over PARALLEL_UPLOADS concurrent connections, resumable after interruption
+PARALLEL_UPLOADS = int(os.environ.get("EASYCOPY_PARALLEL", "4"))
+CHUNK_SIZE = int(os.environ.get("EASYCOPY_CHUNK_SIZE", str(8 * 1024 * 1024)))
+CHUNKED_THRESHOLD = 4 * CHUNK_SIZE
+MAX_RETRIES = 3
+
+# Files are sent from a memory map READ_SIZE bytes at a time; uploads of at
+# least PROGRESS_THRESHOLD bytes show their progress on a terminal
+READ_SIZE = 1024 * 1024
+PROGRESS_THRESHOLD = 16 * 1024 * 1024
+
+# Payloads of at least this size are offered by hash first, so re-uploading
+# content the server already stores skips sending the body
+DEDUP_THRESHOLD = 256 * 1024
+
+# Files of at least this size are sent as a delta against the previous
+# version with the same name in the server's history, unless more than
+# DELTA_MAX_CHANGED of the file would have to be sent anyway
+DELTA_THRESHOLD = 4 * 1024 * 1024
+DELTA_MAX_CHANGED = 0.5
+
+# Images are sent in this format: "png", "webp" (lossy, EASYCOPY_WEBP_QUALITY)
+# or "webp-lossless". A copied image already in the format is sent as it is;
+# anything else is encoded with fast settings (screenshots are large, and a
+# few percent of size matters less than hundreds of milliseconds in zlib)
+IMAGE_FORMAT = os.environ.get("EASYCOPY_IMAGE_FORMAT", "png").lower()
+PNG_COMPRESS_LEVEL = int(os.environ.get("EASYCOPY_PNG_LEVEL", "1"))
+WEBP_QUALITY = int(os.environ.get("EASYCOPY_WEBP_QUALITY", "90"))
+
+# Connections are kept alive and reused by every request
+http = new_session(PARALLEL_UPLOADS)
+
+
+def _appkit_files():
+    from AppKit import NSPasteboard, NSFilenamesPboardType
+    files = NSPasteboard.generalPasteboard().propertyListForType_(NSFilenamesPboardType)
+    return [str(f) for f in files] if files else None
+
+
+def _osascript_files():
+    import subprocess
+    result = subprocess.run(
+        ['osascript', '-e', 'the clipboard as «class furl»'],
+        capture_output=True,
+        text=True,
+        timeout=2
+    )
+    # Only proceed if osascript succeeded (exit code 0)
+    # and returned a properly formatted file URL
+    if result.returncode == 0 and result.stdout.strip():
+        # Parse the file path from output
+        # Format: "file Macintosh HD:Users:name:path:to:file.txt"
+        output = result.stdout.strip()
+        # Must start with "file " followed by a valid Mac path (contains colons)
+        if output.startswith('file ') and ':' in output[5:]:
+            # Remove "file " prefix and convert Mac path to Unix path
+            mac_path = output[5:]  # Remove "file "
+            # Remove drive name (e.g., "Macintosh HD:")
+            if ':' in mac_path:
+                mac_path = mac_path.split(':', 1)[1]
+            # Convert colon-separated path to slash-separated
+            unix_path = '/' + mac_path.replace(':', '/')
+            # Verify the path actually exists before returning
+            if Path(unix_path).exists():
+                return [unix_path]
+    return None
+
+
+def _gtk_files():
+    from gi.repository import Gtk, Gdk
+    clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
+    # Check for file URIs
+    if clipboard.wait_is_uris_available():
+        uris = clipboard.wait_for_uris()
+        if uris:
+            # Convert URIs to file paths
+            return [uri.replace('file://', '') for uri in uris]
+    return None
+
+
+def _win32_files():
+    import win32clipboard
+    win32clipboard.OpenClipboard()
+    try:
+        # CF_HDROP format contains file paths
+        return win32clipboard.GetClipboardData(win32clipboard.CF_HDROP) or None
+    except Exception:
+        return None
+    finally:
+        win32clipboard.CloseClipboard()
+
+
+@functools.cache
+def clipboard_files_backend():
+    """
+    The function reading copied file paths on this platform, or None
+    Probed once per process (the daemon keeps the answer for every run)
+    """
+    try:
+        if sys.platform == "darwin":
+            try:
+                import AppKit  # noqa: F401
+                return _appkit_files
+            except ImportError:
+                return _osascript_files  # Slower: runs a process per call
+        if sys.platform.startswith("linux"):
+            import gi
+            gi.require_version('Gtk', '3.0')
+            from gi.repository import Gtk, Gdk  # noqa: F401
+            return _gtk_files
+        if sys.platform == "win32":
+            import win32clipboard  # noqa: F401
+            return _win32_files
+    except (ImportError, ValueError):
+        pass
+    return None
+
 
 def get_clipboard_files():
     """
     Try to get file paths from clipboard
-    Platform-specific implementation
+    Platform-specific implementation (see clipboard_files_backend)
     """
-    # On macOS, we can check if files are in clipboard
-    if sys.platform == "darwin":
-        # Try AppKit first
-        try:
-            from AppKit import NSPasteboard, NSFilenamesPboardType
-            pb = NSPasteboard.generalPasteboard()
-            files = pb.propertyListForType_(NSFilenamesPboardType)
-            if files and len(files) > 0:
-                return [str(f) for f in files]
-        except (ImportError, Exception):
-            pass
-        
-        # Fallback: use osascript
-        try:
-            import subprocess
-            result = subprocess.run(
-                ['osascript', '-e', 'the clipboard as «class furl»'],
-                capture_output=True,
-                text=True,
-                timeout=2
-            )
-            # Only proceed if osascript succeeded (exit code 0)
-            # and returned a properly formatted file URL
-            if result.returncode == 0 and result.stdout.strip():
-                # Parse the file path from output
-                # Format: "file Macintosh HD:Users:name:path:to:file.txt"
-                output = result.stdout.strip()
-                # Must start with "file " followed by a valid Mac path (contains colons)
-                if output.startswith('file ') and ':' in output[5:]:
-                    # Remove "file " prefix and convert Mac path to Unix path
-                    mac_path = output[5:]  # Remove "file "
-                    # Remove drive name (e.g., "Macintosh HD:")
-                    if ':' in mac_path:
-                        mac_path = mac_path.split(':', 1)[1]
-                    # Convert colon-separated path to slash-separated
-                    unix_path = '/' + mac_path.replace(':', '/')
-                    # Verify the path actually exists before returning
-                    if Path(unix_path).exists():
-                        return [unix_path]
-        except Exception:
-            pass
-    
-    # On Linux with GTK
-    elif sys.platform.startswith("linux"):
+    backend = clipboard_files_backend()
+    if backend is None:
+        return None
+    try:
+        return backend()
+    except Exception:
+        return None
+
+
+def send_body(method, url, body, headers, compress=False, timeout=None):
+    """
+    Send a seekable binary file object or FileBody as the request body without reading it whole
+    With compress=True the body is compressed on the fly (Content-Encoding),
+    falling back to the next encoding if the server rejects one with 415.
+    A busy (503) or rate-limiting (429) server is asked again after its Retry-After delay
+    """
+    start = body.tell()
+    for attempt in range(MAX_RETRIES):
+        body.seek(start)
+        response = _send_encoded(method, url, body, headers, compress, timeout)
+        if response.status_code not in (429, 503) or attempt == MAX_RETRIES - 1:
+            return response
         try:
-            import gi
-            gi.require_version('Gtk', '3.0')
-            from gi.repository import Gtk, Gdk
-            
-            clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
-            
-            # Check for file URIs
-            if clipboard.wait_is_uris_available():
-                uris = clipboard.wait_for_uris()
-                if uris:
-                    # Convert URIs to file paths
-                    return [uri.replace('file://', '') for uri in uris]
-        except (ImportError, Exception):
-            pass
-    
-    # On Windows
-    elif sys.platform == "win32":
+            delay = float(response.headers.get("Retry-After", "1"))
+        except ValueError:
+            delay = 1
+        time.sleep(min(delay, 30))
+    return response
+
+
+def _send_encoded(method, url, body, headers, compress, timeout):
+    if not compress:
+        return http.request(method, url, data=body, headers=headers, timeout=timeout)
+    start = body.tell()
+    for encoding in ENCODINGS:
+        body.seek(start)
+        response = http.request(method, url, data=compress_chunks(body, encoding),
+                                    headers={**headers, "Content-Encoding": encoding}, timeout=timeout)
+        if response.status_code != 415:
+            break
+    return response
+
+
+def upload_raw(content_type, body, metadata, compress=False):
+    """
+    Stream raw bytes to the server's /upload/raw endpoint
+    body is a binary file object or a FileBody (streamed by requests without reading it whole)
+    """
+    headers = {
+        "Content-Type": "application/octet-stream",
+        "X-EasyCopy-Type": content_type,
+        "X-EasyCopy-Metadata": quote(json.dumps(metadata)),
+    }
+    response = send_body("PUT", f"{API_URL}/upload/raw", body, headers, compress=compress)
+    response.raise_for_status()
+    return response.json()
+
+
+@contextmanager
+def mapped(path):
+    """
+    Read-only memory map of a file (b"" for an empty file, which cannot be mapped)
+    Pages are read on demand and can be dropped again, so files larger than
+    the available memory can be hashed and sent
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+class FileBody:
+    """
+    Request body of bytes [start, end) of a memory-mapped file
+    Iterated in chunk_size pieces with a known length (so requests sends a
+    Content-Length, not 16 KB reads or chunked encoding). The bytes are
+    hashed and counted as they are sent and each piece is reported to
+    progress(byte count); seek(0) starts over for a retry
+    """
+
+    def __init__(self, data, start=0, end=None, chunk_size=READ_SIZE, progress=None):
+        self.data = data
+        self.start = start
+        self.end = len(data) if end is None else end
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self._pos = 0
+        self._hash = hashlib.sha256()
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __iter__(self):
+        while self._pos < len(self):
+            offset = self.start + self._pos
+            chunk = self.data[offset:min(offset + self.chunk_size, self.end)]
+            self._pos += len(chunk)
+            self._hash.update(chunk)
+            if self.progress:
+                self.progress(len(chunk))
+            yield chunk
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset):
+        if offset != 0:
+            raise ValueError("FileBody can only be rewound to the start")
+        if self.progress and self._pos:
+            self.progress(-self._pos)
+        self._pos = 0
+        self._hash = hashlib.sha256()
+
+    def hexdigest(self):
+        """SHA-256 of the bytes sent since the last rewind"""
+        return self._hash.hexdigest()
+
+
+class Progress:
+    """
+    Byte counter for a large upload (called from several threads for chunked
+    uploads) showing a percentage while output goes to a terminal
+    """
+
+    def __init__(self, total, label):
+        self.total = total
+        self.label = label
+        self.sent = 0
+        self.shown = None
+        self._lock = threading.Lock()
+        self._visible = total >= PROGRESS_THRESHOLD and getattr(sys.stdout, "isatty", lambda: False)()
+
+    def __call__(self, count):
+        with self._lock:
+            self.sent += count
+            percent = self.sent * 100 // max(self.total, 1)
+            if self._visible and percent != self.shown:
+                self.shown = percent
+                sys.stdout.write(f"\r  Uploading {self.label}: {percent}%")
+                sys.stdout.flush()
+
+    def close(self):
+        if self.shown is not None:
+            sys.stdout.write("\r\033[K")
+            sys.stdout.flush()
+
+
+def upload_by_hash(content_type, sha256, metadata):
+    """
+    Ask the server to reuse content it already stores
+    Returns the server response, or None if the body has to be sent
+    """
+    payload = {"type": content_type, "sha256": sha256, "metadata": metadata}
+    response = http.post(f"{API_URL}/upload/hash", json=payload)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
+def _put_chunk(session_id, data, index, chunk_size, compress=False, progress=None):
+    """PUT chunk index of a mapped file, retrying on connection problems"""
+    start = index * chunk_size
+    body = FileBody(data, start, min(start + chunk_size, len(data)), progress=progress)
+    url = f"{API_URL}/upload/sessions/{session_id}/chunks/{index}"
+    for attempt in range(MAX_RETRIES):
         try:
-            import win32clipboard
-            win32clipboard.OpenClipboard()
-            try:
-                # CF_HDROP format contains file paths
-                files = win32clipboard.GetClipboardData(win32clipboard.CF_HDROP)
-                win32clipboard.CloseClipboard()
-                if files:
-                    return files
-            except:
-                win32clipboard.CloseClipboard()
-        except ImportError:
-            pass
-    
+            body.seek(0)
+            response = send_body("PUT", url, body, {"Content-Type": "application/octet-stream"},
+                                 compress=compress, timeout=60)
+            response.raise_for_status()
+            return
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == MAX_RETRIES - 1:
+                raise
+
+
+def upload_chunked(content_type, data, metadata, sha256, progress=None):
+    """
+    Upload a mapped file through an upload session
+    Chunks go up in parallel; re-running after an interruption only sends
+    the chunks the server does not have yet
+    """
+    size = len(data)
+    response = http.post(f"{API_URL}/upload/sessions", json={
+        "type": content_type,
+        "size": size,
+        "chunk_size": CHUNK_SIZE,
+        "sha256": sha256,
+        "metadata": metadata,
+    })
+    response.raise_for_status()
+    session = response.json()
+    session_id, chunk_size = session["session_id"], session["chunk_size"]
+
+    received = set(session["received"])
+    missing = [i for i in range(session["chunk_count"]) if i not in received]
+    if received:
+        print(f"  Resuming upload ({len(received)}/{session['chunk_count']} chunks already on server)")
+        if progress:
+            progress(sum(min(chunk_size, size - i * chunk_size) for i in received))
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    compress = is_compressible(metadata.get("mime_type"))
+    with ThreadPoolExecutor(max_workers=max(PARALLEL_UPLOADS, 1)) as pool:
+        for future in [pool.submit(_put_chunk, session_id, data, i, chunk_size, compress, progress)
+                       for i in missing]:
+            future.result()
+
+    response = http.post(f"{API_URL}/upload/sessions/{session_id}/commit", json={"sha256": sha256})
+    response.raise_for_status()
+    return response.json()
+
+
+def find_previous_version(filename):
+    """The newest file in the server's history with this name, or None"""
+    response = http.get(f"{API_URL}/history")
+    response.raise_for_status()
+    for entry in response.json()["entries"]:
+        if entry["type"] == "file" and entry["metadata"].get("filename") == filename:
+            return entry
     return None
 
 
+def upload_delta(path, data, sha256, metadata):
+    """
+    Send only what changed since the previous version of the file on the server
+    (data is the file, mapped). Returns None if there is no usable previous
+    version (send the whole file)
+    """
+    from delta import plan_delta
+
+    base = find_previous_version(path.name)
+    if base is None:
+        return None
+    response = http.get(f"{API_URL}/history/{base['id']}/signature")
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    block_size = int(response.headers["X-EasyCopy-Block-Size"])
+    base_size = int(response.headers["X-EasyCopy-Size"])
+
+    plan = plan_delta(data, response.content, block_size, base_size, max_literal=int(len(data) * DELTA_MAX_CHANGED))
+    if plan is None:
+        return None
+    return _put_delta("file", data, plan, block_size, {"X-EasyCopy-Base": str(base["id"])}, sha256, metadata)
+
+
+def _put_delta(content_type, data, plan, block_size, base_headers, sha256, metadata):
+    """Send data as the delta plan; returns None if the server no longer has the base"""
+    from delta import encode_delta, literal_size
+
+    headers = {
+        "Content-Type": "application/octet-stream",
+        "X-EasyCopy-Type": content_type,
+        "X-EasyCopy-Metadata": quote(json.dumps(metadata)),
+        "X-EasyCopy-Block-Size": str(block_size),
+        "X-EasyCopy-SHA256": sha256,
+        "X-EasyCopy-Size": str(len(data)),
+        **base_headers,
+    }
+    response = http.put(f"{API_URL}/upload/delta", data=encode_delta(data, plan), headers=headers)
+    if response.status_code == 404:
+        return None  # The previous version was evicted meanwhile
+    response.raise_for_status()
+    print(f"  Sent as a delta: {literal_size(plan)} changed bytes")
+    return response.json()
+
+
+def upload_text_delta(data, sha256, metadata):
+    """
+    Send only what changed since the last large text synced (data is the
+    new text, UTF-8 encoded). Returns None if there is no usable base
+    """
+    base = load_text_base()
+    if base is None or base == data:
+        return None
+    from delta import block_size_for, make_signature, plan_delta
+
+    # Both versions are here: the signature is computed locally, not fetched
+    block_size = block_size_for(len(base))
+    signature = make_signature(base[i:i + block_size] for i in range(0, len(base), block_size))
+    plan = plan_delta(data, signature, block_size, len(base), max_literal=int(len(data) * DELTA_MAX_CHANGED))
+    if plan is None:
+        return None
+    base_headers = {"X-EasyCopy-Base-SHA256": hashlib.sha256(base).hexdigest()}
+    return _put_delta("text", data, plan, block_size, base_headers, sha256, metadata)
+
+
 def upload_text(text):
     """Upload text content to server"""
+    encoded = text.encode("utf-8")
+    sha256 = hashlib.sha256(encoded).hexdigest() if len(encoded) >= TEXT_DELTA_THRESHOLD else None
+    if len(encoded) >= DEDUP_THRESHOLD:
+        result = upload_by_hash("text", sha256, {"length": len(text)})
+        if result is not None:
+            save_text_base(encoded)
+            print(f"✓ Uploaded text ({len(text)} characters, already on server)")
+            return result
+    if len(encoded) >= TEXT_DELTA_THRESHOLD:
+        result = upload_text_delta(encoded, sha256, {"length": len(text)})
+        if result is not None:
+            save_text_base(encoded)
+            print(f"✓ Uploaded text ({len(text)} characters)")
+            return result
+
     payload = {
         "type": "text",
         "content": text,
@@ -114,14 +475,23 @@ def upload_text(text):
         }
     }
     
-    response = requests.post(f"{SERVER_URL}/upload", json=payload)
+    # Large text goes up compressed
+    body = BytesIO(json.dumps(payload).encode("utf-8"))
+    response = send_body("POST", f"{API_URL}/upload", body, {"Content-Type": "application/json"},
+                         compress=len(encoded) >= MIN_COMPRESS_SIZE)
     response.raise_for_status()
+    save_text_base(encoded)
     print(f"✓ Uploaded text ({len(text)} characters)")
     return response.json()
 
 
-def upload_file(file_path):
-    """Upload file content to server"""
+def upload_file(file_path, progress=None):
+    """
+    Upload file content to server
+    The file is sent from a memory map, never read into memory whole.
+    progress is called with the byte count of every piece sent (default: a
+    percentage on the terminal for large files)
+    """
     path = Path(file_path)
     
     if not path.exists():
@@ -132,96 +502,340 @@ def upload_file(file_path):
         # Not a regular file, skip
         return False
     
-    # Read file and encode to base64
-    with open(path, "rb") as f:
-        file_content = f.read()
-    
-    content_base64 = base64.b64encode(file_content).decode('utf-8')
-    
     # Detect mime type
     mime_type, _ = mimetypes.guess_type(str(path))
+    file_size = path.stat().st_size
     
-    payload = {
-        "type": "file",
-        "content": content_base64,
-        "metadata": {
-            "filename": path.name,
-            "original_path": str(path.absolute()),
-            "size": len(file_content),
-            "mime_type": mime_type or "application/octet-stream"
-        }
+    metadata = {
+        "filename": path.name,
+        "original_path": str(path.absolute()),
+        "size": file_size,
+        "mime_type": mime_type or "application/octet-stream"
     }
     
-    response = requests.post(f"{SERVER_URL}/upload", json=payload)
+    display = Progress(file_size, path.name) if progress is None else None
+    result = sha256 = None
+    try:
+        with mapped(path) as data:
+            if file_size >= DEDUP_THRESHOLD:
+                sha256 = hashlib.sha256(data).hexdigest()
+                result = upload_by_hash("file", sha256, metadata)
+            if result is None and file_size >= DELTA_THRESHOLD:
+                result = upload_delta(path, data, sha256, metadata)
+            if result is None and file_size >= CHUNKED_THRESHOLD:
+                result = upload_chunked("file", data, metadata, sha256, progress or display)
+            if result is None:
+                # Stream the file straight from the map, compressed unless its type already is;
+                # hashed on the way, which checks what the server stored
+                compress = file_size >= MIN_COMPRESS_SIZE and is_compressible(metadata["mime_type"])
+                body = FileBody(data, progress=progress or display)
+                result = upload_raw("file", body, metadata, compress=compress)
+                if result["sha256"] != body.hexdigest():
+                    raise RuntimeError(f"{path.name} changed while it was uploaded, copy it again")
+    finally:
+        if display:
+            display.close()
+    print(f"✓ Uploaded file: {path.name} ({file_size} bytes)")
+    return result
+
+
+class TarStream:
+    """
+    Readable tar archive of (arcname, path) entries
+    A thread writes the archive into a pipe while it is read, so nothing is
+    buffered beyond the pipe; errors while archiving are raised by read()
+    """
+
+    def __init__(self, entries):
+        read_fd, write_fd = os.pipe()
+        self._pipe = os.fdopen(read_fd, "rb")
+        self._error = None
+        self._thread = threading.Thread(target=self._build, args=(entries, write_fd), daemon=True)
+        self._thread.start()
+
+    def _build(self, entries, write_fd):
+        import tarfile
+
+        try:
+            with os.fdopen(write_fd, "wb") as pipe, tarfile.open(fileobj=pipe, mode="w|",
+                                                                 format=tarfile.PAX_FORMAT) as tar:
+                for arcname, path in entries:
+                    tar.add(path, arcname=arcname)
+        except BrokenPipeError:
+            pass  # The reader gave up
+        except Exception as e:
+            self._error = e
+
+    def read(self, size=-1):
+        data = self._pipe.read(size)
+        if not data:
+            self._thread.join()
+            if self._error is not None:
+                raise self._error
+        return data
+
+    def close(self):
+        self._pipe.close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def bundle_entries(paths):
+    """(arcname, path) for each path, with clashing names made unique"""
+    entries, used = [], set()
+    for path in paths:
+        arcname, counter = path.name, 1
+        while arcname in used:
+            arcname = f"{path.stem}_{counter}{path.suffix}"
+            counter += 1
+        used.add(arcname)
+        entries.append((arcname, path))
+    return entries
+
+
+def count_files(paths):
+    """(number of regular files, their total size) under paths, without reading them"""
+    files = size = 0
+    for path in paths:
+        if not path.is_dir():
+            files, size = files + 1, size + path.stat().st_size
+            continue
+        for root, _, names in os.walk(path):
+            for name in names:
+                file_path = Path(root) / name
+                if file_path.is_file() and not file_path.is_symlink():
+                    files, size = files + 1, size + file_path.stat().st_size
+    return files, size
+
+
+def read_stdin():
+    """Yield standard input as it arrives (whatever is available, up to READ_SIZE bytes at a time)"""
+    stdin = sys.stdin.buffer
+    while chunk := stdin.read1(READ_SIZE):
+        yield chunk
+
+
+def upload_stdin(content_type="file", name="stdin"):
+    """
+    Stream standard input to the server while it is being produced
+    Sending starts with the first bytes, long before the writer finishes, and
+    memory use stays constant. Standard input cannot be read twice, so the
+    body goes up uncompressed: a 415 for an unsupported encoding could not
+    be retried
+    """
+    metadata = {}
+    if content_type == "file":
+        mime_type, _ = mimetypes.guess_type(name)
+        metadata = {"filename": name, "mime_type": mime_type or "application/octet-stream"}
+    headers = {
+        "Content-Type": "application/octet-stream",
+        "X-EasyCopy-Type": content_type,
+        "X-EasyCopy-Metadata": quote(json.dumps(metadata)),
+    }
+    response = http.put(f"{API_URL}/upload/raw", data=read_stdin(), headers=headers, timeout=(10, None))
     response.raise_for_status()
-    print(f"✓ Uploaded file: {path.name} ({len(file_content)} bytes)")
+    result = response.json()
+    print(f"✓ Uploaded standard input as {content_type} ({result['size']} bytes)")
+    return result
+
+
+def upload_bundle(paths):
+    """
+    Upload several files and/or directory trees as one tar stream
+    The archive is built while it is sent - one request, no temporary file
+    """
+    entries = bundle_entries(paths)
+    files, size = count_files(paths)
+    metadata = {
+        "format": "tar",
+        "name": entries[0][0] if len(entries) == 1 else "bundle",
+        "files": files,
+        "size": size,
+    }
+    headers = {
+        "Content-Type": "application/x-tar",
+        "X-EasyCopy-Type": "bundle",
+        "X-EasyCopy-Metadata": quote(json.dumps(metadata)),
+    }
+    # The archive is compressed on the fly; fall back to the next encoding on 415
+    for encoding in ENCODINGS:
+        with TarStream(entries) as stream:
+            response = http.put(f"{API_URL}/upload/raw", data=compress_chunks(stream, encoding),
+                                    headers={**headers, "Content-Encoding": encoding})
+        if response.status_code != 415:
+            break
+    response.raise_for_status()
+    print(f"✓ Uploaded {files} files as a bundle: {metadata['name']} ({size} bytes)")
     return response.json()
 
 
+def upload_paths(file_paths):
+    """
+    Upload copied files: a single file as is, several files or directories as a bundle
+    Returns False if none of the paths exists
+    """
+    paths = [Path(p) for p in file_paths if Path(p).exists()]
+    if not paths:
+        return False
+    if len(paths) == 1 and paths[0].is_file():
+        return upload_file(paths[0])
+    return upload_bundle(paths)
+
+
+def encode_image(image):
+    """(buffer, format) of a PIL image encoded as IMAGE_FORMAT"""
+    buffer = BytesIO()
+    if IMAGE_FORMAT.startswith("webp"):
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        if IMAGE_FORMAT == "webp-lossless":
+            image.save(buffer, format="WEBP", lossless=True, quality=0, method=0)
+        else:
+            image.save(buffer, format="WEBP", quality=WEBP_QUALITY, method=0)
+        return buffer, "WEBP"
+    image.save(buffer, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    return buffer, "PNG"
+
+
+def source_bytes(image):
+    """
+    The encoded bytes a lazily opened image was read from if they are
+    already in IMAGE_FORMAT (sent without decoding and re-encoding), or None
+    """
+    fp = getattr(image, "fp", None)
+    if fp is None or (image.format or "").lower() != IMAGE_FORMAT.split("-")[0]:
+        return None
+    fp.seek(0)
+    return BytesIO(fp.read())
+
+
+def clipboard_png():
+    """
+    PNG bytes of the copied image read straight from the platform clipboard, or None
+    Pillow's ImageGrab decodes the image, so its original bytes are lost
+    """
+    if sys.platform == "darwin":
+        try:
+            from AppKit import NSPasteboard, NSPasteboardTypePNG
+        except ImportError:
+            return None  # ImageGrab keeps the bytes it gets from osascript
+        data = NSPasteboard.generalPasteboard().dataForType_(NSPasteboardTypePNG)
+        return bytes(data) if data is not None else None
+    if sys.platform.startswith("linux"):
+        import shutil
+        import subprocess
+        if os.environ.get("WAYLAND_DISPLAY") and shutil.which("wl-paste"):
+            args = ["wl-paste", "--type", "image/png"]
+        elif shutil.which("xclip"):
+            args = ["xclip", "-selection", "clipboard", "-target", "image/png", "-out"]
+        else:
+            return None
+        try:
+            result = subprocess.run(args, capture_output=True, timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        if result.returncode == 0 and result.stdout.startswith(b"\x89PNG\r\n\x1a\n"):
+            return result.stdout
+    return None
+
+
 def upload_image(image):
     """Upload image from clipboard to server"""
-    # Convert image to PNG and encode to base64
-    buffer = BytesIO()
-    image.save(buffer, format="PNG")
-    image_bytes = buffer.getvalue()
-    content_base64 = base64.b64encode(image_bytes).decode('utf-8')
+    # Send the copied bytes as-is when they are in the configured format
+    buffer = source_bytes(image)
+    image_format = image.format
+    if buffer is None:
+        buffer, image_format = encode_image(image)
+    image_size = buffer.getbuffer().nbytes
+    buffer.seek(0)
     
-    payload = {
-        "type": "image",
-        "content": content_base64,
-        "metadata": {
-            "format": "PNG",
-            "size": len(image_bytes),
-            "dimensions": f"{image.width}x{image.height}"
-        }
+    metadata = {
+        "format": image_format,
+        "size": image_size,
+        "dimensions": f"{image.width}x{image.height}"
     }
     
-    response = requests.post(f"{SERVER_URL}/upload", json=payload)
-    response.raise_for_status()
-    print(f"✓ Uploaded image ({image.width}x{image.height}, {len(image_bytes)} bytes)")
-    return response.json()
+    result = None
+    if image_size >= DEDUP_THRESHOLD:
+        result = upload_by_hash("image", hashlib.sha256(buffer.getbuffer()).hexdigest(), metadata)
+    if result is None:
+        result = upload_raw("image", buffer, metadata)
+    print(f"✓ Uploaded image ({image.width}x{image.height}, {image_size} bytes)")
+    return result
+
+
+def upload_clipboard_files():
+    """Upload the files copied to the clipboard; False if there are none"""
+    files = get_clipboard_files()
+    if not files:
+        return False
+    return upload_paths(files)
+
+
+def upload_clipboard_image():
+    """Upload the image copied to the clipboard; False if there is none"""
+    from PIL import Image, ImageGrab
+
+    try:
+        # Opened lazily: only the header is parsed unless it has to be re-encoded
+        data = clipboard_png()
+        clipboard_content = Image.open(BytesIO(data)) if data else ImageGrab.grabclipboard()
+    except Exception:
+        # Not an image or error reading image
+        return False
+    # On macOS, ImageGrab.grabclipboard() returns a list of file paths when files are copied
+    if isinstance(clipboard_content, list):
+        return upload_paths(clipboard_content) if clipboard_content else False
+    if isinstance(clipboard_content, Image.Image):
+        return upload_image(clipboard_content)
+    return False
+
+
+def upload_clipboard_text():
+    """Upload the text in the clipboard; False if there is none"""
+    import pyperclip
+
+    text = pyperclip.paste()
+    if not text:
+        return False
+    return upload_text(text)
+
+
+# Content types in the order they are looked for in the clipboard
+CLIPBOARD_UPLOADERS = {
+    "file": upload_clipboard_files,
+    "image": upload_clipboard_image,
+    "text": upload_clipboard_text,
+}
 
 
 def main():
     """Main upload logic - detect clipboard type and upload"""
+    parser = argparse.ArgumentParser(description="Upload clipboard content to the EasyCopy server")
+    parser.add_argument("--type", choices=tuple(CLIPBOARD_UPLOADERS),
+                        help="upload this kind of content without probing the clipboard for the others")
+    parser.add_argument("source", nargs="?", choices=["-"],
+                        help="- to upload standard input (as a file unless --type says otherwise)")
+    parser.add_argument("--name", default="stdin", help="filename for content uploaded from standard input")
+    args = parser.parse_args()
+
     try:
-        # Priority 1: Check for files in clipboard (platform-specific)
-        files = get_clipboard_files()
-        if files:
-            # Upload the first file (or we could upload all)
-            # If upload_file returns False, it means the path was invalid
-            # so we continue to try other content types
-            result = upload_file(files[0])
-            if result is not False:
-                return
-        
-        # Priority 2: Check for image in clipboard
-        try:
-            clipboard_content = ImageGrab.grabclipboard()
-            # On macOS, ImageGrab.grabclipboard() returns a list of file paths when files are copied
-            if clipboard_content:
-                if isinstance(clipboard_content, list):
-                    # This is a list of file paths
-                    if len(clipboard_content) > 0:
-                        result = upload_file(clipboard_content[0])
-                        if result is not False:
-                            return
-                elif isinstance(clipboard_content, Image.Image):
-                    # This is an actual image
-                    upload_image(clipboard_content)
-                    return
-        except Exception as e:
-            # Not an image or error reading image
-            pass
-        
-        # Priority 3: Check for text in clipboard
-        text = pyperclip.paste()
-        if text:
-            upload_text(text)
+        if args.source == "-":
+            upload_stdin(args.type or "file", args.name)
             return
+
+        # Without --type: files first, then an image, then text
+        for content_type in [args.type] if args.type else CLIPBOARD_UPLOADERS:
+            if CLIPBOARD_UPLOADERS[content_type]() is not False:
+                return
         
         # Nothing in clipboard
-        print("✗ No content found in clipboard")
+        print(f"✗ No {args.type} found in clipboard" if args.type else "✗ No content found in clipboard")
         sys.exit(1)
         
     except requests.exceptions.ConnectionError:
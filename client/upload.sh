@@ -2,6 +2,6 @@
 
 #set -e
 source "$(dirname "$0")/.venv/bin/activate"
-OUTPUT=$(/Users/vladimir.komarevskiy/.pyenv/versions/3.11.3/bin/python -u "$(dirname "$0")/upload.py")
+OUTPUT=$(/Users/vladimir.komarevskiy/.pyenv/versions/3.11.3/bin/python -u "$(dirname "$0")/easycopy.py" upload)
 CMD="display notification \"$OUTPUT\" with title \"Clip-context\""
 osascript -e "$CMD"
\ No newline at end of file
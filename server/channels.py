@@ -0,0 +1,157 @@
+"""
+EasyCopy Server - Clipboard channels
+Each named channel has its own current entry, history and change
+notifications, so users on different channels never contend with each other.
+Entries and history live in the state backend (see state.py); blobs are
+shared by all channels (content-addressed, reference-counted by the backend).
+"""
+
+import asyncio
+import logging
+import re
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from events import EventBroker
+from state import GARBAGE_GRACE
+
+DEFAULT_CHANNEL = "default"
+CHANNEL_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+# Seconds between checks for changes made by other workers
+CHANGE_POLL_INTERVAL = 0.5
+
+EMPTY_CLIPBOARD = {
+    "type": None,  # "text", "file", or "image"
+    "sha256": None,  # Digest of the raw payload bytes in blob_store
+    "size": 0,  # Raw payload size in bytes
+    "metadata": {},  # Additional metadata (filename, path, mime_type, etc.)
+    "timestamp": None,
+}
+
+logger = logging.getLogger("easycopy")
+
+
+def is_channel_name(name):
+    return CHANNEL_PATTERN.fullmatch(name) is not None
+
+
+def change_event(entry):
+    """Small notification describing an entry (never includes the payload)"""
+    return {
+        "type": entry["type"],
+        "size": entry["size"],
+        "sha256": entry["sha256"],
+        "timestamp": entry["timestamp"],
+    }
+
+
+class ChannelHistory:
+    """A channel's view of the history kept by the state backend"""
+
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+
+    def stats(self):
+        """(entries, total payload bytes)"""
+        return self.backend.history_stats(self.name)
+
+    def page(self, before=None, limit=50):
+        return self.backend.history_page(self.name, before, limit)
+
+    def get(self, entry_id):
+        return self.backend.history_get(self.name, entry_id)
+
+
+class Channel:
+    """
+    One clipboard: the current entry (metadata only), its history and subscribers
+    Entries are replaced, never mutated, so clipboard is a consistent snapshot.
+    """
+
+    def __init__(self, name, backend, blob_store):
+        self.name = name
+        self.backend = backend
+        self.blob_store = blob_store
+        self.events = EventBroker()
+        self.history = ChannelHistory(backend, name)
+        self._notified_version = 0
+
+    @property
+    def clipboard(self):
+        return self.backend.get(self.name) or dict(EMPTY_CLIPBOARD)
+
+    def set(self, entry):
+        """
+        Make entry the current content and record it in the history
+        Returns (entry with its history id, state version). Blocking - call
+        from a worker thread
+        """
+        return self.backend.set(self.name, entry, self.blob_store.delete)
+
+    def notify(self, entry, version):
+        """Publish a change to subscribers unless a newer one was already published"""
+        if version > self._notified_version:
+            self._notified_version = version
+            self.events.publish(change_event(entry))
+
+
+class Channels:
+    """Registry of the channels this worker has served"""
+
+    def __init__(self, blob_store, backend):
+        self.blob_store = blob_store
+        self.backend = backend
+        self._channels = {}
+        self._lock = threading.Lock()
+
+        self._delete_unreferenced_blobs()
+
+    def __iter__(self):
+        return iter(list(self._channels.values()))
+
+    def get(self, name):
+        """The channel called name, created on first use (nothing is written until content is set)"""
+        channel = self._channels.get(name)
+        if channel is not None:
+            return channel
+        with self._lock:
+            if name not in self._channels:
+                self._channels[name] = Channel(name, self.backend, self.blob_store)
+            return self._channels[name]
+
+    async def watch(self):
+        """
+        Forward changes made by other workers to this worker's subscribers
+        Runs for the lifetime of the app when the backend is shared
+        """
+        since = await run_in_threadpool(self.backend.version)
+        while True:
+            await asyncio.sleep(CHANGE_POLL_INTERVAL)
+            try:
+                changes, version = await run_in_threadpool(self.backend.changes, since)
+            except Exception:
+                logger.exception("Polling the state backend for changes failed")
+                continue
+            for name, entry in changes:
+                channel = self._channels.get(name)
+                if channel is not None:
+                    channel.notify(entry, version)
+            since = version
+
+    def _delete_unreferenced_blobs(self):
+        """Delete blobs nothing references (left behind by a crash between storing and recording)"""
+        cutoff = time.time() - GARBAGE_GRACE
+
+        def stale(digest):
+            # A claim touches the blob, so this also spares blobs being reused
+            found = self.blob_store.find(digest)
+            return found is not None and found[0].stat().st_mtime < cutoff
+
+        for digest in list(self.blob_store.digests()):
+            if stale(digest) and not self.backend.is_referenced(digest):
+                # Every worker sweeps at startup: decide again under the backend's lock
+                self.backend.collect(digest, lambda: stale(digest), self.blob_store.delete)
@@ -0,0 +1,270 @@
+"""
+EasyCopy Server - Content-Encoding support
+gzip is always available; zstd is used when the optional zstandard package
+is installed. Covers compressed request bodies, compressed-at-rest blobs and
+Accept-Encoding negotiation for responses.
+"""
+
+import zlib
+
+from fastapi import HTTPException
+from starlette.responses import PlainTextResponse
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip always works
+    zstandard = None
+
+# Supported encodings in order of preference
+ENCODINGS = ("zstd", "gzip") if zstandard else ("gzip",)
+
+# Encoding used for blobs compressed at rest
+AT_REST_ENCODING = ENCODINGS[0]
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Payloads smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+# Decoded bytes handed on per request body message. A small compressed body
+# can expand a thousandfold or more, so it is decoded a piece at a time and
+# the upload limits (applied to the decoded body) stop it as it passes them
+DECODED_CHUNK_SIZE = 1024 * 1024
+# Compressed bytes buffered before each zstd decoding step: more than a whole
+# block (at most 128 KB), so a valid body never runs short of input mid-step
+ZSTD_READ_AHEAD = 256 * 1024
+
+# MIME types that are already compressed (prefix match)
+INCOMPRESSIBLE_TYPES = (
+    "image/png", "image/jpeg", "image/gif", "image/webp", "image/avif", "image/heic",
+    "video/", "audio/",
+    "application/zip", "application/gzip", "application/x-gzip", "application/x-bzip2",
+    "application/x-xz", "application/x-7z-compressed", "application/x-rar-compressed",
+    "application/vnd.rar", "application/zstd", "application/java-archive", "application/pdf",
+    "application/vnd.openxmlformats-officedocument", "application/epub+zip",
+    "font/woff", "font/woff2",
+)
+
+
+def is_compressible(mime_type):
+    """False for MIME types that are already compressed"""
+    mime_type = (mime_type or "application/octet-stream").lower()
+    return not mime_type.startswith(INCOMPRESSIBLE_TYPES)
+
+
+def negotiate(accept_encoding, available=ENCODINGS):
+    """Pick the preferred encoding from available that the Accept-Encoding header allows"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in available:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+class _ZlibCompressor:
+    def __init__(self):
+        self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+
+class _ZlibDecompressor:
+    def __init__(self):
+        self._obj = zlib.decompressobj(31)
+
+    def decompress(self, data):
+        return self._obj.decompress(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+
+class _ZstdDecompressor:
+    def __init__(self):
+        self._obj = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, data):
+        # A finished decompressobj rejects any further call, even with no data
+        # (the last message of a request body is often empty)
+        if not data:
+            return b""
+        return self._obj.decompress(data)
+
+    def flush(self):
+        return b""
+
+
+def compressor(encoding):
+    """Incremental compressor with compress(data) / flush() for an encoding"""
+    if encoding == "gzip":
+        return _ZlibCompressor()
+    if encoding == "zstd" and zstandard:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def decompressor(encoding):
+    """Incremental decompressor with decompress(data) / flush() for an encoding"""
+    if encoding == "gzip":
+        return _ZlibDecompressor()
+    if encoding == "zstd" and zstandard:
+        return _ZstdDecompressor()
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def compress_stream(chunks, encoding):
+    """Compress an iterable of bytes (or str, encoded as UTF-8) chunk by chunk"""
+    comp = compressor(encoding)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        data = comp.compress(chunk)
+        if data:
+            yield data
+    yield comp.flush()
+
+
+def decompress_stream(chunks, encoding):
+    decomp = decompressor(encoding)
+    for chunk in chunks:
+        data = decomp.decompress(chunk)
+        if data:
+            yield data
+    tail = decomp.flush()
+    if tail:
+        yield tail
+
+
+class _ShortInput(Exception):
+    """A zstd decoding step needed more input than was buffered (not a valid body)"""
+
+
+class _BodyBuffer:
+    """The compressed request body received so far, read by the zstd decoder"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.complete = False  # The last body message has arrived
+        self.exhausted = False  # The decoder asked for more after the last byte
+
+    def read(self, size):
+        if not self.data:
+            if not self.complete:
+                raise _ShortInput()
+            self.exhausted = True
+            return b""
+        chunk = bytes(self.data[:size])
+        del self.data[:size]
+        return chunk
+
+
+async def _decoded_messages(encoding, receive):
+    """
+    Body messages of a request, decoded, with at most DECODED_CHUNK_SIZE bytes each
+    Other messages (a disconnect) are passed on and end the body. Raises 400
+    for a corrupt or truncated body
+    """
+    invalid = HTTPException(status_code=400, detail=f"Invalid {encoding} request body")
+    truncated = HTTPException(status_code=400, detail=f"Truncated {encoding} request body")
+
+    if encoding == "gzip":
+        decoder = zlib.decompressobj(31)
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                yield message
+                return
+            data, more_body = message.get("body", b""), message.get("more_body", False)
+            while True:
+                try:
+                    body = decoder.decompress(data, DECODED_CHUNK_SIZE)
+                except zlib.error:
+                    raise invalid
+                data = decoder.unconsumed_tail
+                if body:
+                    yield {"type": "http.request", "body": body, "more_body": True}
+                if not data and len(body) < DECODED_CHUNK_SIZE:
+                    break
+        if not decoder.eof:
+            raise truncated
+    else:
+        source = _BodyBuffer()
+        chunks = zstandard.ZstdDecompressor().read_to_iter(source, write_size=DECODED_CHUNK_SIZE)
+        while True:
+            while not source.complete and len(source.data) < ZSTD_READ_AHEAD:
+                message = await receive()
+                if message["type"] != "http.request":
+                    yield message
+                    return
+                source.data += message.get("body", b"")
+                source.complete = not message.get("more_body", False)
+            try:
+                body = next(chunks, None)
+            except (zstandard.ZstdError, _ShortInput):
+                raise invalid
+            if body is None:
+                break
+            yield {"type": "http.request", "body": body, "more_body": True}
+        # The decoder stops at the end of the frame; running out of input first means it was cut short
+        if source.exhausted:
+            raise truncated
+    yield {"type": "http.request", "body": b"", "more_body": False}
+
+
+class RequestDecompressionMiddleware:
+    """
+    Transparently decode request bodies sent with Content-Encoding gzip/zstd
+    Bodies are decoded as they stream in, DECODED_CHUNK_SIZE bytes at a
+    time, so handlers see plain bytes without the whole compressed (or
+    decoded) body being buffered
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        encoding = None
+        for name, value in scope["headers"]:
+            if name == b"content-encoding":
+                encoding = value.decode("latin-1").strip().lower()
+        if encoding in (None, "", "identity"):
+            return await self.app(scope, receive, send)
+        if encoding not in ENCODINGS:
+            response = PlainTextResponse(f"Unsupported Content-Encoding: {encoding}", status_code=415,
+                                         headers={"Accept-Encoding": ", ".join(ENCODINGS)})
+            return await response(scope, receive, send)
+
+        # Updated in place so outer middleware still sees what routing adds to the scope
+        scope["headers"] = [(name, value) for name, value in scope["headers"]
+                            if name not in (b"content-encoding", b"content-length")]
+        messages = _decoded_messages(encoding, receive)
+
+        async def receive_decoded():
+            try:
+                return await messages.__anext__()
+            except StopAsyncIteration:
+                # After the body: waiting for a disconnect
+                return await receive()
+
+        await self.app(scope, receive_decoded, send)
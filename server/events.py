@@ -0,0 +1,63 @@
+"""
+EasyCopy Server - Change notifications
+Fan-out of small clipboard change events to Server-Sent Events subscribers
+"""
+
+import asyncio
+import json
+
+# Idle subscribers get a comment line this often so proxies keep the stream open
+KEEPALIVE_INTERVAL = 15
+# Events queued per subscriber before a slow one starts missing notifications
+SUBSCRIBER_QUEUE_SIZE = 16
+
+
+class EventBroker:
+    """In-process publish/subscribe for change notifications"""
+
+    def __init__(self):
+        self._subscribers = set()
+
+    def publish(self, event):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Only the latest state matters; drop the oldest pending event
+                queue.get_nowait()
+                queue.put_nowait(event)
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    async def stream(self, initial_event=None):
+        """
+        Yield SSE-formatted events for one subscriber until the client disconnects
+        initial_event is sent first so a new subscriber learns the current state
+        """
+        queue = self.subscribe()
+        try:
+            if initial_event is not None:
+                yield format_sse(initial_event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            self.unsubscribe(queue)
+
+
+def format_sse(event, name="change"):
+    return f"event: {name}\ndata: {json.dumps(event)}\n\n"
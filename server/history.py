@@ -0,0 +1,118 @@
+"""
+EasyCopy Server - Clipboard history
+In-memory index of the last entries of a channel, ordered from least to
+most recently used. Used by the memory state backend; the SQLite and Redis
+backends implement the same eviction rules in their own storage.
+"""
+
+import time
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timezone
+
+
+class ClipboardHistory:
+    """
+    Bounded history of clipboard entries
+    Entries get increasing ids; setting content that is already in the history
+    moves it to the newest position under a new id, so id order is also LRU order.
+    Oldest entries are evicted once max_entries, max_bytes (raw size of the
+    distinct payloads) or max_age (seconds, 0 = unlimited) is exceeded; the
+    newest entry is always kept.
+    Not synchronised: callers serialise add() (reads tolerate concurrent adds).
+    """
+
+    def __init__(self, max_entries=100, max_bytes=1024 ** 3, max_age=0):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self._entries = {}  # id -> entry
+        self._ids = []  # ids in ascending (least to most recently used) order
+        self._by_content = {}  # (type, sha256) -> id
+        self._refs = Counter()  # sha256 -> number of entries using the blob
+        self._blob_sizes = {}  # sha256 -> raw size, counted once per blob
+        self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, digest):
+        return digest in self._refs
+
+    def add(self, entry):
+        """
+        Record entry (which carries its id) as the newest history item
+        Returns the digests no entry of this history uses any more
+        """
+        released = []
+        # Same content again: the older copy is superseded by the new one
+        previous = self._by_content.get((entry["type"], entry["sha256"]))
+        self._index(entry)
+        if previous is not None:
+            self._remove(previous, released)
+        self._evict(released)
+        return released
+
+    def get(self, entry_id):
+        return self._entries.get(entry_id)
+
+    def page(self, before=None, limit=50):
+        """
+        Up to limit entries, newest first, with ids below before (if given)
+        Returns (entries, next_before) - next_before is None on the last page.
+        Entries past max_age are left out; they are deleted on the next add()
+        """
+        ids = self._ids
+        end = len(ids) if before is None else bisect_left(ids, before)
+        newest = ids[-1] if ids else None
+        cutoff = time.time() - self.max_age if self.max_age else None
+        page = []
+        start = max(0, end - limit)
+        window = ids[start:end]
+        for entry_id in reversed(window):
+            entry = self._entries.get(entry_id)
+            if entry is None or (cutoff is not None and entry_id != newest
+                                 and entry_epoch(entry) < cutoff):
+                continue
+            page.append(entry)
+        return page, (window[0] if start > 0 and window else None)
+
+    def _index(self, entry):
+        entry_id, digest = entry["id"], entry["sha256"]
+        self._entries[entry_id] = entry
+        self._ids.append(entry_id)
+        self._by_content[(entry["type"], digest)] = entry_id
+        if self._refs[digest] == 0:
+            self._blob_sizes[digest] = entry["size"]
+            self.total_bytes += entry["size"]
+        self._refs[digest] += 1
+
+    def _remove(self, entry_id, released):
+        entry = self._entries.pop(entry_id)
+        del self._ids[bisect_left(self._ids, entry_id)]
+        key = (entry["type"], entry["sha256"])
+        if self._by_content.get(key) == entry_id:
+            del self._by_content[key]
+
+        digest = entry["sha256"]
+        self._refs[digest] -= 1
+        if self._refs[digest] == 0:
+            del self._refs[digest]
+            self.total_bytes -= self._blob_sizes.pop(digest)
+            released.append(digest)
+
+    def _evict(self, released):
+        cutoff = time.time() - self.max_age if self.max_age else None
+        while len(self._ids) > 1:
+            oldest = self._entries[self._ids[0]]
+            if (len(self._ids) > self.max_entries or self.total_bytes > self.max_bytes
+                    or (cutoff is not None and entry_epoch(oldest) < cutoff)):
+                self._remove(oldest["id"], released)
+            else:
+                break
+
+
+def entry_epoch(entry):
+    """Seconds since the epoch of an entry's (naive UTC) ISO timestamp"""
+    return datetime.fromisoformat(entry["timestamp"]).replace(tzinfo=timezone.utc).timestamp()
@@ -0,0 +1,147 @@
+"""
+EasyCopy Server - Image derivatives
+Resized and re-encoded variants of stored images (previews for the web app,
+smaller downloads for slow links). Derivatives are rendered once in the
+server's CPU work pool and kept in a byte-bounded LRU cache keyed by content hash and
+parameters; concurrent requests for the same derivative share one render.
+"""
+
+import asyncio
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+try:
+    from PIL import Image
+except ImportError:  # Derivatives are optional; the original is served instead
+    Image = None
+
+FORMATS = ("webp", "jpeg", "png")
+DEFAULT_QUALITY = 80
+MAX_DIMENSION = 8192
+# Requested sizes and qualities are rounded to these steps, so each image has
+# a bounded number of distinct derivatives to render and cache
+SIZE_STEP = 16
+QUALITY_STEP = 5
+
+
+class DerivativeCache:
+    """LRU of encoded derivatives bounded by their total size in bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+            return item
+
+    def put(self, key, item):
+        size = len(item[0])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= len(previous[0])
+            self._items[key] = item
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (data, _) = self._items.popitem(last=False)
+                self.total_bytes -= len(data)
+
+
+def snap(width=None, height=None, image_format=None, quality=None):
+    """
+    Derivative parameters rounded to SIZE_STEP (down, so the result still
+    fits) and QUALITY_STEP
+    """
+    if width is not None:
+        width = max(SIZE_STEP, width - width % SIZE_STEP)
+    if height is not None:
+        height = max(SIZE_STEP, height - height % SIZE_STEP)
+    if quality is not None:
+        quality = min(100, max(QUALITY_STEP, round(quality / QUALITY_STEP) * QUALITY_STEP))
+    return width, height, image_format, quality
+
+
+def render(source, width=None, height=None, image_format=None, quality=None):
+    """
+    (encoded bytes, format) of an image file scaled to fit width x height
+    (never enlarged) and encoded as image_format, or None if the original
+    already is exactly that
+    """
+    with Image.open(source) as image:
+        source_format = (image.format or "").lower()
+        image_format = image_format or (source_format if source_format in FORMATS else "png")
+        size = (min(width or image.width, image.width), min(height or image.height, image.height))
+        if size == image.size and image_format == source_format and quality is None:
+            return None
+        # JPEGs can be decoded at a reduced scale directly
+        image.draft("RGB", size)
+        image.thumbnail(size)
+        if image_format == "jpeg":
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA")
+        buffer = BytesIO()
+        if image_format == "png":
+            image.save(buffer, format="PNG")
+        elif image_format == "webp":
+            image.save(buffer, format="WEBP", quality=quality or DEFAULT_QUALITY, method=4)
+        else:
+            image.save(buffer, format="JPEG", quality=quality or DEFAULT_QUALITY, optimize=True)
+        return buffer.getvalue(), image_format
+
+
+class ImageDerivatives:
+    """
+    Derivatives of the images in a blob store, rendered on demand and cached
+    Renders run in pool (a WorkPool), so they share its bound with the other
+    CPU-heavy work
+    """
+
+    def __init__(self, blob_store, cache_bytes, pool):
+        self.blob_store = blob_store
+        self.cache = DerivativeCache(cache_bytes)
+        self.pool = pool
+        self._pending = {}  # key -> future of a render in progress
+
+    def _render_blob(self, digest, params):
+        with self.blob_store.open_raw(digest) as f:
+            try:
+                return render(f, *params)
+            except Exception:
+                return None  # Not decodable: the original is served as it is
+
+    async def get(self, digest, width=None, height=None, image_format=None, quality=None):
+        """
+        (item, cached): item is the derivative's (bytes, format), or None if the
+        original should be served; cached tells whether it was rendered before.
+        Raises PoolSaturated if a render is needed and the pool is full
+        """
+        if Image is None:
+            return None, False
+        params = (width, height, image_format, quality)
+        key = (digest,) + params
+        item = self.cache.get(key)
+        if item is not None:
+            return item, True
+        future = self._pending.get(key)
+        if future is None:
+            self.pool.admit()
+            future = asyncio.ensure_future(self.pool.run(self._render_blob, digest, params))
+            self._pending[key] = future
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+        item = await asyncio.shield(future)
+        if item is not None:
+            self.cache.put(key, item)
+        return item, False
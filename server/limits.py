@@ -0,0 +1,150 @@
+"""
+EasyCopy Server - Upload limits
+Early, cheap rejection of request bodies the server should not take on:
+bodies over the size limit (413, decided from Content-Length before
+anything is read, else as soon as the streamed body passes the limit), new
+uploads while too many body bytes are in flight for the worker or the
+channel, and clients sending requests faster than their rate (both 429 with
+Retry-After). Limits and counters are per worker process.
+"""
+
+import math
+import re
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from channels import DEFAULT_CHANNEL
+
+# Methods whose requests carry a body
+BODY_METHODS = (b"POST", b"PUT", b"PATCH")
+CHANNEL_PATH = re.compile(r"/c/([^/]+)/")
+# Routes writing their body to disk as it arrives; all others read it into memory
+STREAMED_PATH = re.compile(r".*/upload/(raw|delta|sessions/[^/]+/chunks/[^/]+)")
+
+
+class TokenBuckets:
+    """Per-client token buckets: rate requests per second, bursts of up to burst"""
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # client -> (tokens, time of update), least recently seen first
+
+    def take(self, client, now=None):
+        """Take a token for client; returns 0, or the seconds until a token is available"""
+        now = time.monotonic() if now is None else now
+        tokens, updated = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+        self._buckets[client] = (tokens - 1 if not wait else tokens, now)
+        # Clients not seen for a while have full buckets anyway
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class UploadLimits:
+    """
+    Upload limits (0 = unlimited) and the in-flight byte counts they are checked against
+    max_body applies to bodies streamed to disk (see STREAMED_PATH),
+    max_buffered_body to those read into memory (JSON); max_inflight and
+    max_channel_inflight bound the body bytes being received at once, for
+    new requests only. on_reject(reason) is called for every refusal
+    """
+
+    def __init__(self, max_body=0, max_buffered_body=0, max_inflight=0, max_channel_inflight=0, rate=0, burst=0,
+                 on_reject=None):
+        self.max_body = max_body
+        self.max_buffered_body = max_buffered_body
+        self.max_inflight = max_inflight
+        self.max_channel_inflight = max_channel_inflight
+        self.buckets = TokenBuckets(rate, burst or rate) if rate > 0 else None
+        self.on_reject = on_reject
+        self.inflight = 0
+        self.channel_inflight = {}
+
+    def _reject(self, reason, status_code, detail, retry_after=None):
+        if self.on_reject is not None:
+            self.on_reject(reason)
+        headers = {"Retry-After": str(max(1, math.ceil(retry_after)))} if retry_after is not None else None
+        return HTTPException(status_code=status_code, detail=detail, headers=headers)
+
+    def too_large(self, limit):
+        return self._reject("too_large", 413, f"Upload exceeds the limit of {limit} bytes")
+
+    def check(self, client, channel, length):
+        """The HTTPException refusing a new request, or None to accept it"""
+        if self.buckets is not None:
+            wait = self.buckets.take(client)
+            if wait:
+                return self._reject("rate", 429, "Too many requests, slow down", wait)
+        for limit, current in ((self.max_inflight, self.inflight),
+                               (self.max_channel_inflight, self.channel_inflight.get(channel, 0))):
+            # Never refuse the only upload: a body larger than the limit still goes through alone
+            if limit and current and current + (length or 0) > limit:
+                return self._reject("busy", 429, "Too many uploads in progress, retry shortly", 1)
+        return None
+
+    def add(self, channel, count):
+        self.inflight += count
+        total = self.channel_inflight.get(channel, 0) + count
+        if total:
+            self.channel_inflight[channel] = total
+        else:
+            self.channel_inflight.pop(channel, None)
+
+
+class UploadLimitMiddleware:
+    """Apply UploadLimits to every request with a body"""
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"].encode() not in BODY_METHODS:
+            return await self.app(scope, receive, send)
+
+        limits = self.limits
+        length = None
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit():
+                length = int(value)
+        match = CHANNEL_PATH.match(scope["path"])
+        # Top-level routes serve the default channel, like /c/default/...
+        channel = match.group(1) if match else DEFAULT_CHANNEL
+        client = scope["client"][0] if scope.get("client") else ""
+        limit = limits.max_body if STREAMED_PATH.fullmatch(scope["path"]) else limits.max_buffered_body
+
+        error = limits.check(client, channel, length)
+        if error is None and limit and length is not None and length > limit:
+            error = limits.too_large(limit)
+        if error is not None:
+            response = JSONResponse({"detail": error.detail}, status_code=error.status_code, headers=error.headers)
+            return await response(scope, receive, send)
+
+        # A declared length is counted in full from the start, a streamed body as it arrives
+        counted = length or 0
+        received = 0
+        limits.add(channel, counted)
+
+        async def receive_limited():
+            nonlocal counted, received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if limit and received > limit:
+                    raise limits.too_large(limit)
+                if received > counted:
+                    limits.add(channel, received - counted)
+                    counted = received
+            return message
+
+        try:
+            await self.app(scope, receive_limited, send)
+        finally:
+            limits.add(channel, -counted)
@@ -0,0 +1,58 @@
+"""
+EasyCopy Server - Logging setup
+Leveled, structured log records: context goes in extra={...} fields, which
+are rendered as key=value pairs (text) or as JSON object keys (json)
+"""
+
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _STANDARD_ATTRIBUTES}
+
+
+class TextFormatter(logging.Formatter):
+    """2024-01-01T12:00:00Z INFO easycopy: Uploaded type=text size=12"""
+
+    def format(self, record):
+        timestamp = datetime.fromtimestamp(record.created, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        line = f"{timestamp} {record.levelname} {record.name}: {record.getMessage()}"
+        fields = " ".join(f"{key}={value}" for key, value in _fields(record).items())
+        if fields:
+            line += " " + fields
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, for log collectors"""
+
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+def configure_logging(level="INFO", fmt="text"):
+    """Send easycopy.* log records to stderr with the given level and format (text or json)"""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JSONFormatter() if fmt == "json" else TextFormatter())
+    logger = logging.getLogger("easycopy")
+    logger.handlers[:] = [handler]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+    return logger
@@ -4,19 +4,63 @@ EasyCopy Server - Simple clipboard sync server
 Stores the latest clipboard content (text, file, or image) with metadata
 """
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse, Response, FileResponse
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, FileResponse, StreamingResponse
 import os
+import json
+import time
+import binascii
+import mmap
+import asyncio
+import sys
+import codecs
+import shutil
+import uuid
+from contextlib import ExitStack, asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, ValidationError
 from typing import Optional, Literal
 import base64
 from datetime import datetime
 from pathlib import Path
+from urllib.parse import quote, unquote
 
+from storage import BlobStore
+from sessions import UploadSessions
+from channels import EMPTY_CLIPBOARD, Channel, Channels, DEFAULT_CHANNEL, change_event, is_channel_name
+from state import open_backend
+from images import FORMATS as IMAGE_FORMATS, MAX_DIMENSION, ImageDerivatives, snap as snap_image_params
+from delta import (MAX_BLOCK_SIZE, MIN_BLOCK_SIZE, SIGNATURE_RECORD, DeltaDecoder, block_size_for, encode_delta,
+                   make_signature, plan_delta)
+from content_encoding import (RequestDecompressionMiddleware, MIN_COMPRESS_SIZE, compress_stream,
+                              is_compressible, negotiate)
+from limits import UploadLimitMiddleware, UploadLimits
+from logs import configure_logging
+from metrics import InstrumentedRoute, MetricsMiddleware, codec_duration, monitor_event_loop, payload_size, registry
+from workpool import PoolSaturated, WorkPool
 
-app = FastAPI(title="EasyCopy Server")
+
+logger = configure_logging(os.environ.get("EASYCOPY_LOG_LEVEL", "INFO"),
+                           os.environ.get("EASYCOPY_LOG_FORMAT", "text"))
+
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # With a shared state backend other workers change channels too
+    watcher = asyncio.create_task(channels.watch()) if state_backend.shared else None
+    lag_monitor = asyncio.create_task(monitor_event_loop())
+    yield
+    lag_monitor.cancel()
+    if watcher is not None:
+        watcher.cancel()
+    cpu_pool.shutdown()
+
+
+app = FastAPI(title="EasyCopy Server", lifespan=lifespan)
 
 # Enable CORS for web app access
 app.add_middleware(
@@ -27,14 +71,430 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory storage for the latest clipboard content
-# In-memory storage for the latest clipboard content
-clipboard_data = {
-    "type": None,  # "text", "file", or "image"
-    "content": None,  # The actual content (text or base64 encoded)
-    "metadata": {},  # Additional metadata (filename, path, mime_type, etc.)
-    "timestamp": None,
-}
+# Request body limits, per worker (0 = unlimited; see limits.py): bytes of one
+# body written to disk as it arrives (/upload/raw, /upload/delta, session
+# chunks, and the total size of a session) or read into memory (JSON, which
+# the web app also sends files as), body bytes being received at once per
+# worker and per channel, and requests per second per client address (off by
+# default: behind a proxy all clients share its address unless uvicorn is
+# told to trust its forwarded headers)
+MAX_UPLOAD_BYTES = int(os.environ.get("EASYCOPY_MAX_UPLOAD_BYTES", "0"))
+MAX_JSON_BYTES = int(os.environ.get("EASYCOPY_MAX_JSON_BYTES", str(128 * 1024 ** 2)))
+MAX_INFLIGHT_BYTES = int(os.environ.get("EASYCOPY_MAX_INFLIGHT_BYTES", str(1024 ** 3)))
+MAX_CHANNEL_INFLIGHT_BYTES = int(os.environ.get("EASYCOPY_MAX_CHANNEL_INFLIGHT_BYTES", "0"))
+UPLOAD_RATE = float(os.environ.get("EASYCOPY_UPLOAD_RATE", "0"))
+UPLOAD_BURST = int(os.environ.get("EASYCOPY_UPLOAD_BURST", "0"))  # 0 = one second's worth
+
+upload_rejections = registry.counter("easycopy_upload_rejected_total", "Request bodies refused by the upload limits",
+                                     ("reason",))
+upload_limits = UploadLimits(MAX_UPLOAD_BYTES, MAX_JSON_BYTES, MAX_INFLIGHT_BYTES, MAX_CHANNEL_INFLIGHT_BYTES,
+                             UPLOAD_RATE, UPLOAD_BURST, on_reject=lambda reason: upload_rejections.inc(reason=reason))
+registry.gauge("easycopy_upload_inflight_bytes", "Request body bytes being received",
+               lambda: upload_limits.inflight)
+
+# Inside decompression, so limits apply to the decoded bytes
+app.add_middleware(UploadLimitMiddleware, limits=upload_limits)
+
+# Accept request bodies sent with Content-Encoding: gzip / zstd
+app.add_middleware(RequestDecompressionMiddleware)
+
+# Payloads live on disk under the data dir; mount it as a volume to survive restarts
+DATA_DIR = Path(os.environ.get("EASYCOPY_DATA_DIR", Path(__file__).parent / "data"))
+
+# Per-route request metrics for /metrics (outermost, so bytes are counted as sent);
+# EASYCOPY_PROFILE_RATE=0.01 writes a cProfile dump of 1% of requests to EASYCOPY_PROFILE_DIR
+app.add_middleware(
+    MetricsMiddleware,
+    profile_rate=float(os.environ.get("EASYCOPY_PROFILE_RATE", "0")),
+    profile_dir=os.environ.get("EASYCOPY_PROFILE_DIR", DATA_DIR / "profiles"),
+)
+
+# Read size for streaming blobs (a multiple of 3 so base64 chunks concatenate cleanly)
+STREAM_CHUNK_SIZE = 3 * 256 * 1024
+
+# Chunked upload sessions: chunk size bounds and default, and the most chunks
+# a session may have (larger sessions get a larger chunk size), which also
+# bounds its size along with the free disk space (see _max_session_size)
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_SESSION_CHUNKS = 16384
+MAX_SESSION_BYTES = MAX_SESSION_CHUNKS * MAX_CHUNK_SIZE
+
+# A delta upload may rebuild at most this many times the base's size plus
+# the size of the delta itself
+DELTA_MAX_EXPANSION = 4
+
+# Content types; a bundle is a tar stream of several files and directories
+CONTENT_TYPES = ("text", "file", "image", "bundle")
+ContentType = Literal[CONTENT_TYPES]
+
+# Clipboard history limits (the current entry is always kept)
+HISTORY_MAX_ENTRIES = int(os.environ.get("EASYCOPY_HISTORY_SIZE", "100"))
+HISTORY_MAX_BYTES = int(os.environ.get("EASYCOPY_HISTORY_MAX_BYTES", str(1024 ** 3)))
+HISTORY_MAX_AGE = int(os.environ.get("EASYCOPY_HISTORY_MAX_AGE", "0"))  # Seconds, 0 = no age limit
+HISTORY_PAGE_SIZE = 50
+
+# Where channel state lives: sqlite (a file in the data dir, shared by the
+# workers of one host), redis (shared by several hosts) or memory (one worker)
+STATE_BACKEND = os.environ.get("EASYCOPY_STATE_BACKEND", "sqlite")
+REDIS_URL = os.environ.get("EASYCOPY_REDIS_URL", "redis://localhost:6379/0")
+WORKERS = int(os.environ.get("EASYCOPY_WORKERS", "1"))
+
+# /status stays small: a text preview and a tiny thumbnail instead of the payload
+PREVIEW_CHARS = 300
+THUMBNAIL_SIZE = (160, 160)
+
+# Resized/re-encoded images (/download/image?width=...) kept in memory per worker
+IMAGE_CACHE_BYTES = int(os.environ.get("EASYCOPY_IMAGE_CACHE_BYTES", str(64 * 1024 ** 2)))
+
+# Threads for hashing, compressing and decoding request bodies, and how many
+# more tasks may wait for one before new uploads get 503 (see workpool.py)
+CPU_WORKERS = int(os.environ.get("EASYCOPY_CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+CPU_QUEUE = int(os.environ.get("EASYCOPY_CPU_QUEUE", "32"))
+# Request body bytes handed to the pool at a time
+WRITE_BATCH_SIZE = 1024 * 1024
+
+state_backend = open_backend(STATE_BACKEND, DATA_DIR, REDIS_URL, max_entries=HISTORY_MAX_ENTRIES,
+                             max_bytes=HISTORY_MAX_BYTES, max_age=HISTORY_MAX_AGE)
+blob_store = BlobStore(DATA_DIR, state_backend)
+upload_sessions = UploadSessions(DATA_DIR / "sessions")
+channels = Channels(blob_store, state_backend)
+cpu_pool = WorkPool(CPU_WORKERS, CPU_QUEUE)
+image_derivatives = ImageDerivatives(blob_store, IMAGE_CACHE_BYTES, cpu_pool)
+
+# API routes exist twice: at the top level for the default channel and under
+# /c/{channel}/ for named channels
+router = APIRouter(route_class=InstrumentedRoute)
+
+registry.gauge("easycopy_stored_payload_bytes", "Raw size of the payloads kept in all channel histories",
+               state_backend.total_bytes)
+registry.gauge("easycopy_channels", "Channels with content", lambda: len(state_backend.channels()))
+registry.gauge("easycopy_image_cache_bytes", "Size of the cached image derivatives",
+               lambda: image_derivatives.cache.total_bytes)
+image_renders = registry.counter("easycopy_image_derivatives_total", "Image derivative requests", ("result",))
+registry.gauge("easycopy_cpu_pool_tasks", "Tasks running or waiting in the CPU work pool", lambda: cpu_pool.pending)
+pool_rejections = registry.counter("easycopy_cpu_pool_rejected_total", "Requests refused because the CPU pool was full")
+registry.gauge("easycopy_event_subscribers", "Open /events streams",
+               lambda: sum(channel.events.subscriber_count for channel in channels))
+
+
+@app.exception_handler(PoolSaturated)
+async def pool_saturated(request: Request, exc: PoolSaturated):
+    pool_rejections.inc()
+    return JSONResponse({"detail": "Server busy, retry shortly"}, status_code=503, headers={"Retry-After": "1"})
+
+
+def get_channel(channel: str = DEFAULT_CHANNEL) -> Channel:
+    """Route dependency resolving the {channel} path segment (default channel without one)"""
+    if not is_channel_name(channel):
+        raise HTTPException(status_code=400, detail="Channel names are 1-64 letters, digits, '-' or '_'")
+    return channels.get(channel)
+
+
+async def _set_clipboard(channel, entry):
+    """
+    Replace a channel's current entry and notify its subscribers
+    The state backend update runs in a worker thread, so other channels (and
+    readers of this one) are never blocked
+    """
+    entry, version = await run_in_threadpool(channel.set, entry)
+    if entry["type"] is not None:
+        payload_size.observe(entry["size"], type=entry["type"])
+    # Skipped if a newer upload overtook this one and was announced already
+    channel.notify(entry, version)
+    return entry
+
+
+async def _get_clipboard(channel):
+    """A channel's current entry, read in a worker thread (state backends may block on I/O)"""
+    return await run_in_threadpool(lambda: channel.clipboard)
+
+
+async def _write_body(request, write, max_size=None):
+    """
+    Pass the request body to write in the CPU pool, WRITE_BATCH_SIZE bytes
+    at a time, in order; returns the number of bytes received. A body longer
+    than max_size is refused with 400 as soon as it gets there
+    """
+    batch, batched, size = [], 0, 0
+    async for chunk in request.stream():
+        batch.append(chunk)
+        batched += len(chunk)
+        if max_size is not None and size + batched > max_size:
+            raise HTTPException(status_code=400, detail=f"Body longer than {max_size} bytes")
+        if batched >= WRITE_BATCH_SIZE:
+            await cpu_pool.run(write, b"".join(batch))
+            size += batched
+            batch, batched = [], 0
+    if batched:
+        await cpu_pool.run(write, b"".join(batch))
+    return size + batched
+
+
+def _max_session_size():
+    """
+    Largest upload a chunked session or streamed delta may declare: the
+    upload limit, MAX_SESSION_BYTES and half the free space of the data dir
+    (a session's chunks and the blob assembled from them are on disk together)
+    """
+    free = shutil.disk_usage(DATA_DIR).free // 2
+    return min(upload_limits.max_body or MAX_SESSION_BYTES, MAX_SESSION_BYTES, free)
+
+
+def _log_upload(channel, entry, method, **fields):
+    extra = {"channel": channel.name, "type": entry["type"], "size": entry["size"],
+             "sha256": entry["sha256"], "method": method, **fields}
+    if entry["type"] == "file":
+        extra["file"] = entry["metadata"].get("filename", "")
+    elif entry["type"] == "bundle":
+        extra["files"] = entry["metadata"].get("files", 0)
+    logger.info("Uploaded", extra=extra)
+
+
+def _new_entry(content_type, digest, size, metadata):
+    return {
+        "type": content_type,
+        "sha256": digest,
+        "size": size,
+        "metadata": metadata or {},
+        "timestamp": datetime.utcnow().isoformat(),
+    }
+
+
+def _text_preview(entry):
+    """First PREVIEW_CHARS characters of a text entry, read without loading the rest"""
+    head = blob_store.read_head(entry["sha256"], PREVIEW_CHARS * 4)  # Worst case 4 bytes per UTF-8 character
+    text = head.decode("utf-8", errors="ignore")[:PREVIEW_CHARS]
+    return text, len(text.encode("utf-8")) < entry["size"]
+
+
+async def _thumbnail(digest):
+    """
+    Small JPEG data URL of an image blob, or None if Pillow is unavailable, it
+    fails or the CPU pool is too busy to render it
+    """
+    try:
+        item, _ = await image_derivatives.get(digest, *THUMBNAIL_SIZE, "jpeg", 70)
+    except PoolSaturated:
+        return None
+    if item is None:
+        return None
+    return "data:image/jpeg;base64," + base64.b64encode(item[0]).decode("ascii")
+
+
+def _iter_content_json(entry):
+    """
+    Yield the JSON-encoded content string of an entry piece by piece
+    Text is escaped incrementally, binary payloads are base64-encoded per chunk
+    """
+    yield '"'
+    encoding_time = 0.0
+    if entry["type"] == "text":
+        operation = "json_encode"
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        for chunk in blob_store.iter_chunks(entry["sha256"], STREAM_CHUNK_SIZE):
+            start = time.perf_counter()
+            encoded = json.dumps(decoder.decode(chunk), ensure_ascii=False)[1:-1]
+            encoding_time += time.perf_counter() - start
+            yield encoded
+        yield json.dumps(decoder.decode(b"", final=True), ensure_ascii=False)[1:-1]
+    else:
+        operation = "base64_encode"
+        for chunk in blob_store.iter_chunks(entry["sha256"], STREAM_CHUNK_SIZE):
+            start = time.perf_counter()
+            encoded = base64.b64encode(chunk).decode("ascii")
+            encoding_time += time.perf_counter() - start
+            yield encoded
+    codec_duration.observe(encoding_time, operation=operation)
+    yield '"'
+
+
+def _iter_download_json(entry):
+    """Produce the /download response body lazily, without building it in memory"""
+    yield '{"type": ' + json.dumps(entry["type"]) + ', "content": '
+    yield from _iter_content_json(entry)
+    yield (', "metadata": ' + json.dumps(entry["metadata"]) +
+           ', "timestamp": ' + json.dumps(entry["timestamp"]) + '}')
+
+
+def _should_compress(content_type, metadata):
+    """Whether a payload is worth storing compressed (already-compressed types are skipped)"""
+    if content_type in ("text", "bundle"):
+        return True
+    if content_type == "file":
+        return is_compressible((metadata or {}).get("mime_type"))
+    return False
+
+
+def _media(entry):
+    """(media type, filename, disposition) an entry is served with"""
+    metadata = entry["metadata"]
+    if entry["type"] == "text":
+        return "text/plain; charset=utf-8", "clipboard.txt", "inline"
+    if entry["type"] == "image":
+        image_format = metadata.get("format", "PNG").lower()
+        return f"image/{image_format}", f"clipboard_image.{image_format}", "inline"
+    if entry["type"] == "bundle":
+        return "application/x-tar", f"{metadata.get('name', 'bundle')}.tar", "attachment"
+    return (metadata.get("mime_type", "application/octet-stream"),
+            metadata.get("filename", "download"), "attachment")
+
+
+def _history_item(entry):
+    """History listing entry: metadata only, like /status without previews"""
+    return {
+        "id": entry["id"],
+        "type": entry["type"],
+        "size": entry["size"],
+        "sha256": entry["sha256"],
+        "metadata": entry["metadata"],
+        "timestamp": entry["timestamp"],
+    }
+
+
+def _wrong_type(entry, detail):
+    """404 for a type-specific download; X-EasyCopy-Type tells clients where the content is instead"""
+    headers = {"X-EasyCopy-Type": entry["type"]} if entry["type"] else None
+    return HTTPException(status_code=404, detail=detail, headers=headers)
+
+
+def _etag(entry, encoding=None):
+    """
+    Strong ETag of an entry: its content hash
+    Compressed representations get the encoding appended ("<sha256>-gzip"),
+    image derivatives their parameters
+    """
+    if encoding:
+        return f'"{entry["sha256"]}-{encoding}"'
+    return f'"{entry["sha256"]}"'
+
+
+def _not_modified(request, entry):
+    """True if the request's If-None-Match already names the entry's content (in any encoding)"""
+    header = request.headers.get("if-none-match")
+    if not header or entry["sha256"] is None:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip().removeprefix("W/").strip('"')
+        if tag == "*" or tag.split("-")[0] == entry["sha256"]:
+            return True
+    return False
+
+
+def _parse_metadata_header(request):
+    """Decode the URL-encoded JSON X-EasyCopy-Metadata request header"""
+    try:
+        metadata = json.loads(unquote(request.headers.get("x-easycopy-metadata", "{}")))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid X-EasyCopy-Metadata header")
+    if not isinstance(metadata, dict):
+        raise HTTPException(status_code=400, detail="Invalid X-EasyCopy-Metadata header")
+    return metadata
+
+
+def _int_header(request, name, minimum=0, maximum=None):
+    """Integer value of a required request header (400 if missing or out of range)"""
+    try:
+        value = int(request.headers[name])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Missing or invalid {name} header")
+    if value < minimum or (maximum is not None and value > maximum):
+        raise HTTPException(status_code=400, detail=f"{name} out of range")
+    return value
+
+
+def _blob_signature(digest, block_size):
+    """Delta signature of a blob, cached next to it (blobs never change)"""
+    path = blob_store.signature_path(digest, block_size)
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        pass
+    signature = make_signature(blob_store.iter_chunks(digest, block_size))
+    tmp_path = blob_store.tmp_dir / f"{uuid.uuid4().hex}.sig"
+    tmp_path.write_bytes(signature)
+    os.replace(tmp_path, path)
+    return signature
+
+
+def _iter_delta(digest, signature, block_size, base_size):
+    """Delta stream rebuilding a blob from the client's copy described by signature"""
+    with blob_store.open_raw(digest) as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield from encode_delta(b"", [])
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield from encode_delta(data, plan_delta(data, signature, block_size, base_size))
+
+
+def _get_session(session_id):
+    session = upload_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+
+def _assemble_session(session, expected_sha256):
+    """Concatenate a session's chunks into a blob, verifying the whole-file hash"""
+    compress = _should_compress(session.info["type"], session.info["metadata"])
+    with blob_store.writer(compress=compress) as writer:
+        for index in range(session.chunk_count):
+            with open(session.chunk_path(index), "rb") as f:
+                while chunk := f.read(STREAM_CHUNK_SIZE):
+                    writer.write(chunk)
+        if writer.hexdigest() != expected_sha256:
+            writer.abort()
+            return None, writer.size
+        return writer.commit(), writer.size
+
+
+def _content_disposition(disposition, filename):
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition}; filename*=utf-8''{quoted}"
+    return f'{disposition}; filename="{filename}"'
+
+
+async def _blob_response(request, entry, media_type, filename, disposition="attachment"):
+    """
+    Serve an entry's blob
+    Everything goes out with sendfile and supports Range/If-Range; the content
+    hash is the ETag so resumes are safe across uploads. Compressed blobs are
+    sent as stored to clients accepting their encoding. Other clients get
+    them decompressed on the fly, or from a decoded copy once they ask for a
+    range. Metadata is mirrored in X-EasyCopy-Metadata.
+    """
+    path, encoding = blob_store.find(entry["sha256"])
+    headers = {
+        "X-EasyCopy-Metadata": quote(json.dumps(entry["metadata"])),
+        "Vary": "Accept-Encoding",
+    }
+    accepted = encoding is None or negotiate(request.headers.get("accept-encoding"), (encoding,))
+    if not accepted and ("range" in request.headers or blob_store.decoded_path(entry["sha256"]).is_file()):
+        path = await cpu_pool.run(blob_store.decoded_copy, entry["sha256"])
+        encoding, accepted = None, True
+    if accepted:
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        return FileResponse(
+            path,
+            media_type=media_type,
+            filename=filename,
+            content_disposition_type=disposition,
+            headers={**headers, "ETag": _etag(entry, encoding)},
+        )
+    return StreamingResponse(
+        blob_store.iter_chunks(entry["sha256"]),
+        media_type=media_type,
+        headers={
+            **headers,
+            "ETag": _etag(entry),
+            "Content-Length": str(entry["size"]),
+            "Content-Disposition": _content_disposition(disposition, filename),
+            "Accept-Ranges": "bytes",
+        },
+    )
 
 
 # Runtime config endpoint for frontend
@@ -45,11 +505,29 @@ def get_config():
 
 
 class ClipboardUpload(BaseModel):
-    type: Literal["text", "file", "image"]
+    type: ContentType
     content: str  # For text: plain text; For file/image: base64 encoded
     metadata: Optional[dict] = {}
 
 
+class UploadSessionCreate(BaseModel):
+    type: ContentType
+    size: int = Field(ge=0)  # Total payload size in bytes
+    chunk_size: int = Field(DEFAULT_CHUNK_SIZE, ge=MIN_CHUNK_SIZE, le=MAX_CHUNK_SIZE)
+    sha256: Optional[str] = None  # Lets an interrupted client find its session again
+    metadata: Optional[dict] = {}
+
+
+class HashUpload(BaseModel):
+    type: ContentType
+    sha256: str  # Digest of content the client believes the server already has
+    metadata: Optional[dict] = {}
+
+
+class UploadSessionCommit(BaseModel):
+    sha256: str  # Hash of the whole payload, verified before it replaces the clipboard
+
+
 class ClipboardResponse(BaseModel):
     type: Optional[str]
     content: Optional[str]
@@ -57,126 +535,558 @@ class ClipboardResponse(BaseModel):
     timestamp: Optional[str]
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics (text exposition format)"""
+    # Gauges query the state backend
+    return PlainTextResponse(await run_in_threadpool(registry.render), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/health")
 async def health():
     """Health check endpoint"""
     return {"status": "ok", "service": "easycopy-server"}
 
 
-@app.post("/upload")
-async def upload_clipboard(data: ClipboardUpload):
+def _decode_upload(body):
+    """
+    Validate an /upload body and decode its content (run in the CPU pool)
+    Returns (upload, raw payload bytes)
+    """
+    try:
+        with codec_duration.time(operation="json_decode"):
+            data = ClipboardUpload.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError([{**error, "loc": ("body", *error["loc"])}
+                                      for error in e.errors(include_url=False)])
+    if data.type == "text":
+        return data, data.content.encode("utf-8")
+    try:
+        with codec_duration.time(operation="base64_decode"):
+            return data, base64.b64decode(data.content, validate=True)
+    except binascii.Error:
+        raise HTTPException(status_code=400, detail="Content is not valid base64")
+
+
+@router.post("/upload", openapi_extra={"requestBody": {
+    "required": True, "content": {"application/json": {"schema": ClipboardUpload.model_json_schema()}}}})
+async def upload_clipboard(request: Request, channel: Channel = Depends(get_channel)):
     """
     Upload clipboard content to server
     Replaces the current stored content
     """
-    global clipboard_data
-    
-    clipboard_data = {
+    cpu_pool.admit()
+    data, raw = await cpu_pool.run(_decode_upload, await request.body())
+    digest, size = await cpu_pool.run(blob_store.put_bytes, raw, _should_compress(data.type, data.metadata))
+    entry = await _set_clipboard(channel, _new_entry(data.type, digest, size, data.metadata))
+
+    _log_upload(channel, entry, "json")
+
+    return {
+        "status": "success",
         "type": data.type,
-        "content": data.content,
-        "metadata": data.metadata or {},
-        "timestamp": datetime.utcnow().isoformat(),
+        "size": size,
+        "sha256": digest,
+        "timestamp": entry['timestamp']
     }
-    
-    print(f"[{clipboard_data['timestamp']}] Uploaded {data.type} " +
-          f"({len(data.content)} bytes)" +
-          (f" - {data.metadata.get('filename', '')}" if data.type == 'file' else ""))
-    
+
+
+@router.put("/upload/raw")
+async def upload_raw(request: Request, channel: Channel = Depends(get_channel)):
+    """
+    Stream raw clipboard bytes to server
+    The body is written to disk chunk by chunk; type and metadata come from
+    the X-EasyCopy-Type and X-EasyCopy-Metadata (URL-encoded JSON) headers
+    """
+    content_type = request.headers.get("x-easycopy-type", "file")
+    if content_type not in CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Invalid content type: {content_type}")
+
+    metadata = _parse_metadata_header(request)
+
+    cpu_pool.admit()
+    with blob_store.writer(compress=_should_compress(content_type, metadata)) as writer:
+        await _write_body(request, writer.write)
+        digest = await cpu_pool.run(writer.commit)
+
+    entry = await _set_clipboard(channel, _new_entry(content_type, digest, writer.size, metadata))
+
+    _log_upload(channel, entry, "raw")
+
+    return {
+        "status": "success",
+        "type": content_type,
+        "size": writer.size,
+        "sha256": digest,
+        "timestamp": entry['timestamp']
+    }
+
+
+@router.post("/upload/hash")
+async def upload_by_hash(data: HashUpload, channel: Channel = Depends(get_channel)):
+    """
+    Replace the clipboard with content the server already stores
+    Returns 404 if the hash is unknown, in which case the client sends the body
+    """
+    digest = data.sha256.lower()
+    if not await run_in_threadpool(blob_store.claim, digest):
+        raise HTTPException(status_code=404, detail="Content not stored, upload the body")
+
+    size = blob_store.size(digest)
+    entry = await _set_clipboard(channel, _new_entry(data.type, digest, size, data.metadata))
+
+    _log_upload(channel, entry, "hash")
+
     return {
         "status": "success",
         "type": data.type,
-        "size": len(data.content),
-        "timestamp": clipboard_data['timestamp']
+        "size": size,
+        "sha256": digest,
+        "deduplicated": True,
+        "timestamp": entry['timestamp']
     }
 
 
-@app.get("/download")
-async def download_clipboard() -> ClipboardResponse:
+@router.get("/history/{entry_id}/signature")
+async def get_history_signature(entry_id: int, channel: Channel = Depends(get_channel),
+                                block_size: Optional[int] = Query(None, ge=MIN_BLOCK_SIZE, le=MAX_BLOCK_SIZE)):
+    """
+    Block signature of a history entry, the base for /upload/delta
+    The block size defaults to one suited to the entry's size and is returned
+    in X-EasyCopy-Block-Size, the entry's raw size in X-EasyCopy-Size
+    """
+    entry = await run_in_threadpool(channel.history.get, entry_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="History entry not found")
+
+    block_size = block_size or block_size_for(entry["size"])
+    cpu_pool.admit()
+    signature = await cpu_pool.run(_blob_signature, entry["sha256"], block_size)
+    return Response(signature, media_type="application/octet-stream", headers={
+        "ETag": _etag(entry),
+        "X-EasyCopy-Block-Size": str(block_size),
+        "X-EasyCopy-Size": str(entry["size"]),
+    })
+
+
+@router.put("/upload/delta")
+async def upload_delta(request: Request, channel: Channel = Depends(get_channel)):
+    """
+    Upload a new version of stored content as a delta against it
+    The base is the history entry X-EasyCopy-Base, or any content the server
+    stores by its hash in X-EasyCopy-Base-SHA256 (for clients that keep the
+    base themselves, like the text of the last sync). X-EasyCopy-Block-Size
+    is the block size the delta was made with, X-EasyCopy-SHA256 the hash of
+    the result and X-EasyCopy-Size (optional) its size; type and metadata
+    headers as for /upload/raw. 404 if the base has been evicted (send the
+    whole content instead), 400 if the result grows beyond its size or
+    DELTA_MAX_EXPANSION, 422 if it does not match the hash
+    """
+    content_type = request.headers.get("x-easycopy-type", "file")
+    if content_type not in CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Invalid content type: {content_type}")
+    metadata = _parse_metadata_header(request)
+    block_size = _int_header(request, "x-easycopy-block-size", MIN_BLOCK_SIZE, MAX_BLOCK_SIZE)
+    expected_sha256 = request.headers.get("x-easycopy-sha256", "").lower()
+
+    base_sha256 = request.headers.get("x-easycopy-base-sha256", "").lower()
+    if base_sha256:
+        base_id = None
+    else:
+        base_id = _int_header(request, "x-easycopy-base")
+        base = await run_in_threadpool(channel.history.get, base_id)
+        base_sha256 = base["sha256"] if base is not None else None
+    if base_sha256 is None or not blob_store.exists(base_sha256):
+        raise HTTPException(status_code=404, detail="Base entry not found, upload the whole file")
+
+    base_size = await run_in_threadpool(blob_store.size, base_sha256)
+    declared_size = None
+    if "x-easycopy-size" in request.headers:
+        declared_size = _int_header(request, "x-easycopy-size")
+        # A streamed delta's own size is unknown until it has arrived
+        length = request.headers.get("content-length", "")
+        max_size = DELTA_MAX_EXPANSION * base_size + int(length) if length.isdigit() else _max_session_size()
+        if declared_size > max_size:
+            raise HTTPException(status_code=400, detail="X-EasyCopy-Size too large for the base and delta")
+    delta_size = 0
+
+    cpu_pool.admit()
+    with ExitStack() as stack:
+        writer = stack.enter_context(blob_store.writer(compress=_should_compress(content_type, metadata)))
+        base_file = await run_in_threadpool(stack.enter_context, blob_store.open_raw(base_sha256))
+
+        def write(data):
+            # Copy instructions can repeat the base without end
+            size = writer.size + len(data)
+            if size > DELTA_MAX_EXPANSION * base_size + delta_size:
+                raise HTTPException(status_code=400, detail="Delta result too large for its base")
+            if declared_size is not None and size > declared_size:
+                raise HTTPException(status_code=400, detail="Delta result larger than X-EasyCopy-Size")
+            writer.write(data)
+            if upload_limits.max_body and writer.size > upload_limits.max_body:
+                raise upload_limits.too_large(upload_limits.max_body)
+
+        def feed(data):
+            nonlocal delta_size
+            delta_size += len(data)
+            decoder.feed(data)
+
+        decoder = DeltaDecoder(base_file, block_size, write)
+        try:
+            await _write_body(request, feed)
+            decoder.close()
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid delta: {e}")
+        if writer.hexdigest() != expected_sha256:
+            raise HTTPException(status_code=422, detail="Hash mismatch, upload discarded")
+        digest = await cpu_pool.run(writer.commit)
+
+    entry = await _set_clipboard(channel, _new_entry(content_type, digest, writer.size, metadata))
+
+    _log_upload(channel, entry, "delta", base=base_id if base_id is not None else base_sha256)
+
+    return {
+        "status": "success",
+        "type": content_type,
+        "size": writer.size,
+        "sha256": digest,
+        "timestamp": entry['timestamp']
+    }
+
+
+@router.post("/upload/sessions")
+async def create_upload_session(data: UploadSessionCreate):
+    """
+    Start a chunked upload
+    Returns the session id and the chunks the server already has (non-empty
+    when resuming an interrupted upload of the same content). The chunk
+    size may be larger than requested, to keep within MAX_SESSION_CHUNKS
+    """
+    max_size = await run_in_threadpool(_max_session_size)
+    if data.size > max_size:
+        raise upload_limits.too_large(max_size)
+    chunk_size = max(data.chunk_size, -(-data.size // MAX_SESSION_CHUNKS))
+    session = upload_sessions.create(data.type, data.metadata or {}, data.size, chunk_size, data.sha256)
+    return session.summary()
+
+
+@router.get("/upload/sessions/{session_id}")
+async def get_upload_session(session_id: str):
+    """List the chunks received so far"""
+    return _get_session(session_id).summary()
+
+
+@router.put("/upload/sessions/{session_id}/chunks/{index}")
+async def upload_chunk(session_id: str, index: int, request: Request):
+    """Store one numbered chunk; chunks may arrive in any order and in parallel"""
+    session = _get_session(session_id)
+    if not 0 <= index < session.chunk_count:
+        raise HTTPException(status_code=400, detail=f"Chunk index out of range (0-{session.chunk_count - 1})")
+
+    chunk_path = session.chunk_path(index)
+    tmp_path = session.path / f"{index:08d}.{uuid.uuid4().hex}.tmp"
+    expected_size = session.expected_chunk_size(index)
+    cpu_pool.admit()
+    try:
+        with open(tmp_path, "wb") as f:
+            size = await _write_body(request, f.write, expected_size)
+        if size != expected_size:
+            raise HTTPException(status_code=400, detail=f"Chunk {index} must be {expected_size} bytes, got {size}")
+        os.replace(tmp_path, chunk_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    session.touch()
+    return {"status": "success", "index": index, "size": size}
+
+
+@router.post("/upload/sessions/{session_id}/commit")
+async def commit_upload_session(session_id: str, data: UploadSessionCommit, channel: Channel = Depends(get_channel)):
+    """Assemble all chunks, verify the whole-file hash and replace the clipboard"""
+    session = _get_session(session_id)
+    missing = session.missing()
+    if missing:
+        raise HTTPException(status_code=409, detail={"message": "Missing chunks", "missing": missing})
+
+    cpu_pool.admit()
+    digest, size = await cpu_pool.run(_assemble_session, session, data.sha256.lower())
+    if digest is None:
+        upload_sessions.delete(session)
+        raise HTTPException(status_code=422, detail="Hash mismatch, upload discarded")
+
+    upload_sessions.delete(session)
+    content_type, metadata = session.info["type"], session.info["metadata"]
+    entry = await _set_clipboard(channel, _new_entry(content_type, digest, size, metadata))
+
+    _log_upload(channel, entry, "chunked", chunks=session.chunk_count)
+
+    return {
+        "status": "success",
+        "type": content_type,
+        "size": size,
+        "sha256": digest,
+        "timestamp": entry['timestamp']
+    }
+
+
+@router.delete("/upload/sessions/{session_id}")
+async def abort_upload_session(session_id: str):
+    """Discard an unfinished upload"""
+    upload_sessions.delete(_get_session(session_id))
+    return {"status": "success"}
+
+
+@router.get("/download", response_model=ClipboardResponse)
+async def download_clipboard(request: Request, channel: Channel = Depends(get_channel)):
     """
     Download the latest clipboard content from server
-    Returns 404 if no content is available
+    Returns 404 if no content is available, 304 if If-None-Match matches
+    The JSON body is streamed straight from the blob on disk
     """
-    if clipboard_data["type"] is None:
+    entry = await _get_clipboard(channel)
+    if entry["type"] is None:
         raise HTTPException(status_code=404, detail="No clipboard data available")
-    
-    print(f"[{datetime.utcnow().isoformat()}] Downloaded {clipboard_data['type']}")
-    
-    return ClipboardResponse(
-        type=clipboard_data["type"],
-        content=clipboard_data["content"],
-        metadata=clipboard_data["metadata"],
-        timestamp=clipboard_data["timestamp"]
-    )
 
+    if _not_modified(request, entry):
+        return Response(status_code=304, headers={"ETag": _etag(entry)})
+
+    logger.info("Downloaded", extra={"channel": channel.name, "type": entry["type"], "size": entry["size"]})
+
+    body = _iter_download_json(entry)
+    # Type and size let clients switch to a raw, ranged or delta transfer
+    # before reading the body
+    headers = {"ETag": _etag(entry), "Vary": "Accept-Encoding",
+               "X-EasyCopy-Type": entry["type"], "X-EasyCopy-Size": str(entry["size"])}
+    encoding = negotiate(request.headers.get("accept-encoding"))
+    if encoding and entry["size"] >= MIN_COMPRESS_SIZE and blob_store.find(entry["sha256"])[1]:
+        # Only payloads that were worth compressing at rest are worth compressing on the wire
+        body = compress_stream(body, encoding)
+        headers.update({"Content-Encoding": encoding, "ETag": _etag(entry, encoding)})
 
-@app.get("/status")
-async def get_status():
-    """Get information about the currently stored clipboard data"""
-    if clipboard_data["type"] is None:
+    return StreamingResponse(body, media_type="application/json", headers=headers)
+
+
+@router.get("/status")
+async def get_status(channel: Channel = Depends(get_channel)):
+    """
+    Get information about the currently stored clipboard data
+    Metadata only - the size of the response does not depend on the payload;
+    full content is available from /download/text, /download/file, /download/image
+    and /download/bundle
+    """
+    entry = await _get_clipboard(channel)
+    if entry["type"] is None:
         return {"has_data": False}
-    
-    return {
+
+    status = {
         "has_data": True,
-        "type": clipboard_data["type"],
-        "content": clipboard_data["content"],  # Include content for web viewer
-        "size": len(clipboard_data["content"]) if clipboard_data["content"] else 0,
-        "metadata": clipboard_data["metadata"],
-        "timestamp": clipboard_data["timestamp"]
+        "type": entry["type"],
+        "size": entry["size"],
+        "sha256": entry["sha256"],
+        "metadata": entry["metadata"],
+        "timestamp": entry["timestamp"]
     }
+    if entry["type"] == "text":
+        status["preview"], status["preview_truncated"] = _text_preview(entry)
+    elif entry["type"] == "image":
+        status["thumbnail"] = await _thumbnail(entry["sha256"])
+    return status
+
+
+@router.get("/events")
+async def clipboard_events(channel: Channel = Depends(get_channel)):
+    """
+    Server-Sent Events stream of clipboard changes
+    Each "change" event carries type, size, sha256 and timestamp (type is
+    null after a clear); the current state is sent on connect
+    """
+    return StreamingResponse(
+        channel.events.stream(initial_event=change_event(await _get_clipboard(channel))),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
-@app.delete("/clear")
-async def clear_clipboard():
-    """Clear the stored clipboard data"""
-    global clipboard_data
-    
-    clipboard_data = {
-        "type": None,
-        "content": None,
-        "metadata": {},
-        "timestamp": None,
+@router.get("/history")
+async def get_history(before: Optional[int] = None, limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=500),
+                      channel: Channel = Depends(get_channel)):
+    """
+    List clipboard history, newest first (metadata only)
+    Pass the returned next_before as before to get the next page
+    """
+    page, next_before = await run_in_threadpool(channel.history.page, before=before, limit=limit)
+    total, total_bytes = await run_in_threadpool(channel.history.stats)
+    return {
+        "entries": [_history_item(entry) for entry in page],
+        "total": total,
+        "total_bytes": total_bytes,
+        "next_before": next_before,
     }
-    
-    print(f"[{datetime.utcnow().isoformat()}] Clipboard cleared")
+
+
+@router.api_route("/history/{entry_id}", methods=["GET", "HEAD"])
+async def download_history_entry(entry_id: int, request: Request, channel: Channel = Depends(get_channel)):
+    """
+    Download the content of a history entry (Range/If-Range supported)
+    Served like /download/text, /download/file and /download/image
+    """
+    entry = await run_in_threadpool(channel.history.get, entry_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="History entry not found")
+
+    if _not_modified(request, entry):
+        return Response(status_code=304, headers={"ETag": _etag(entry)})
+
+    response = await _blob_response(request, entry, *_media(entry))
+    response.headers["X-EasyCopy-Type"] = entry["type"]
+    return response
+
+
+@router.delete("/clear")
+async def clear_clipboard(channel: Channel = Depends(get_channel)):
+    """Clear the stored clipboard data (the history is kept)"""
+    await _set_clipboard(channel, dict(EMPTY_CLIPBOARD))
+
+    logger.info("Clipboard cleared", extra={"channel": channel.name})
     return {"status": "success", "message": "Clipboard data cleared"}
 
 
-@app.get("/download/file")
-async def download_file():
-    """Download the stored file with original filename"""
-    if clipboard_data["type"] != "file":
-        raise HTTPException(status_code=404, detail="No file available")
-    
-    filename = clipboard_data["metadata"].get("filename", "download")
-    mime_type = clipboard_data["metadata"].get("mime_type", "application/octet-stream")
-    
-    # Decode base64 content
-    file_content = base64.b64decode(clipboard_data["content"])
-    
-    return Response(
-        content=file_content,
-        media_type=mime_type,
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+@router.api_route("/download/text", methods=["GET", "HEAD"])
+async def download_text(request: Request, channel: Channel = Depends(get_channel)):
+    """Download the stored text as text/plain (Range/If-Range supported)"""
+    entry = await _get_clipboard(channel)
+    if entry["type"] != "text":
+        raise _wrong_type(entry, "No text available")
 
+    if _not_modified(request, entry):
+        return Response(status_code=304, headers={"ETag": _etag(entry)})
 
-@app.get("/download/image")
-async def download_image():
-    """Download the stored image"""
-    if clipboard_data["type"] != "image":
-        raise HTTPException(status_code=404, detail="No image available")
-    
-    image_format = clipboard_data["metadata"].get("format", "PNG").lower()
-    mime_type = f"image/{image_format}"
-    
-    # Decode base64 content
-    image_content = base64.b64decode(clipboard_data["content"])
-    
-    return Response(
-        content=image_content,
-        media_type=mime_type,
-        headers={"Content-Disposition": f"inline; filename=clipboard_image.{image_format}"}
-    )
+    return await _blob_response(request, entry, *_media(entry))
+
+
+@router.api_route("/download/file", methods=["GET", "HEAD"])
+async def download_file(request: Request, channel: Channel = Depends(get_channel)):
+    """
+    Download the stored file with original filename
+    Supports Range/If-Range for resumable and parallel downloads
+    """
+    entry = await _get_clipboard(channel)
+    if entry["type"] != "file":
+        raise _wrong_type(entry, "No file available")
+
+    if _not_modified(request, entry):
+        return Response(status_code=304, headers={"ETag": _etag(entry)})
+
+    return await _blob_response(request, entry, *_media(entry))
+
+
+@router.api_route("/download/bundle", methods=["GET", "HEAD"])
+async def download_bundle(request: Request, channel: Channel = Depends(get_channel)):
+    """
+    Download the stored bundle as a tar stream (Range/If-Range supported)
+    Clients extract it while it arrives
+    """
+    entry = await _get_clipboard(channel)
+    if entry["type"] != "bundle":
+        raise _wrong_type(entry, "No bundle available")
+
+    if _not_modified(request, entry):
+        return Response(status_code=304, headers={"ETag": _etag(entry)})
+
+    return await _blob_response(request, entry, *_media(entry))
+
+
+@router.post("/download/delta")
+async def download_delta(request: Request, channel: Channel = Depends(get_channel)):
+    """
+    The stored file or text as a delta against the client's copy of an older version
+    The body is the signature of that copy (see delta.py), with its block size
+    in X-EasyCopy-Block-Size and its size in X-EasyCopy-Size; or, with an
+    empty body, X-EasyCopy-Base-SHA256 names a version the server stores
+    (404 if it has been evicted: fetch the whole content instead). The
+    response is a delta stream with its block size in X-EasyCopy-Block-Size;
+    ETag and X-EasyCopy-Metadata as for /download/file
+    """
+    entry = await _get_clipboard(channel)
+    if entry["type"] not in ("file", "text"):
+        raise _wrong_type(entry, "No file or text available")
+
+    if _not_modified(request, entry):
+        return Response(status_code=304, headers={"ETag": _etag(entry)})
+
+    base_sha256 = request.headers.get("x-easycopy-base-sha256", "").lower()
+    if base_sha256:
+        if not blob_store.exists(base_sha256):
+            raise HTTPException(status_code=404, detail="Base not stored, download the whole content")
+        base_size = blob_store.size(base_sha256)
+        block_size = block_size_for(base_size)
+        cpu_pool.admit()
+        signature = await cpu_pool.run(_blob_signature, base_sha256, block_size)
+    else:
+        block_size = _int_header(request, "x-easycopy-block-size", MIN_BLOCK_SIZE, MAX_BLOCK_SIZE)
+        base_size = _int_header(request, "x-easycopy-size")
+        signature = await request.body()
+        if (len(signature) % SIGNATURE_RECORD.size
+                or len(signature) // SIGNATURE_RECORD.size != -(-base_size // block_size)):
+            raise HTTPException(status_code=400, detail="Signature does not match X-EasyCopy-Size")
+
+    body = _iter_delta(entry["sha256"], signature, block_size, base_size)
+    headers = {"ETag": _etag(entry), "X-EasyCopy-Metadata": quote(json.dumps(entry["metadata"])),
+               "X-EasyCopy-Block-Size": str(block_size), "Vary": "Accept-Encoding"}
+    encoding = negotiate(request.headers.get("accept-encoding"))
+    if encoding and blob_store.find(entry["sha256"])[1]:
+        # Literal bytes of payloads worth compressing at rest are worth compressing on the wire
+        body = compress_stream(body, encoding)
+        headers["Content-Encoding"] = encoding
+
+    return StreamingResponse(body, media_type="application/octet-stream", headers=headers)
+
+
+@router.api_route("/download/image", methods=["GET", "HEAD"])
+async def download_image(
+    request: Request,
+    channel: Channel = Depends(get_channel),
+    width: Optional[int] = Query(None, ge=1, le=MAX_DIMENSION),
+    height: Optional[int] = Query(None, ge=1, le=MAX_DIMENSION),
+    image_format: Optional[Literal[IMAGE_FORMATS]] = Query(None, alias="format"),
+    quality: Optional[int] = Query(None, ge=1, le=100),
+):
+    """
+    Download the stored image (Range/If-Range supported)
+    width/height (fit inside, never enlarged), format and quality ask for a
+    derivative instead (rounded to images.SIZE_STEP and QUALITY_STEP),
+    rendered once and cached; the original is served if it already matches or
+    Pillow is unavailable
+    """
+    entry = await _get_clipboard(channel)
+    if entry["type"] != "image":
+        raise _wrong_type(entry, "No image available")
+
+    params = snap_image_params(width, height, image_format, quality)
+    width, height, image_format, quality = params
+    # Derivatives are tagged like compressed representations: "<sha256>-<parameters>"
+    variant = None
+    if params != (None,) * 4:
+        variant = f"{width or 0}x{height or 0}-{image_format or 'same'}-q{quality or 0}"
+    if _not_modified(request, entry):
+        return Response(status_code=304, headers={"ETag": _etag(entry, variant)})
+
+    if variant:
+        item, cached = await image_derivatives.get(entry["sha256"], *params)
+        image_renders.inc(result="original" if item is None else "hit" if cached else "render")
+        if item is not None:
+            data, rendered_format = item
+            return Response(data, media_type=f"image/{rendered_format}", headers={
+                "ETag": _etag(entry, variant),
+                "X-EasyCopy-Metadata": quote(json.dumps(entry["metadata"])),
+                "Content-Disposition": _content_disposition("inline", f"clipboard_image.{rendered_format}"),
+            })
+
+    return await _blob_response(request, entry, *_media(entry))
+
+
+app.include_router(router)
+app.include_router(router, prefix="/c/{channel}", dependencies=[Depends(get_channel)])
 
 
 # Mount static files at root level to serve webapp assets
@@ -187,4 +1097,7 @@ if static_dir.exists():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if WORKERS > 1 and not state_backend.shared:
+        sys.exit(f"EASYCOPY_WORKERS={WORKERS} needs a shared state backend (sqlite or redis), not {STATE_BACKEND}")
+    # Several workers need the app as an import string so each process loads its own
+    uvicorn.run("main:app" if WORKERS > 1 else app, host="0.0.0.0", port=8000, workers=WORKERS)
@@ -0,0 +1,298 @@
+"""
+EasyCopy Server - Metrics and profiling
+Minimal Prometheus metrics (text exposition format, no client library
+needed), an ASGI middleware recording per-route request counts, latency and
+bytes in/out, event loop lag sampling, and optional sampled cProfile dumps
+of single requests
+"""
+
+import asyncio
+import cProfile
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.routing import APIRoute
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(11))  # 1 KB .. 1 GB
+LAG_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+# Seconds between event loop lag samples
+LAG_SAMPLE_INTERVAL = 0.1
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                                for key, value in values]
+
+
+class Gauge(_Metric):
+    """Gauge whose value is read from a callback at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def render(self):
+        value = self.callback()
+        if value is None:
+            return []
+        return self.header() + [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def time(self, **labels):
+        """Context manager observing the duration of a block"""
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            values = [(key, list(state)) for key, state in self._values.items()]
+        lines = self.header()
+        for key, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                labels = _format_labels(self.label_names + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, callback):
+        return self.register(Gauge(name, documentation, callback))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def resident_memory():
+    """Current RSS of this process in bytes (Linux), or None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+registry = Registry()
+
+requests_total = registry.counter(
+    "easycopy_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+request_duration = registry.histogram(
+    "easycopy_request_duration_seconds", "Time to serve a request, including streaming the body",
+    ("method", "route"))
+request_bytes = registry.counter(
+    "easycopy_request_bytes_total", "Request body bytes received (as sent, before decompression)", ("route",))
+response_bytes = registry.counter(
+    "easycopy_response_bytes_total", "Response body bytes sent", ("route",))
+codec_duration = registry.histogram(
+    "easycopy_codec_seconds", "Time spent in base64 and JSON encoding/decoding of payloads", ("operation",))
+payload_size = registry.histogram(
+    "easycopy_payload_bytes", "Raw size of stored clipboard payloads", ("type",), buckets=SIZE_BUCKETS)
+registry.gauge("process_resident_memory_bytes", "Resident memory size in bytes", resident_memory)
+event_loop_lag = registry.histogram(
+    "easycopy_event_loop_lag_seconds", "How late the event loop runs a timer (time it was blocked)",
+    buckets=LAG_BUCKETS)
+_last_lag = 0.0
+registry.gauge("easycopy_event_loop_lag_last_seconds", "Most recent event loop lag sample", lambda: _last_lag)
+
+
+async def monitor_event_loop(interval=LAG_SAMPLE_INTERVAL):
+    """
+    Sample how late the event loop wakes up from a sleep of interval seconds
+    Runs for the lifetime of the app; anything blocking the loop (CPU work
+    that should be in the work pool) shows up as lag
+    """
+    global _last_lag
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        _last_lag = max(loop.time() - start - interval, 0.0)
+        event_loop_lag.observe(_last_lag)
+
+
+class _TimedJSONRequest(Request):
+    async def json(self):
+        if hasattr(self, "_json"):
+            return self._json
+        await self.body()  # Receiving the body is not decoding time
+        with codec_duration.time(operation="json_decode"):
+            return await super().json()
+
+
+class InstrumentedRoute(APIRoute):
+    """Route class timing the JSON decoding of request bodies"""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            return await handler(_TimedJSONRequest(request.scope, request.receive))
+
+        return timed_handler
+
+
+class MetricsMiddleware:
+    """
+    Record request count, latency and body bytes per route template
+    With profile_rate > 0, that fraction of requests is run under cProfile and
+    the stats are written to profile_dir (one request at a time; the profile
+    covers everything the event loop thread does meanwhile)
+    """
+
+    def __init__(self, app, profile_rate=0.0, profile_dir=None):
+        self.app = app
+        self.profile_rate = profile_rate
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self._profiling = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        received = sent = 0
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        profiler = None
+        if self.profile_rate and not self._profiling and random.random() < self.profile_rate:
+            self._profiling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            route = getattr(route, "path_format", None) or "other"
+            method = scope["method"]
+            requests_total.inc(method=method, route=route, status=status)
+            request_duration.observe(elapsed, method=method, route=route)
+            request_bytes.inc(received, route=route)
+            response_bytes.inc(sent, route=route)
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                self._dump_profile(profiler, method, route)
+
+    def _dump_profile(self, profiler, method, route):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        name = route.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+        profiler.dump_stats(self.profile_dir / f"{time.time_ns()}-{method}-{name}-{os.getpid()}.prof")
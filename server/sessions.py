@@ -0,0 +1,128 @@
+"""
+EasyCopy Server - Chunked upload sessions
+A session collects numbered chunks (uploaded in any order, possibly in
+parallel) under <data dir>/sessions/<id>/ until the client commits it
+with the whole-file hash
+"""
+
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+from storage import load_json, save_json
+
+# Sessions untouched for this long are removed
+SESSION_TTL = 24 * 60 * 60
+
+
+class UploadSession:
+    def __init__(self, path, info):
+        self.path = Path(path)
+        self.info = info
+
+    @property
+    def id(self):
+        return self.info["id"]
+
+    @property
+    def chunk_count(self):
+        size, chunk_size = self.info["size"], self.info["chunk_size"]
+        return max(1, -(-size // chunk_size))
+
+    def expected_chunk_size(self, index):
+        if index == self.chunk_count - 1:
+            return self.info["size"] - index * self.info["chunk_size"]
+        return self.info["chunk_size"]
+
+    def chunk_path(self, index):
+        return self.path / f"{index:08d}.chunk"
+
+    def received(self):
+        """Indexes of chunks that are completely stored"""
+        return sorted(int(p.stem) for p in self.path.glob("*.chunk"))
+
+    def missing(self):
+        """Indexes of chunks not stored yet"""
+        received = self.received()
+        if len(received) >= self.chunk_count:
+            return []
+        missing, expected = [], 0
+        for index in received + [self.chunk_count]:
+            missing.extend(range(expected, index))
+            expected = index + 1
+        return missing
+
+    def touch(self):
+        self.info["updated"] = time.time()
+        save_json(self.path / "session.json", self.info)
+
+    def summary(self):
+        return {
+            "session_id": self.id,
+            "size": self.info["size"],
+            "chunk_size": self.info["chunk_size"],
+            "chunk_count": self.chunk_count,
+            "received": self.received(),
+        }
+
+
+class UploadSessions:
+    """Upload sessions stored on disk so they survive server restarts"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def create(self, content_type, metadata, size, chunk_size, sha256=None):
+        """
+        Start a session, or return the open session for the same hash, size and
+        chunk size so an interrupted client can pick up where it stopped
+        """
+        self.expire()
+        if sha256:
+            for session in self._all():
+                info = session.info
+                if (info.get("sha256") == sha256 and info["size"] == size
+                        and info["chunk_size"] == chunk_size):
+                    session.info.update(type=content_type, metadata=metadata)
+                    session.touch()
+                    return session
+
+        session_id = uuid.uuid4().hex
+        path = self.root / session_id
+        path.mkdir()
+        session = UploadSession(path, {
+            "id": session_id,
+            "type": content_type,
+            "metadata": metadata,
+            "size": size,
+            "chunk_size": chunk_size,
+            "sha256": sha256,
+        })
+        session.touch()
+        return session
+
+    def get(self, session_id):
+        # Session ids are generated hex strings; reject anything else before touching the filesystem
+        if not session_id.isalnum():
+            return None
+        info = load_json(self.root / session_id / "session.json", None)
+        if info is None:
+            return None
+        return UploadSession(self.root / session_id, info)
+
+    def delete(self, session):
+        shutil.rmtree(session.path, ignore_errors=True)
+
+    def expire(self):
+        cutoff = time.time() - SESSION_TTL
+        for session in self._all():
+            if session.info.get("updated", 0) < cutoff:
+                self.delete(session)
+
+    def _all(self):
+        for path in self.root.iterdir():
+            session = self.get(path.name)
+            if session is not None:
+                yield session
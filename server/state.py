@@ -0,0 +1,604 @@
+"""
+EasyCopy Server - State backends
+Where the current entry and history of every channel live. The memory
+backend serves a single process; SQLite (a file in the data dir, the
+default) is shared by all workers on one host, and Redis by workers on
+several hosts behind a load balancer (they also need a shared data dir for
+the blobs). Blob reference counts are kept with the state, so a blob is
+only deleted once no history entry of any channel, in any worker, uses it.
+Deleting a blob and claiming an existing blob for a new entry exclude each
+other across workers (the SQLite write lock, a Redis lock), and a claim
+restarts the blob's grace period, so an upload that found its content
+already stored never ends up referencing a deleted blob.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from history import ClipboardHistory, entry_epoch
+
+try:
+    import redis
+except ImportError:  # Only needed for the redis backend
+    redis = None
+
+BACKENDS = ("sqlite", "memory", "redis")
+
+# Seconds an unreferenced blob is kept before it may be deleted, so an upload
+# that found the blob already stored can still reference it
+GARBAGE_GRACE = 60
+# Seconds to wait for another worker holding a channel's or the blobs' lock (redis)
+LOCK_TIMEOUT = 30
+
+
+class StateBackend:
+    """
+    Interface of the state backends
+    set() is atomic per channel; every other method only reads. Entries are
+    the dicts built by main._new_entry; history entries also carry an "id".
+    """
+
+    # True if several worker processes can use the backend at the same time
+    shared = False
+
+    def get(self, channel):
+        """Current entry of channel, or None if it was never set"""
+        raise NotImplementedError
+
+    def set(self, channel, entry, delete):
+        """
+        Make entry the current content of channel (and the newest history
+        entry unless it is a clear)
+        Calls delete(digest) for blobs unreferenced for longer than
+        GARBAGE_GRACE, excluding claim(). Returns (entry, version)
+        """
+        raise NotImplementedError
+
+    def claim(self, digest, stored):
+        """
+        Guard a new reference to a blob that may already be stored
+        Calls stored() - True if the blob is on disk - excluding blob
+        deletion, and restarts the grace period of a stored unreferenced blob.
+        Returns what stored() returned
+        """
+        raise NotImplementedError
+
+    def collect(self, digest, stale, delete):
+        """Call delete(digest) if no entry uses the blob and stale() is true, excluding claim()"""
+        raise NotImplementedError
+
+    def history_page(self, channel, before=None, limit=50):
+        """(entries newest first with ids below before, next_before or None)"""
+        raise NotImplementedError
+
+    def history_get(self, channel, entry_id):
+        raise NotImplementedError
+
+    def history_stats(self, channel):
+        """(number of entries, raw bytes of their distinct payloads)"""
+        raise NotImplementedError
+
+    def channels(self):
+        """Names of all channels that have state"""
+        raise NotImplementedError
+
+    def total_bytes(self):
+        """Raw bytes kept by the histories of all channels"""
+        raise NotImplementedError
+
+    def is_referenced(self, digest):
+        """True if any history entry uses the blob"""
+        raise NotImplementedError
+
+    def version(self):
+        """Version of the latest change (increases with every set())"""
+        raise NotImplementedError
+
+    def changes(self, since):
+        """([(channel, entry)] changed after version since, latest version)"""
+        raise NotImplementedError
+
+
+class MemoryBackend(StateBackend):
+    """Plain dicts - for a single worker; state is lost on restart"""
+
+    def __init__(self, max_entries=100, max_bytes=1024 ** 3, max_age=0):
+        self._limits = {"max_entries": max_entries, "max_bytes": max_bytes, "max_age": max_age}
+        self._clipboards = {}  # channel -> (entry, version)
+        self._histories = {}  # channel -> ClipboardHistory
+        self._channel_locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()  # Guards everything shared between channels
+        self._refs = Counter()  # digest -> number of channel histories using it
+        self._garbage = {}  # digest -> time it became unreferenced
+        self._version = 0
+        self._next_id = 1
+
+    def get(self, channel):
+        state = self._clipboards.get(channel)
+        return state[0] if state else None
+
+    def set(self, channel, entry, delete):
+        with self._channel_locks[channel]:
+            released = []
+            if entry["type"] is not None:
+                history = self._histories.get(channel)
+                if history is None:
+                    history = self._histories[channel] = ClipboardHistory(**self._limits)
+                with self._lock:
+                    entry = dict(entry, id=self._next_id)
+                    self._next_id += 1
+                    if entry["sha256"] not in history:
+                        self._refs[entry["sha256"]] += 1
+                    self._garbage.pop(entry["sha256"], None)
+                released = history.add(entry)
+            with self._lock:
+                now = time.time()
+                for digest in released:
+                    self._refs[digest] -= 1
+                    if self._refs[digest] <= 0:
+                        del self._refs[digest]
+                        self._garbage[digest] = now
+                self._version += 1
+                self._clipboards[channel] = (entry, self._version)
+                self._collect_garbage(now, delete)
+                return entry, self._version
+
+    def _collect_garbage(self, now, delete):
+        deletable = [digest for digest, since in self._garbage.items()
+                     if since < now - GARBAGE_GRACE and digest not in self._refs]
+        for digest in deletable:
+            delete(digest)
+            del self._garbage[digest]
+
+    def claim(self, digest, stored):
+        with self._lock:
+            if digest in self._garbage:
+                self._garbage[digest] = time.time()
+            return stored()
+
+    def collect(self, digest, stale, delete):
+        with self._lock:
+            if digest not in self._refs and stale():
+                delete(digest)
+                self._garbage.pop(digest, None)
+
+    def history_page(self, channel, before=None, limit=50):
+        history = self._histories.get(channel)
+        return history.page(before, limit) if history else ([], None)
+
+    def history_get(self, channel, entry_id):
+        history = self._histories.get(channel)
+        return history.get(entry_id) if history else None
+
+    def history_stats(self, channel):
+        history = self._histories.get(channel)
+        return (len(history), history.total_bytes) if history else (0, 0)
+
+    def channels(self):
+        return sorted(set(self._clipboards) | set(self._histories))
+
+    def total_bytes(self):
+        return sum(history.total_bytes for history in list(self._histories.values()))
+
+    def is_referenced(self, digest):
+        return digest in self._refs
+
+    def version(self):
+        return self._version
+
+    def changes(self, since):
+        changed = [(channel, entry) for channel, (entry, version) in list(self._clipboards.items())
+                   if version > since]
+        return changed, self._version
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clipboard (
+    channel TEXT PRIMARY KEY,
+    entry TEXT NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS clipboard_version ON clipboard (version);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    type TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_channel ON history (channel, id);
+CREATE INDEX IF NOT EXISTS history_content ON history (channel, sha256, type);
+CREATE INDEX IF NOT EXISTS history_sha256 ON history (sha256);
+CREATE TABLE IF NOT EXISTS channel_stats (
+    channel TEXT PRIMARY KEY,
+    entries INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS garbage (
+    sha256 TEXT PRIMARY KEY,
+    since REAL NOT NULL
+);
+"""
+
+
+class SQLiteBackend(StateBackend):
+    """
+    State in one SQLite database (WAL mode) shared by all workers on a host
+    Each set() is a single write transaction; every lookup uses an index.
+    Blobs are deleted and claimed inside write transactions, which SQLite
+    serializes across processes
+    """
+
+    shared = True
+
+    def __init__(self, path, max_entries=100, max_bytes=1024 ** 3, max_age=0):
+        self.path = str(path)
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._local = threading.local()
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(SQLITE_SCHEMA)
+
+    def _db(self):
+        """This thread's connection (sqlite3 connections are not shared between threads)"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, channel):
+        row = self._db().execute("SELECT entry FROM clipboard WHERE channel = ?", (channel,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction on this thread's connection (holds the database's write lock)"""
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def set(self, channel, entry, delete):
+        with self._transaction() as db:
+            now = time.time()
+            released = []
+            if entry["type"] is not None:
+                entry = self._add_history(db, channel, entry, released)
+                db.execute("DELETE FROM garbage WHERE sha256 = ?", (entry["sha256"],))
+            db.executemany("INSERT OR REPLACE INTO garbage (sha256, since) VALUES (?, ?)",
+                           [(digest, now) for digest in released])
+            version = db.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM clipboard").fetchone()[0]
+            db.execute("INSERT OR REPLACE INTO clipboard (channel, entry, version) VALUES (?, ?, ?)",
+                       (channel, json.dumps(entry), version))
+            self._collect_garbage(db, now, delete)
+        return entry, version
+
+    def _add_history(self, db, channel, entry, released):
+        digest = entry["sha256"]
+        previous = db.execute("SELECT id FROM history WHERE channel = ? AND sha256 = ? AND type = ?",
+                              (channel, digest, entry["type"])).fetchone()
+        new_blob = not self._channel_uses(db, channel, digest)
+        cursor = db.execute(
+            "INSERT INTO history (channel, type, sha256, size, created, entry) VALUES (?, ?, ?, ?, ?, ?)",
+            (channel, entry["type"], digest, entry["size"], entry_epoch(entry), json.dumps(entry)))
+        entry = dict(entry, id=cursor.lastrowid)
+        db.execute("INSERT INTO channel_stats (channel, entries, bytes) VALUES (?, 1, ?) "
+                   "ON CONFLICT (channel) DO UPDATE SET entries = entries + 1, bytes = bytes + excluded.bytes",
+                   (channel, entry["size"] if new_blob else 0))
+        # Same content again: the older copy is superseded by the new one
+        if previous is not None:
+            self._remove(db, channel, previous[0], released)
+        self._evict(db, channel, released)
+        return entry
+
+    def _channel_uses(self, db, channel, digest):
+        return db.execute("SELECT 1 FROM history WHERE channel = ? AND sha256 = ? LIMIT 1",
+                          (channel, digest)).fetchone() is not None
+
+    def _remove(self, db, channel, entry_id, released):
+        digest, size = db.execute("SELECT sha256, size FROM history WHERE id = ?", (entry_id,)).fetchone()
+        db.execute("DELETE FROM history WHERE id = ?", (entry_id,))
+        freed = 0 if self._channel_uses(db, channel, digest) else size
+        db.execute("UPDATE channel_stats SET entries = entries - 1, bytes = bytes - ? WHERE channel = ?",
+                   (freed, channel))
+        if not self.is_referenced(digest, db):
+            released.append(digest)
+
+    def _evict(self, db, channel, released):
+        cutoff = time.time() - self.max_age if self.max_age else None
+        while True:
+            entries, total = db.execute("SELECT entries, bytes FROM channel_stats WHERE channel = ?",
+                                        (channel,)).fetchone()
+            if entries <= 1:
+                return
+            oldest_id, created = db.execute(
+                "SELECT id, created FROM history WHERE channel = ? ORDER BY id LIMIT 1", (channel,)).fetchone()
+            if not (entries > self.max_entries or total > self.max_bytes
+                    or (cutoff is not None and created < cutoff)):
+                return
+            self._remove(db, channel, oldest_id, released)
+
+    def _collect_garbage(self, db, now, delete):
+        # Inside set()'s transaction: no other worker can reference or claim the blobs meanwhile
+        rows = db.execute("SELECT sha256 FROM garbage WHERE since < ?", (now - GARBAGE_GRACE,)).fetchall()
+        for (digest,) in rows:
+            if not self.is_referenced(digest, db):
+                delete(digest)
+        db.executemany("DELETE FROM garbage WHERE sha256 = ?", rows)
+
+    def claim(self, digest, stored):
+        with self._transaction() as db:
+            db.execute("UPDATE garbage SET since = ? WHERE sha256 = ?", (time.time(), digest))
+            return stored()
+
+    def collect(self, digest, stale, delete):
+        with self._transaction() as db:
+            if not self.is_referenced(digest, db) and stale():
+                delete(digest)
+                db.execute("DELETE FROM garbage WHERE sha256 = ?", (digest,))
+
+    def history_page(self, channel, before=None, limit=50):
+        db = self._db()
+        cutoff = time.time() - self.max_age if self.max_age else 0
+        newest = db.execute("SELECT MAX(id) FROM history WHERE channel = ?", (channel,)).fetchone()[0]
+        rows = db.execute(
+            "SELECT id, entry FROM history WHERE channel = ? AND id < ? AND (created >= ? OR id = ?) "
+            "ORDER BY id DESC LIMIT ?",
+            (channel, before if before is not None else (newest or 0) + 1, cutoff, newest, limit + 1)).fetchall()
+        page = [dict(json.loads(entry), id=entry_id) for entry_id, entry in rows[:limit]]
+        return page, (page[-1]["id"] if len(rows) > limit else None)
+
+    def history_get(self, channel, entry_id):
+        row = self._db().execute("SELECT entry FROM history WHERE channel = ? AND id = ?",
+                                 (channel, entry_id)).fetchone()
+        return dict(json.loads(row[0]), id=entry_id) if row else None
+
+    def history_stats(self, channel):
+        row = self._db().execute("SELECT entries, bytes FROM channel_stats WHERE channel = ?",
+                                 (channel,)).fetchone()
+        return tuple(row) if row else (0, 0)
+
+    def channels(self):
+        rows = self._db().execute("SELECT channel FROM clipboard UNION SELECT channel FROM channel_stats")
+        return sorted(channel for (channel,) in rows)
+
+    def total_bytes(self):
+        return self._db().execute("SELECT COALESCE(SUM(bytes), 0) FROM channel_stats").fetchone()[0]
+
+    def is_referenced(self, digest, db=None):
+        db = db or self._db()
+        return db.execute("SELECT 1 FROM history WHERE sha256 = ? LIMIT 1", (digest,)).fetchone() is not None
+
+    def version(self):
+        return self._db().execute("SELECT COALESCE(MAX(version), 0) FROM clipboard").fetchone()[0]
+
+    def changes(self, since):
+        rows = self._db().execute("SELECT channel, entry, version FROM clipboard WHERE version > ? "
+                                  "ORDER BY version", (since,)).fetchall()
+        if not rows:
+            return [], since
+        return [(channel, json.loads(entry)) for channel, entry, _ in rows], rows[-1][2]
+
+
+# Numbers and stores a channel's new entry in one step:
+# KEYS version, clipboard, versions, channels, garbage; ARGV channel, entry, now, released digests...
+PUBLISH_SCRIPT = """
+local version = redis.call("INCR", KEYS[1])
+redis.call("HSET", KEYS[2], ARGV[1], ARGV[2])
+redis.call("ZADD", KEYS[3], version, ARGV[1])
+redis.call("SADD", KEYS[4], ARGV[1])
+for i = 4, #ARGV do
+    redis.call("ZADD", KEYS[5], ARGV[3], ARGV[i])
+end
+return version
+"""
+
+
+class RedisBackend(StateBackend):
+    """
+    State in Redis, shared by workers on any number of hosts
+    set() holds a per-channel Redis lock; blob reference counts are global
+    counters updated atomically. Deleting and claiming blobs hold one global
+    lock, and deletion re-checks the counts and garbage marks under it
+    """
+
+    shared = True
+
+    def __init__(self, url, max_entries=100, max_bytes=1024 ** 3, max_age=0, prefix="easycopy"):
+        if redis is None:
+            raise RuntimeError("The redis state backend needs the redis package (pip install redis)")
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._publish = self.redis.register_script(PUBLISH_SCRIPT)
+
+    def _key(self, *parts):
+        return ":".join((self.prefix,) + parts)
+
+    def get(self, channel):
+        raw = self.redis.hget(self._key("clipboard"), channel)
+        return json.loads(raw) if raw else None
+
+    def _lock(self, *name):
+        return self.redis.lock(self._key("lock", *name), timeout=LOCK_TIMEOUT, blocking_timeout=LOCK_TIMEOUT)
+
+    def set(self, channel, entry, delete):
+        r = self.redis
+        with self._lock(channel):
+            released = []
+            if entry["type"] is not None:
+                entry = self._add_history(channel, entry, released)
+            now = time.time()
+            # The version is allocated together with the entry it numbers, so
+            # versions commit in order and changes() never skips one
+            version = self._publish(keys=[self._key("version"), self._key("clipboard"), self._key("versions"),
+                                          self._key("channels"), self._key("garbage")],
+                                    args=[channel, json.dumps(entry), now, *released], client=r)
+            self._collect_garbage(now, delete)
+            return entry, version
+
+    def _add_history(self, channel, entry, released):
+        r = self.redis
+        digest = entry["sha256"]
+        entry = dict(entry, id=r.incr(self._key("entry_id")))
+        content_key = f"{entry['type']}:{digest}"
+        previous = r.hget(self._key("content", channel), content_key)
+        new_blob = r.hincrby(self._key("channel_refs", channel), digest, 1) == 1
+
+        pipe = r.pipeline()
+        pipe.hset(self._key("entries", channel), entry["id"], json.dumps(entry))
+        pipe.zadd(self._key("history", channel), {entry["id"]: entry["id"]})
+        pipe.hset(self._key("content", channel), content_key, entry["id"])
+        pipe.hincrby(self._key("stats", channel), "entries", 1)
+        if new_blob:
+            pipe.hincrby(self._key("stats", channel), "bytes", entry["size"])
+        pipe.hincrby(self._key("refs"), digest, 1)
+        pipe.zrem(self._key("garbage"), digest)
+        pipe.execute()
+
+        # Same content again: the older copy is superseded by the new one
+        if previous is not None:
+            self._remove(channel, int(previous), released)
+        self._evict(channel, released)
+        return entry
+
+    def _remove(self, channel, entry_id, released):
+        r = self.redis
+        raw = r.hget(self._key("entries", channel), entry_id)
+        if raw is None:
+            return
+        entry = json.loads(raw)
+        digest = entry["sha256"]
+        pipe = r.pipeline()
+        pipe.hdel(self._key("entries", channel), entry_id)
+        pipe.zrem(self._key("history", channel), entry_id)
+        pipe.hincrby(self._key("stats", channel), "entries", -1)
+        pipe.execute()
+        content_key = f"{entry['type']}:{digest}"
+        if r.hget(self._key("content", channel), content_key) == str(entry_id):
+            r.hdel(self._key("content", channel), content_key)
+        if r.hincrby(self._key("channel_refs", channel), digest, -1) <= 0:
+            r.hdel(self._key("channel_refs", channel), digest)
+            r.hincrby(self._key("stats", channel), "bytes", -entry["size"])
+        if r.hincrby(self._key("refs"), digest, -1) <= 0:
+            released.append(digest)
+
+    def _evict(self, channel, released):
+        r = self.redis
+        cutoff = time.time() - self.max_age if self.max_age else None
+        while True:
+            entries, total = self.history_stats(channel)
+            if entries <= 1:
+                return
+            oldest_id = int(r.zrange(self._key("history", channel), 0, 0)[0])
+            oldest = json.loads(r.hget(self._key("entries", channel), oldest_id))
+            if not (entries > self.max_entries or total > self.max_bytes
+                    or (cutoff is not None and entry_epoch(oldest) < cutoff)):
+                return
+            self._remove(channel, oldest_id, released)
+
+    def _collect_garbage(self, now, delete):
+        r = self.redis
+        cutoff = now - GARBAGE_GRACE
+        candidates = r.zrangebyscore(self._key("garbage"), "-inf", cutoff)
+        if not candidates:
+            return
+        # Channel locks do not exclude other channels' set() or claim(): check again under the blobs' lock
+        with self._lock("blobs"):
+            for digest in candidates:
+                since = r.zscore(self._key("garbage"), digest)
+                if since is None or since >= cutoff:
+                    continue  # Collected by another worker, or claimed since
+                if not self.is_referenced(digest):
+                    delete(digest)
+                    r.hdel(self._key("refs"), digest)
+                r.zrem(self._key("garbage"), digest)
+
+    def claim(self, digest, stored):
+        with self._lock("blobs"):
+            self.redis.zadd(self._key("garbage"), {digest: time.time()}, xx=True)
+            return stored()
+
+    def collect(self, digest, stale, delete):
+        with self._lock("blobs"):
+            if not self.is_referenced(digest) and stale():
+                delete(digest)
+                self.redis.zrem(self._key("garbage"), digest)
+
+    def history_page(self, channel, before=None, limit=50):
+        r = self.redis
+        newest = r.zrange(self._key("history", channel), -1, -1)
+        newest = int(newest[0]) if newest else None
+        upper = f"({before}" if before is not None else "+inf"
+        ids = r.zrevrangebyscore(self._key("history", channel), upper, "-inf", start=0, num=limit + 1)
+        raw_entries = r.hmget(self._key("entries", channel), ids[:limit]) if ids else []
+        cutoff = time.time() - self.max_age if self.max_age else None
+        page = []
+        for raw in raw_entries:
+            if raw is None:
+                continue
+            entry = json.loads(raw)
+            if cutoff is not None and entry["id"] != newest and entry_epoch(entry) < cutoff:
+                continue
+            page.append(entry)
+        return page, (int(ids[limit - 1]) if len(ids) > limit else None)
+
+    def history_get(self, channel, entry_id):
+        raw = self.redis.hget(self._key("entries", channel), entry_id)
+        return json.loads(raw) if raw else None
+
+    def history_stats(self, channel):
+        entries, total = self.redis.hmget(self._key("stats", channel), "entries", "bytes")
+        return int(entries or 0), int(total or 0)
+
+    def channels(self):
+        return sorted(self.redis.smembers(self._key("channels")))
+
+    def total_bytes(self):
+        pipe = self.redis.pipeline()
+        for channel in self.channels():
+            pipe.hget(self._key("stats", channel), "bytes")
+        return sum(int(value or 0) for value in pipe.execute())
+
+    def is_referenced(self, digest):
+        return int(self.redis.hget(self._key("refs"), digest) or 0) > 0
+
+    def version(self):
+        return int(self.redis.get(self._key("version")) or 0)
+
+    def changes(self, since):
+        changed = self.redis.zrangebyscore(self._key("versions"), f"({since}", "+inf", withscores=True)
+        if not changed:
+            return [], since
+        names = [name for name, _ in changed]
+        entries = self.redis.hmget(self._key("clipboard"), names)
+        return ([(name, json.loads(raw)) for name, raw in zip(names, entries) if raw],
+                int(max(score for _, score in changed)))
+
+
+def open_backend(kind, data_dir, redis_url=None, **history_limits):
+    """Create the state backend named kind (one of BACKENDS)"""
+    if kind == "memory":
+        return MemoryBackend(**history_limits)
+    if kind == "sqlite":
+        data_dir.mkdir(parents=True, exist_ok=True)
+        return SQLiteBackend(data_dir / "state.db", **history_limits)
+    if kind == "redis":
+        return RedisBackend(redis_url, **history_limits)
+    raise ValueError(f"Unknown state backend {kind!r} (choose from {', '.join(BACKENDS)})")
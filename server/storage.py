@@ -0,0 +1,296 @@
+"""
+EasyCopy Server - Disk-backed blob storage
+Payloads are kept on disk, content-addressed by the SHA-256 of their raw
+bytes, so the server never holds a whole clipboard payload in memory.
+Compressible payloads are stored compressed (<digest>.gz / <digest>.zst)
+next to a small <digest>.meta file recording the raw size; a decoded copy
+(<digest>.raw) is made on demand for range requests of clients that cannot
+accept the stored encoding.
+"""
+
+import hashlib
+import json
+import os
+import re
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from content_encoding import AT_REST_ENCODING, MIN_COMPRESS_SIZE, compressor, decompress_stream
+
+
+DIGEST_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+# File suffix of a blob stored with each Content-Encoding (None = raw bytes)
+BLOB_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+# Bytes inspected before deciding whether compressing a blob is worth it
+COMPRESSION_SAMPLE_SIZE = 256 * 1024
+# Keep the raw bytes unless the sample compresses to at most this fraction
+MAX_COMPRESSION_RATIO = 0.9
+
+
+def is_digest(value):
+    """True for a lowercase hex SHA-256 digest (safe to use as a blob path)"""
+    return isinstance(value, str) and DIGEST_PATTERN.fullmatch(value) is not None
+
+
+class BlobWriter:
+    """
+    Incremental writer for a new blob
+    Hashes and counts the raw bytes as they are written; commit() moves the
+    temp file to its content-addressed location. With compress=True the first
+    COMPRESSION_SAMPLE_SIZE bytes decide whether the blob is stored compressed.
+    """
+
+    def __init__(self, store, compress=False):
+        self.store = store
+        self.tmp_path = store.tmp_dir / f"{uuid.uuid4().hex}.part"
+        self._file = open(self.tmp_path, "wb")
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.stored_size = 0
+        self.encoding = None
+        self._compressor = None
+        self._sample = bytearray() if compress else None
+
+    def write(self, chunk):
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        if self._sample is not None:
+            self._sample += chunk
+            if len(self._sample) >= COMPRESSION_SAMPLE_SIZE:
+                self._choose_encoding()
+            return
+        self._write_stored(chunk)
+
+    def _choose_encoding(self):
+        sample, self._sample = bytes(self._sample), None
+        if len(sample) >= MIN_COMPRESS_SIZE:
+            trial = compressor(AT_REST_ENCODING)
+            compressed = len(trial.compress(sample)) + len(trial.flush())
+            if compressed <= len(sample) * MAX_COMPRESSION_RATIO:
+                self.encoding = AT_REST_ENCODING
+                self._compressor = compressor(AT_REST_ENCODING)
+        self._write_stored(sample)
+
+    def _write_stored(self, chunk):
+        if self._compressor is not None:
+            chunk = self._compressor.compress(chunk)
+        self._file.write(chunk)
+        self.stored_size += len(chunk)
+
+    def hexdigest(self):
+        """SHA-256 of the bytes written so far"""
+        return self._hash.hexdigest()
+
+    def commit(self):
+        """Finish the blob and return its hex digest"""
+        if self._sample is not None:
+            self._choose_encoding()
+        if self._compressor is not None:
+            tail = self._compressor.flush()
+            self._file.write(tail)
+            self.stored_size += len(tail)
+        self._file.close()
+        digest = self.hexdigest()
+        if self.store.claim(digest):
+            # Same content already stored - keep the existing copy
+            self.tmp_path.unlink(missing_ok=True)
+            return digest
+        target = self.store.blob_path(digest, self.encoding)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if self.encoding is not None:
+            save_json(self.store.meta_path(digest), {"size": self.size, "encoding": self.encoding})
+        os.replace(self.tmp_path, target)
+        return digest
+
+    def abort(self):
+        self._file.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+
+
+class BlobStore:
+    """
+    Content-addressed blobs under <root>/blobs/<aa>/<digest>[.gz|.zst]
+    references is the state backend that counts the uses of each blob and
+    collects unused ones (see state.py)
+    """
+
+    def __init__(self, root, references=None):
+        self.root = Path(root)
+        self.references = references
+        self.blob_dir = self.root / "blobs"
+        self.tmp_dir = self.root / "tmp"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        # Leftovers from uploads interrupted by a restart
+        for leftover in self.tmp_dir.glob("*.part"):
+            leftover.unlink(missing_ok=True)
+
+    def blob_path(self, digest, encoding=None):
+        return self.blob_dir / digest[:2] / (digest + BLOB_SUFFIXES[encoding])
+
+    def meta_path(self, digest):
+        return self.blob_dir / digest[:2] / f"{digest}.meta"
+
+    def decoded_path(self, digest):
+        """Cached decoded copy of a compressed blob (see decoded_copy)"""
+        return self.blob_dir / digest[:2] / f"{digest}.raw"
+
+    def signature_path(self, digest, block_size):
+        """Cached delta signature of a blob (see delta.py)"""
+        return self.blob_dir / digest[:2] / f"{digest}.{block_size}.sig"
+
+    def find(self, digest):
+        """Return (path, encoding) of a stored blob, or None"""
+        if not is_digest(digest):
+            return None
+        for encoding in BLOB_SUFFIXES:
+            path = self.blob_path(digest, encoding)
+            if path.is_file():
+                return path, encoding
+        return None
+
+    def exists(self, digest):
+        return self.find(digest) is not None
+
+    def claim(self, digest):
+        """
+        True if the blob is stored and will be kept for a new reference to it
+        Call before recording an entry for content found already stored
+        """
+        def stored():
+            found = self.find(digest)
+            if found is None:
+                return False
+            os.utime(found[0])  # Young blobs are spared by the startup sweep
+            return True
+
+        if self.references is None:
+            return stored()
+        return self.references.claim(digest, stored)
+
+    def size(self, digest):
+        """Raw (decoded) size of a blob"""
+        path, encoding = self.find(digest)
+        if encoding is None:
+            return path.stat().st_size
+        return load_json(self.meta_path(digest), {})["size"]
+
+    def writer(self, compress=False):
+        return BlobWriter(self, compress=compress)
+
+    def put_bytes(self, data, compress=False):
+        """Store an in-memory payload and return (digest, size)"""
+        with self.writer(compress=compress) as w:
+            w.write(data)
+            return w.commit(), w.size
+
+    def iter_stored(self, digest, chunk_size=1024 * 1024):
+        """Yield the blob as stored on disk (possibly compressed)"""
+        path, _ = self.find(digest)
+        with open(path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+    def iter_chunks(self, digest, chunk_size=1024 * 1024):
+        """Yield the raw (decoded) bytes of a blob in chunks of chunk_size (the last may be shorter)"""
+        _, encoding = self.find(digest)
+        if encoding is None:
+            yield from self.iter_stored(digest, chunk_size)
+            return
+        pending = bytearray()
+        for data in decompress_stream(self.iter_stored(digest, chunk_size), encoding):
+            pending += data
+            while len(pending) >= chunk_size:
+                yield bytes(pending[:chunk_size])
+                del pending[:chunk_size]
+        if pending:
+            yield bytes(pending)
+
+    def read_head(self, digest, size):
+        """Return up to size raw bytes from the start of a blob"""
+        head = bytearray()
+        for chunk in self.iter_chunks(digest, min(size, 1024 * 1024)):
+            head += chunk
+            if len(head) >= size:
+                break
+        return bytes(head[:size])
+
+    def digests(self):
+        """Digests of all stored blobs"""
+        for path in self.blob_dir.glob("*/*"):
+            digest = path.name.split(".")[0]
+            if path.suffix not in (".meta", ".sig", ".raw") and is_digest(digest):
+                yield digest
+
+    @contextmanager
+    def open_raw(self, digest):
+        """Seekable file of a blob's raw bytes (compressed blobs are decoded to a temp file first)"""
+        path, encoding = self.find(digest)
+        if encoding is None:
+            with open(path, "rb") as f:
+                yield f
+            return
+        tmp_path = self.tmp_dir / f"{uuid.uuid4().hex}.part"
+        try:
+            with open(tmp_path, "w+b") as f:
+                for chunk in decompress_stream(self.iter_stored(digest), encoding):
+                    f.write(chunk)
+                f.seek(0)
+                yield f
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def decoded_copy(self, digest):
+        """
+        Path of a file holding a blob's raw bytes: the blob itself, or for a
+        compressed blob a decoded copy kept next to it (created on first use)
+        """
+        path, encoding = self.find(digest)
+        if encoding is None:
+            return path
+        decoded = self.decoded_path(digest)
+        if not decoded.is_file():
+            tmp_path = self.tmp_dir / f"{uuid.uuid4().hex}.part"
+            try:
+                with open(tmp_path, "wb") as f:
+                    for chunk in decompress_stream(self.iter_stored(digest), encoding):
+                        f.write(chunk)
+                os.replace(tmp_path, decoded)
+            finally:
+                tmp_path.unlink(missing_ok=True)
+        return decoded
+
+    def delete(self, digest):
+        for encoding in BLOB_SUFFIXES:
+            self.blob_path(digest, encoding).unlink(missing_ok=True)
+        self.meta_path(digest).unlink(missing_ok=True)
+        self.decoded_path(digest).unlink(missing_ok=True)
+        for path in self.blob_path(digest).parent.glob(f"{digest}.*.sig"):
+            path.unlink(missing_ok=True)
+
+
+def load_json(path, default):
+    """Read a JSON state file, falling back to default if missing or corrupt"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def save_json(path, data):
+    """Atomically replace a JSON state file"""
+    tmp = Path(f"{path}.{uuid.uuid4().hex}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
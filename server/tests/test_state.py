@@ -0,0 +1,151 @@
+"""
+EasyCopy Server - State backend tests
+Blob garbage collection against claims of blobs found already stored, for
+every backend. The Redis backend runs against EASYCOPY_TEST_REDIS_URL (a
+database the tests may flush) or, without it, fakeredis
+"""
+
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import state  # noqa: E402
+from state import GARBAGE_GRACE, MemoryBackend, RedisBackend, SQLiteBackend  # noqa: E402
+
+TEST_REDIS_URL = os.environ.get("EASYCOPY_TEST_REDIS_URL")
+
+
+class Clock:
+    """Stands in for the time module in state.py"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+class Disk:
+    """The blobs a backend manages: digests on disk and the delete() callback"""
+
+    def __init__(self, *digests):
+        self.stored = set(digests)
+
+    def delete(self, digest):
+        self.stored.discard(digest)
+
+    def claim(self, backend, digest):
+        return backend.claim(digest, lambda: digest in self.stored)
+
+
+def entry(digest):
+    return {"type": "text", "sha256": digest, "size": 1, "metadata": {}, "timestamp": "2024-01-01T00:00:00"}
+
+
+def redis_backend():
+    if TEST_REDIS_URL:
+        backend = RedisBackend(TEST_REDIS_URL, max_entries=1, prefix=f"easycopy-test-{uuid.uuid4().hex}")
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")  # Redis locks are Lua scripts
+        backend = RedisBackend("redis://localhost", max_entries=1)
+        backend.redis = fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+    return backend
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(state, "time", Clock())
+    if request.param == "memory":
+        backend = MemoryBackend(max_entries=1)
+    elif request.param == "sqlite":
+        backend = SQLiteBackend(tmp_path / "state.db", max_entries=1)
+    else:
+        backend = redis_backend()
+    yield backend
+    if isinstance(backend, RedisBackend) and TEST_REDIS_URL:
+        keys = list(backend.redis.scan_iter(backend._key("*")))
+        if keys:
+            backend.redis.delete(*keys)
+
+
+def release(backend, disk, digest):
+    """Reference digest from one entry and replace it, leaving it unreferenced"""
+    backend.set("a", entry(digest), disk.delete)
+    backend.set("a", entry("f" * 64), disk.delete)
+    assert not backend.is_referenced(digest)
+
+
+def test_unreferenced_blob_is_deleted_after_grace(backend):
+    disk = Disk("0" * 64, "f" * 64)
+    release(backend, disk, "0" * 64)
+    backend.set("b", entry("f" * 64), disk.delete)
+    assert "0" * 64 in disk.stored
+
+    state.time.now += GARBAGE_GRACE + 1
+    backend.set("b", entry("f" * 64), disk.delete)
+    assert disk.stored == {"f" * 64}
+
+
+def test_claim_restarts_grace(backend):
+    disk = Disk("0" * 64, "f" * 64)
+    release(backend, disk, "0" * 64)
+
+    state.time.now += GARBAGE_GRACE + 1
+    assert disk.claim(backend, "0" * 64)
+    # Collection by another channel before the claimed blob is referenced
+    backend.set("b", entry("f" * 64), disk.delete)
+    assert "0" * 64 in disk.stored
+
+    backend.set("c", entry("0" * 64), disk.delete)
+    state.time.now += GARBAGE_GRACE + 1
+    backend.set("b", entry("f" * 64), disk.delete)
+    assert "0" * 64 in disk.stored
+    assert backend.is_referenced("0" * 64)
+
+
+def test_claimed_blob_never_referenced_is_still_collected(backend):
+    disk = Disk("0" * 64, "f" * 64)
+    release(backend, disk, "0" * 64)
+    state.time.now += GARBAGE_GRACE + 1
+    assert disk.claim(backend, "0" * 64)
+
+    state.time.now += GARBAGE_GRACE + 1
+    backend.set("b", entry("f" * 64), disk.delete)
+    assert "0" * 64 not in disk.stored
+
+
+def test_claim_of_deleted_blob_fails(backend):
+    disk = Disk("0" * 64, "f" * 64)
+    release(backend, disk, "0" * 64)
+    state.time.now += GARBAGE_GRACE + 1
+    backend.set("b", entry("f" * 64), disk.delete)
+
+    assert not disk.claim(backend, "0" * 64)
+
+
+def test_referenced_again_before_collection(backend):
+    disk = Disk("0" * 64, "f" * 64)
+    release(backend, disk, "0" * 64)
+    backend.set("b", entry("0" * 64), disk.delete)
+
+    state.time.now += GARBAGE_GRACE + 1
+    backend.set("a", entry("f" * 64), disk.delete)
+    assert "0" * 64 in disk.stored
+
+
+def test_collect_rechecks(backend):
+    disk = Disk("0" * 64, "1" * 64)
+    backend.set("a", entry("0" * 64), disk.delete)
+
+    backend.collect("0" * 64, lambda: True, disk.delete)
+    backend.collect("1" * 64, lambda: False, disk.delete)
+    assert disk.stored == {"0" * 64, "1" * 64}
+
+    backend.collect("1" * 64, lambda: True, disk.delete)
+    assert disk.stored == {"0" * 64}
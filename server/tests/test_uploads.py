@@ -0,0 +1,91 @@
+"""
+EasyCopy Server - Upload limit tests
+Bodies and declared sizes the server must refuse early: a compressed body
+that decodes past the upload limit, a delta declaring a result its base
+cannot produce, a chunk longer than the session's chunk size, and clients
+over their request rate
+"""
+
+import gzip
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from limits import TokenBuckets  # noqa: E402
+
+MAX_UPLOAD_BYTES = 1024 * 1024
+
+
+@pytest.fixture(scope="module")
+def main(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("EASYCOPY_DATA_DIR", str(tmp_path_factory.mktemp("data")))
+        patch.setenv("EASYCOPY_STATE_BACKEND", "memory")
+        patch.setenv("EASYCOPY_MAX_UPLOAD_BYTES", str(MAX_UPLOAD_BYTES))
+        patch.setenv("EASYCOPY_UPLOAD_RATE", "0")
+        import main
+        yield main
+    sys.modules.pop("main", None)
+
+
+@pytest.fixture
+def client(main):
+    return TestClient(main.app)
+
+
+def upload_raw(client, data):
+    response = client.put("/upload/raw", content=data, headers={"X-EasyCopy-Type": "text"})
+    assert response.status_code == 200
+    return response.json()["sha256"]
+
+
+def test_compressed_body_decoding_past_limit_is_refused(client):
+    bomb = gzip.compress(bytes(64 * MAX_UPLOAD_BYTES))
+    response = client.put("/upload/raw", content=bomb,
+                          headers={"X-EasyCopy-Type": "file", "Content-Encoding": "gzip"})
+    assert response.status_code == 413
+
+
+def test_zstd_body_decoding_past_limit_is_refused(client):
+    zstandard = pytest.importorskip("zstandard")
+    bomb = zstandard.ZstdCompressor().compress(bytes(64 * MAX_UPLOAD_BYTES))
+    response = client.put("/upload/raw", content=bomb,
+                          headers={"X-EasyCopy-Type": "file", "Content-Encoding": "zstd"})
+    assert response.status_code == 413
+
+
+def test_delta_declaring_oversized_result_is_refused(client, main):
+    base = os.urandom(main.MIN_BLOCK_SIZE)
+    response = client.put("/upload/delta", content=b"\0" * 16, headers={
+        "X-EasyCopy-Base-SHA256": upload_raw(client, base),
+        "X-EasyCopy-Block-Size": str(main.MIN_BLOCK_SIZE),
+        "X-EasyCopy-SHA256": hashlib.sha256(b"").hexdigest(),
+        "X-EasyCopy-Size": str(1024 * len(base)),
+    })
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("X-EasyCopy-Size")
+
+
+def test_chunk_longer_than_expected_is_refused(client, main):
+    chunk_size = main.MIN_CHUNK_SIZE
+    session = client.post("/upload/sessions", json={"type": "file", "size": 3 * chunk_size,
+                                                    "chunk_size": chunk_size}).json()
+    url = f"/upload/sessions/{session['session_id']}"
+    response = client.put(f"{url}/chunks/0", content=bytes(chunk_size + 1))
+    assert response.status_code == 400
+    assert client.get(url).json()["received"] == []
+
+
+def test_client_over_its_rate_gets_retry_after(client, main, monkeypatch):
+    monkeypatch.setattr(main.upload_limits, "buckets", TokenBuckets(0.5, 1))
+    assert client.post("/upload", json={"type": "text", "content": "first"}).status_code == 200
+    response = client.post("/upload", json={"type": "text", "content": "second"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
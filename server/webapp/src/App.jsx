@@ -1,9 +1,15 @@
 
 
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import './App.css'
 
-const AUTO_REFRESH_INTERVAL = 5000 // 5 seconds
+// Named channel from ?channel=name; without it the server's default channel is used
+const channel = new URLSearchParams(window.location.search).get('channel')
+
+// Widest image preview requested from the server (in device pixels)
+const PREVIEW_MAX_WIDTH = 1600
+
+const api = (path) => (channel ? `/c/${encodeURIComponent(channel)}${path}` : path)
 
 function App() {
   const [clipboardData, setClipboardData] = useState(null)
@@ -11,21 +17,25 @@ function App() {
   const [error, setError] = useState(null)
   const [autoRefresh, setAutoRefresh] = useState(true)
   const [textExpanded, setTextExpanded] = useState(false)
+  const [fullText, setFullText] = useState(null)
   const [lastUpdated, setLastUpdated] = useState(null)
   const [uploadText, setUploadText] = useState('')
   const [uploading, setUploading] = useState(false)
   const [showUploadPanel, setShowUploadPanel] = useState(false)
+  const lastHash = useRef(null)
 
-  // ...existing logic for fetchClipboardStatus, copyToClipboard, downloadFile, downloadImage, uploadTextContent, uploadFile, handleFileSelect, formatTimestamp, formatFileSize, getTruncatedText, useEffect for autoRefresh...
+  // ...existing logic for fetchClipboardStatus, copyToClipboard, downloadFile, downloadImage, uploadTextContent, uploadFile, handleFileSelect, formatTimestamp, formatFileSize, getDisplayedText, useEffect for autoRefresh...
 
   // Re-insert the main renderContent and return JSX from previous correct version
   const fetchClipboardStatus = async () => {
     try {
       setLoading(true)
       setError(null)
-      const response = await fetch('/status')
+      const response = await fetch(api('/status'))
       if (!response.ok) throw new Error('Failed to fetch clipboard status')
       const data = await response.json()
+      if ((data.sha256 || null) !== lastHash.current) setFullText(null)
+      lastHash.current = data.sha256 || null
       if (data.has_data) {
         setClipboardData(data)
         setLastUpdated(new Date())
@@ -50,9 +60,38 @@ function App() {
     }
   }
 
+  // /status only carries a preview; the full text is fetched on demand
+  const loadFullText = async () => {
+    if (fullText !== null) return fullText
+    const response = await fetch(api('/download/text'))
+    if (!response.ok) throw new Error('Failed to fetch text')
+    const text = await response.text()
+    setFullText(text)
+    return text
+  }
+
+  const toggleTextExpanded = async () => {
+    try {
+      if (!textExpanded) await loadFullText()
+      setTextExpanded(!textExpanded)
+    } catch (err) {
+      setError(err.message)
+      console.error('Error fetching text:', err)
+    }
+  }
+
+  const copyTextToClipboard = async () => {
+    try {
+      copyToClipboard(clipboardData.preview_truncated ? await loadFullText() : clipboardData.preview)
+    } catch (err) {
+      alert('Failed to copy to clipboard')
+      console.error('Copy error:', err)
+    }
+  }
+
   const downloadFile = async () => {
     try {
-      const response = await fetch('/download/file')
+      const response = await fetch(api('/download/file'))
       if (!response.ok) throw new Error('Download failed')
       const blob = await response.blob()
       const url = window.URL.createObjectURL(blob)
@@ -71,7 +110,7 @@ function App() {
 
   const downloadImage = async () => {
     try {
-      const response = await fetch('/download/image')
+      const response = await fetch(api('/download/image'))
       if (!response.ok) throw new Error('Download failed')
       const blob = await response.blob()
       const url = window.URL.createObjectURL(blob)
@@ -101,7 +140,7 @@ function App() {
         content: uploadText,
         metadata: { length: uploadText.length }
       }
-      const response = await fetch('/upload', {
+      const response = await fetch(api('/upload'), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(payload)
@@ -139,7 +178,7 @@ function App() {
               mime_type: file.type || 'application/octet-stream'
             }
           }
-          const response = await fetch('/upload', {
+          const response = await fetch(api('/upload'), {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(payload)
@@ -190,23 +229,26 @@ function App() {
     return `${(bytes / Math.pow(k, i)).toFixed(2)} ${sizes[i]}`
   }
 
-  const getTruncatedText = (text, maxLength = 300) => {
-    if (!text) return ''
-    if (text.length <= maxLength) return text
-    if (textExpanded) return text
-    return text.substring(0, maxLength) + '...'
+  const getDisplayedText = () => {
+    if (textExpanded && fullText !== null) return fullText
+    const preview = clipboardData.preview || ''
+    return clipboardData.preview_truncated ? preview + '...' : preview
   }
 
   useEffect(() => {
     fetchClipboardStatus()
   }, [])
 
+  // Live updates: the server pushes small change notifications over SSE,
+  // content is only fetched when the stored hash actually changes
   useEffect(() => {
     if (!autoRefresh) return
-    const interval = setInterval(() => {
-      fetchClipboardStatus()
-    }, AUTO_REFRESH_INTERVAL)
-    return () => clearInterval(interval)
+    const source = new EventSource(api('/events'))
+    source.addEventListener('change', (e) => {
+      const event = JSON.parse(e.data)
+      if ((event.sha256 || null) !== lastHash.current) fetchClipboardStatus()
+    })
+    return () => source.close()
   }, [autoRefresh])
 
   const renderContent = () => {
@@ -220,33 +262,35 @@ function App() {
     }
     switch (clipboardData.type) {
       case 'text':
-        const textContent = clipboardData.content || ''
-        const needsTruncation = textContent.length > 300
+        const needsTruncation = clipboardData.preview_truncated
         return (
           <div className="content-container">
             <div className="content-header">
               <h3>Text Content</h3>
               <div className="metadata">
-                <span>Length: {clipboardData.metadata.length || textContent.length} characters</span>
+                <span>Length: {clipboardData.metadata.length ? `${clipboardData.metadata.length} characters` : formatFileSize(clipboardData.size)}</span>
               </div>
             </div>
             <div className="text-content">
-              <pre>{getTruncatedText(textContent)}</pre>
+              <pre>{getDisplayedText()}</pre>
             </div>
             <div className="action-buttons">
               {needsTruncation && (
-                <button onClick={() => setTextExpanded(!textExpanded)} className="btn btn-secondary">
+                <button onClick={toggleTextExpanded} className="btn btn-secondary">
                   {textExpanded ? 'Show Less' : 'Show More'}
                 </button>
               )}
-              <button onClick={() => copyToClipboard(textContent)} className="btn btn-primary">
+              <button onClick={copyTextToClipboard} className="btn btn-primary">
                 Copy to Clipboard
               </button>
             </div>
           </div>
         )
       case 'image':
-        const imageUrl = '/download/image'
+        const imageUrl = api('/download/image')
+        // A screen-sized WebP rendered by the server instead of the full original
+        const previewWidth = Math.min(PREVIEW_MAX_WIDTH, Math.round(window.innerWidth * (window.devicePixelRatio || 1)))
+        const previewUrl = `${imageUrl}?width=${previewWidth}&format=webp&v=${clipboardData.sha256}`
         return (
           <div className="content-container">
             <div className="content-header">
@@ -260,7 +304,9 @@ function App() {
               </div>
             </div>
             <div className="image-content">
-              <img src={imageUrl} alt="Clipboard content" />
+              <a href={imageUrl} target="_blank" rel="noreferrer">
+                <img src={previewUrl} alt="Clipboard content" />
+              </a>
             </div>
             <div className="action-buttons">
               <button onClick={() => copyToClipboard(imageUrl)} className="btn btn-secondary">
@@ -294,6 +340,28 @@ function App() {
             </div>
           </div>
         )
+      case 'bundle':
+        return (
+          <div className="content-container">
+            <div className="content-header">
+              <h3>Bundle Content</h3>
+              <div className="metadata">
+                <span>Name: {clipboardData.metadata.name || 'bundle'}</span>
+                <span>Files: {clipboardData.metadata.files ?? 'Unknown'}</span>
+                <span>Size: {formatFileSize(clipboardData.metadata.size)}</span>
+              </div>
+            </div>
+            <div className="file-content">
+              <div className="file-icon">🗂️</div>
+              <p className="file-name">{clipboardData.metadata.name || 'bundle'}.tar</p>
+            </div>
+            <div className="action-buttons">
+              <a href={api('/download/bundle')} className="btn btn-primary" download>
+                Download Archive
+              </a>
+            </div>
+          </div>
+        )
       default:
         return <div className="empty-state">Unknown content type</div>
     }
@@ -314,7 +382,7 @@ function App() {
         </button>
         <label className="auto-refresh-toggle">
           <input type="checkbox" checked={autoRefresh} onChange={(e) => setAutoRefresh(e.target.checked)} />
-          <span>Auto-refresh (5s)</span>
+          <span>Live updates</span>
         </label>
         {lastUpdated && (
           <span className="last-updated">Last updated: {lastUpdated.toLocaleTimeString()}</span>
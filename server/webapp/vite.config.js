@@ -9,7 +9,10 @@ export default defineConfig({
       '/upload': 'http://localhost:8000',
       '/download': 'http://localhost:8000',
       '/status': 'http://localhost:8000',
+      '/events': 'http://localhost:8000',
       '/clear': 'http://localhost:8000',
+      '/history': 'http://localhost:8000',
+      '/c/': 'http://localhost:8000',
       '/health': 'http://localhost:8000'
     }
   }
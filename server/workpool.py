@@ -0,0 +1,55 @@
+"""
+EasyCopy Server - CPU work pool
+Hashing, compression, base64/JSON decoding and delta reconstruction of
+request bodies run in a bounded thread pool instead of on the event loop, so
+small requests keep answering while large transfers are processed.
+Threads rather than processes: hashlib, zlib, zstd and base64 release the GIL
+on large buffers, and copying payloads to another process would cost about
+as much as the work itself.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolSaturated(Exception):
+    """The pool has no room for another request (answered with 503)"""
+
+
+class WorkPool:
+    """
+    Thread pool with a bounded backlog
+    At most workers tasks run and max_queue more wait. admit() refuses a new
+    request while the pool is that full; run() always accepts the next step
+    of a request that was admitted already, so transfers are never cut off
+    halfway through
+    """
+
+    def __init__(self, workers, max_queue):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pending = 0  # Tasks running or waiting (only touched on the event loop)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cpu")
+
+    @property
+    def saturated(self):
+        return self.pending >= self.workers + self.max_queue
+
+    def admit(self):
+        """Raise PoolSaturated if a new request should be turned away"""
+        if self.saturated:
+            raise PoolSaturated()
+
+    def _done(self, _):
+        self.pending -= 1
+
+    async def run(self, func, *args):
+        """Run func(*args) in the pool and return its result"""
+        future = asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        self.pending += 1
+        # Counted until the thread finishes, even if the request is cancelled first
+        future.add_done_callback(self._done)
+        return await future
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)